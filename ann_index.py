@@ -0,0 +1,189 @@
+"""
+Digital Protection - Approximate Nearest Neighbour Index Types
+ingest_data.py builds the index as a flat (exact) FAISS index and, if asked,
+converts it to HNSW, IVF-PQ or 8-bit scalar quantization. The type and its
+parameters are recorded in index_meta.json, which the app reads to set the
+search-time knobs (efSearch / nprobe).
+
+    flat   exact full scan; fine up to tens of thousands of chunks
+    hnsw   graph search, near-exact recall, ~1.2x flat memory
+    ivfpq  clustered + product-quantized, 10-30x smaller, needs training
+    sq8    8-bit scalar quantized full scan, 4x smaller than flat
+"""
+
+import io
+import os
+import json
+import math
+import zipfile
+
+import faiss
+import numpy as np
+
+INDEX_META_FILE = "index_meta.json"
+INDEX_TYPES = ("flat", "hnsw", "ivfpq", "sq8")
+
+DEFAULT_PARAMS = {
+    "flat": {},
+    "hnsw": {"m": 32, "ef_construction": 200, "ef_search": 64},
+    "ivfpq": {"nlist": 0, "pq_m": 48, "pq_bits": 8, "nprobe": 0},  # 0 = pick from corpus size
+    "sq8": {},
+}
+
+MIN_TRAINING_POINTS_PER_LIST = 39  # FAISS warns below this
+MAX_TRAINING_POINTS = 200_000
+
+
+def auto_nlist(count):
+    """~4 * sqrt(n) lists, limited so each gets enough training points"""
+    nlist = int(4 * math.sqrt(count))
+    return max(1, min(nlist, count // MIN_TRAINING_POINTS_PER_LIST, 65536))
+
+
+def auto_nprobe(nlist):
+    return max(1, min(nlist, round(math.sqrt(nlist))))
+
+
+def _pq_subquantizers(dim, wanted):
+    """Largest divisor of dim not above wanted (PQ needs equal sub-vectors)"""
+    for m in range(min(wanted, dim), 0, -1):
+        if dim % m == 0:
+            return m
+    return 1
+
+
+def build_ann_index(vectors, index_type="flat", params=None, ids=None):
+    """Build an index over vectors (row i stays position i); returns (index, meta)
+
+    With ids, the index is wrapped in an IndexIDMap and search returns ids[i]
+    instead of i. Raises ValueError if there are too few vectors to train
+    index_type.
+    """
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type '{index_type}' (choose from {', '.join(INDEX_TYPES)})")
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    count, dim = vectors.shape
+    params = {**DEFAULT_PARAMS[index_type], **(params or {})}
+    search = {}
+
+    if index_type == "flat":
+        index = faiss.IndexFlatL2(dim)
+    elif index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, int(params["m"]))
+        index.hnsw.efConstruction = int(params["ef_construction"])
+        search["ef_search"] = int(params["ef_search"])
+    elif index_type == "ivfpq":
+        nlist = int(params["nlist"]) or auto_nlist(count)
+        if count < nlist * MIN_TRAINING_POINTS_PER_LIST or count < 2 ** int(params["pq_bits"]):
+            raise ValueError(f"IVF-PQ needs at least {max(nlist * MIN_TRAINING_POINTS_PER_LIST, 2 ** int(params['pq_bits']))} "
+                             f"chunks to train, have {count}")
+        pq_m = _pq_subquantizers(dim, int(params["pq_m"]))
+        index = faiss.IndexIVFPQ(faiss.IndexFlatL2(dim), dim, nlist, pq_m, int(params["pq_bits"]))
+        params.update(nlist=nlist, pq_m=pq_m)
+        search["nprobe"] = int(params["nprobe"]) or auto_nprobe(nlist)
+    else:
+        index = faiss.IndexScalarQuantizer(dim, faiss.ScalarQuantizer.QT_8bit)
+
+    if not index.is_trained:
+        sample = vectors
+        if count > MAX_TRAINING_POINTS:
+            rows = np.random.default_rng(0).choice(count, MAX_TRAINING_POINTS, replace=False)
+            sample = vectors[np.sort(rows)]
+        index.train(sample)
+    if ids is not None:
+        index = faiss.IndexIDMap(index)
+        index.add_with_ids(vectors, np.asarray(ids, dtype=np.int64))
+    else:
+        index.add(vectors)
+
+    build = {k: v for k, v in params.items() if k not in ("ef_search", "nprobe")}
+    return index, index_meta(index, index_type, build, search)
+
+
+def index_meta(index, index_type, build=None, search=None):
+    """What index_meta.json records about an index"""
+    return {
+        "type": index_type,
+        "dim": int(index.d),
+        "ntotal": int(index.ntotal),
+        "metric": "l2",
+        "build": build or {},
+        "search": search or {},
+    }
+
+
+def index_type_of(index):
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexIDMap):
+        index = faiss.downcast_index(index.index)
+    if isinstance(index, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(index, faiss.IndexIVF):
+        return "ivfpq"
+    if isinstance(index, faiss.IndexScalarQuantizer):
+        return "sq8"
+    return "flat"
+
+
+def flat_vectors(index):
+    """All vectors in position order, for rebuilding or updating the index
+
+    Exact for flat and HNSW, within quantization error for sq8. IVF-PQ
+    vectors can't be recovered closely enough, so it raises ValueError.
+    """
+    if index_type_of(index) == "ivfpq":
+        raise ValueError("IVF-PQ vectors are lossy; rebuild the index from the source documents")
+    if index.ntotal == 0:
+        return np.zeros((0, index.d), dtype=np.float32)
+    return index.reconstruct_n(0, index.ntotal)
+
+
+def to_flat_index(index):
+    """A flat copy (positions unchanged) that supports add and delete"""
+    if index_type_of(index) == "flat":
+        return index
+    flat = faiss.IndexFlatL2(index.d)
+    flat.add(flat_vectors(index))
+    return flat
+
+
+def configure_search(index, meta=None, fetch_k=10):
+    """Set efSearch / nprobe from the metadata (or sensible defaults); returns them"""
+    index_type = (meta or {}).get("type") or index_type_of(index)
+    search = dict((meta or {}).get("search", {}))
+    parameters = faiss.ParameterSpace()
+    applied = {}
+    if index_type == "hnsw":
+        # efSearch below the number of results requested would cut recall
+        applied["efSearch"] = max(search.get("ef_search", DEFAULT_PARAMS["hnsw"]["ef_search"]), 2 * fetch_k)
+    elif index_type == "ivfpq":
+        nlist = faiss.extract_index_ivf(index).nlist
+        applied["nprobe"] = min(nlist, search.get("nprobe") or auto_nprobe(nlist))
+    for name, value in applied.items():
+        parameters.set_index_parameter(index, name, value)
+    return applied
+
+
+def write_index_meta(index_path, meta):
+    path = os.path.join(index_path, INDEX_META_FILE)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(meta, f, indent=2)
+    os.replace(path + ".tmp", path)
+
+
+def read_index_meta(index_path):
+    """index_meta.json from the index folder (or '<folder>.zip'), or None"""
+    path = os.path.join(index_path, INDEX_META_FILE)
+    if os.path.isdir(index_path):
+        if not os.path.exists(path):
+            return None
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+
+    zip_path = index_path + ".zip"
+    if os.path.exists(zip_path):
+        with zipfile.ZipFile(zip_path, "r") as archive:
+            for name in archive.namelist():
+                if os.path.basename(name) == INDEX_META_FILE:
+                    return json.load(io.TextIOWrapper(archive.open(name), encoding="utf-8"))
+    return None
@@ -1,10 +1,17 @@
 import streamlit as st
 import os
-import re
 import time
-from langchain_community.vectorstores import FAISS
-from langchain_huggingface import HuggingFaceEmbeddings
-from groq import Groq
+from concurrent.futures import ThreadPoolExecutor
+from response_cache import read_index_version
+from request_pipeline import ConnectionWarmer, TimingLog
+from query_rewriter import QueryEmbeddingCache
+from telemetry import MetricsRegistry, start_metrics_server
+from conversation_store import conversation_db_from_env, open_conversation_store
+from chat_pipeline import (
+    INDEX_PATH, BackgroundLoad, ChatPipeline, create_context_builder, create_faq_router, create_groq_client,
+    create_model_router, create_reranker, create_response_cache, greeting, open_retriever,
+    rerank_in_process,
+)
 
 # --- 1. PAGE CONFIG (Must be first) ---
 st.set_page_config(
@@ -226,192 +233,177 @@ st.html("""
 </script>
 """)
 
-# --- 3. LOAD KNOWLEDGE BASE ---
+
+# --- 3. METRICS ENDPOINT ---
+METRICS_PORT = int(os.environ.get("DP_METRICS_PORT", "9108"))  # 0 disables the endpoint
+
+
 @st.cache_resource
-def load_retriever():
-    try:
-        # Check if we need to unzip the index (for Cloud Deployment)
-        if not os.path.exists("faiss_index") and os.path.exists("faiss_index.zip"):
-            print("Unzipping faiss_index.zip...")
-            import zipfile
-            with zipfile.ZipFile("faiss_index.zip", 'r') as zip_ref:
-                zip_ref.extractall(".")
-            print("Unzipping complete.")
-            
-        embeddings = HuggingFaceEmbeddings(model_name="paraphrase-multilingual-MiniLM-L12-v2")
-        vectorstore = FAISS.load_local(
-            "faiss_index", 
-            embeddings, 
-            allow_dangerous_deserialization=True
-        )
-        return vectorstore.as_retriever(search_kwargs={"k": 4}), None
-    except Exception as e:
-        return None, str(e)
-
-
-retriever, retriever_error = load_retriever()
+def load_metrics():
+    """One registry and /metrics endpoint per process"""
+    registry = MetricsRegistry()
+    if METRICS_PORT:
+        try:
+            start_metrics_server(registry, port=METRICS_PORT)
+            print(f"✓ Metrics at http://127.0.0.1:{METRICS_PORT}/metrics")
+        except OSError as e:
+            print(f"DEBUG: Metrics endpoint not started: {e}")
+    return registry
 
-# --- 4. PATHS ---
-logo_path = "data/logo_transparent.png"
-if not os.path.exists(logo_path):
-    logo_path = None
 
-# --- 5. GROQ CLIENT ---
-client = None
-api_error = None
-try:
-    api_key = st.secrets.get("GROQ_API_KEY", None)
-    if api_key:
-        client = Groq(api_key=api_key)
-    else:
-        api_error = "GROQ_API_KEY not found in secrets"
-except Exception as e:
-    api_error = str(e)
+metrics = load_metrics()
 
-# --- 6. MODEL CONFIGURATION ---
-GROQ_MODEL = "llama-3.3-70b-versatile"
-BACKUP_MODEL = "llama-3.1-8b-instant"  # Faster backup model
+# --- 3.5. LOAD KNOWLEDGE BASE (background) ---
+# The embedding model and index take seconds to load, so they load on a
+# background thread while the header, greeting and history render. The
+# first question waits only for what is still loading (see section 12).
+@st.cache_resource
+def load_reranker(_metrics):
+    """Process-wide: the cross-encoder doesn't change when the index is rebuilt"""
+    return BackgroundLoad("Reranker", create_reranker, _metrics)
 
-# --- 7. GREETINGS ---
-GREETING_EN = """Hello! Welcome to **Digital Protection**.
 
-I am here to help you with your questions.
+def open_knowledge(reranker_load):
+    # DP_RERANK=1 adds the cross-encoder stage: the index opens once it has loaded
+    return open_retriever(INDEX_PATH, reranker_load.result() if reranker_load else None)
 
-How can I help you?"""
 
-GREETING_AR = """<div class="arabic-text">
+# index_version is only used as the cache key: a rebuilt index gets a new
+# version stamp, so the retriever is reloaded without restarting the app
+@st.cache_resource(max_entries=1)
+def load_retriever(index_version, _reranker_load):
+    return BackgroundLoad("Knowledge base", open_knowledge, _reranker_load)
 
-مرحبا! اهلا بك في **Digital Protection**.
 
-انا هنا لمساعدتك في اسئلتك.
+@st.cache_resource
+def load_response_cache():
+    # Similarity threshold, TTL and size are set in chat_pipeline.py
+    return create_response_cache()
 
-كيف يمكنني مساعدتك؟
 
-</div>"""
+index_version = read_index_version(INDEX_PATH)
+reranker_load = load_reranker(metrics) if rerank_in_process() else None
+retriever_load = load_retriever(index_version, reranker_load)
+response_cache = load_response_cache()
 
-# --- 8. SYSTEM INSTRUCTIONS ---
-SYSTEM_INSTRUCTIONS_EN = """You are DP Assistant for Digital Protection, a data protection consultancy in Amman, Jordan.
+# --- 4. PATHS ---
+logo_path = "data/logo_transparent.png"
+if not os.path.exists(logo_path):
+    logo_path = None
 
-LANGUAGE: Respond in ENGLISH only.
+# --- 5. REQUEST THREADS ---
+@st.cache_resource
+def load_request_executor():
+    """Threads that run retrieval and Groq warm-up side by side"""
+    return ThreadPoolExecutor(max_workers=8, thread_name_prefix="dp-request")
 
-RULES:
-1. NO EMOJIS ever
-2. NO LEGAL ADVICE - say "I cannot provide legal advice. Please consult a qualified legal professional."
-3. NO CONTRACTS - say "I cannot generate contracts. Please contact our team."
-4. NO SPECIFIC PRICES - say pricing depends on scope
-5. NO IT SUPPORT for printers, WiFi, hardware
 
-STYLE: Give complete, helpful answers. Use bullet points for lists. Professional but friendly.
+@st.cache_resource
+def load_timing_log():
+    return TimingLog()
 
-SERVICES:
-- Privacy & Compliance: GDPR, ISO 27701, CBJ
-- Security Assessments: Vulnerability scanning, risk analysis
-- Network Security: Firewalls, WAF
-- Identity & Access Management: IAM/PAM
 
-CONTACT: info@dp-technologies.net | +962 790 552 879 | Amman, Jordan"""
+request_executor = load_request_executor()
+timing_log = load_timing_log()
 
-SYSTEM_INSTRUCTIONS_AR = """انت مساعد DP لشركة Digital Protection في عمان، الاردن.
+# --- 6. GROQ MODELS AND FAQ FAST PATH (background) ---
+# Models, hedging, Groq rate limits and the prompt token budget are set in
+# chat_pipeline.py, shared with the headless API (chat_api.py)
+def open_models(api_key, metrics):
+    """Groq client, its connection warmer and the model router
 
-اللغة: رد بالعربية فقط.
+    Built once per process: every session and rerun shares the same pooled,
+    keep-alive HTTP connections, and the router's latency histograms,
+    breakers and rate limits see every session
+    """
+    client = create_groq_client(api_key)
+    return ConnectionWarmer(client), create_model_router(client, metrics)
 
-القواعد:
-1. بدون رموز تعبيرية ابدا
-2. بدون استشارات قانونية - قل "لا استطيع تقديم استشارات قانونية. يرجى استشارة محام مختص."
-3. بدون عقود - قل "لا استطيع انشاء عقود. يرجى التواصل مع فريقنا."
-4. بدون اسعار محددة - قل التسعير يعتمد على نطاق المشروع
-5. بدون دعم تقني للطابعات والواي فاي
 
-الاسلوب: قدم اجابات كاملة ومفيدة. استخدم النقاط للقوائم. مهني وودود.
+def open_faq_router(retriever_load, metrics):
+    """Intent centroids need the embedding model, so this waits for the knowledge base"""
+    retriever = retriever_load.result()
+    if retriever is None:
+        raise RuntimeError(f"no knowledge base ({retriever_load.error})")
+    return create_faq_router(retriever, metrics)
 
-الخدمات:
-- الخصوصية والامتثال: GDPR، ISO 27701، البنك المركزي الاردني
-- تقييمات الامن: فحص الثغرات، تحليل المخاطر
-- امن الشبكات: جدران الحماية، WAF
-- ادارة الهوية والوصول: IAM/PAM
 
-التواصل: info@dp-technologies.net | +962 790 552 879 | عمان، الاردن"""
+@st.cache_resource
+def load_models(api_key, _metrics):
+    return BackgroundLoad("Groq models", open_models, api_key, _metrics)
 
-# --- 9. HELPER FUNCTIONS ---
-def is_arabic(text):
-    """Detect if text contains Arabic characters"""
-    arabic_pattern = re.compile(r'[\u0600-\u06FF\u0750-\u077F\u08A0-\u08FF]+')
-    return bool(arabic_pattern.search(text))
 
-def clean_response(answer, is_arabic_response=False):
-    """Clean up the response text"""
-    # Remove robotic labels
-    labels = ["Direct answer:", "Key Points:", "Key Considerations:", "Next Step:", 
-              "Response:", "Answer:", "الاجابة:", "النقاط الرئيسية:", "الخطوة التالية:"]
-    for label in labels:
-        answer = answer.replace(label, "")
-    
-    # Remove emojis
-    emoji_pattern = re.compile("["
-        u"\U0001F600-\U0001F64F"
-        u"\U0001F300-\U0001F5FF"
-        u"\U0001F680-\U0001F6FF"
-        u"\U0001F1E0-\U0001F1FF"
-        u"\U00002702-\U000027B0"
-        u"\U000024C2-\U0001F251"
-        "]+", flags=re.UNICODE)
-    answer = emoji_pattern.sub('', answer)
-    
-    # Clean whitespace
-    while "\n\n\n" in answer:
-        answer = answer.replace("\n\n\n", "\n\n")
-    
-    answer = answer.strip()
-    
-    # Wrap Arabic in RTL div
-    if is_arabic_response:
-        answer = f'<div class="arabic-text">{answer}</div>'
-    
-    return answer
+@st.cache_resource
+def load_faq_router(_retriever_load, _metrics):
+    return BackgroundLoad("FAQ fast path", open_faq_router, _retriever_load, _metrics)
 
-def get_fallback_response(prompt, is_arabic_lang):
-    """Get a fallback response when API fails"""
-    prompt_lower = prompt.lower()
-    fallback = FALLBACK_AR if is_arabic_lang else FALLBACK_EN
-    
-    if any(word in prompt_lower for word in ["service", "خدم", "offer", "تقدم"]):
-        return fallback["services"]
-    elif any(word in prompt_lower for word in ["price", "cost", "سعر", "تكلف", "كم"]):
-        return fallback["pricing"]
-    elif any(word in prompt_lower for word in ["where", "location", "اين", "موقع"]):
-        return fallback["location"]
+
+models_load = None
+api_error = None
+try:
+    api_key = st.secrets.get("GROQ_API_KEY", None)
+    if api_key:
+        models_load = load_models(api_key, metrics)
     else:
-        return fallback["default"]
-
-# --- 10. FALLBACK RESPONSES ---
-FALLBACK_EN = {
-    "services": "We offer cybersecurity and compliance services including GDPR, ISO 27701, CBJ compliance, security assessments, and identity management. Contact us at info@dp-technologies.net for details.",
-    "pricing": "Pricing depends on the scope of your project. We offer fixed-price, time and materials, and retainer options. Contact info@dp-technologies.net for a quote.",
-    "location": "We are located in Amman, Jordan. Contact us at info@dp-technologies.net or +962 790 552 879.",
-    "default": "Thank you for your message. For detailed assistance, please contact our team at info@dp-technologies.net or +962 790 552 879."
-}
-
-FALLBACK_AR = {
-    "services": "نقدم خدمات الامن السيبراني والامتثال بما في ذلك GDPR و ISO 27701 والبنك المركزي الاردني وتقييمات الامن. تواصل معنا على info@dp-technologies.net",
-    "pricing": "التسعير يعتمد على نطاق مشروعك. نقدم خيارات السعر الثابت والوقت والمواد والاشتراك. تواصل معنا للحصول على عرض سعر.",
-    "location": "نحن في عمان، الاردن. تواصل معنا على info@dp-technologies.net او +962 790 552 879",
-    "default": "شكرا لرسالتك. للمساعدة التفصيلية، يرجى التواصل مع فريقنا على info@dp-technologies.net او +962 790 552 879"
-}
-
-# --- 11. INITIALIZE SESSION STATE ---
-if "messages" not in st.session_state:
-    st.session_state.messages = []
-    
+        api_error = "GROQ_API_KEY not found in secrets"
+except Exception as e:
+    api_error = str(e)
+
+faq_load = load_faq_router(retriever_load, metrics)
+context_builder = create_context_builder()
+
+# --- 7. CHAT PIPELINE ---
+def build_pipeline():
+    """Pipeline over whatever has loaded; blocks while a background load is still running"""
+    connection_warmer, model_router = (models_load.result() if models_load else None) or (None, None)
+    return ChatPipeline(
+        retriever=retriever_load.result(),
+        model_router=model_router,
+        context_builder=context_builder,
+        response_cache=response_cache,
+        faq_router=faq_load.result(),
+        index_version=index_version,
+        executor=request_executor,
+        connection_warmer=connection_warmer,
+        timing_log=timing_log,
+        metrics=metrics,
+    )
+
+
+# --- 8. INITIALIZE SESSION STATE ---
+# History is kept in the process-wide conversation store, not in session
+# state: only its newest messages stay in memory, idle conversations are
+# evicted, and DP_CONVERSATION_DB keeps the full history in SQLite
+RENDER_WINDOW = 20  # Messages drawn per rerun; "Load earlier" adds this many more
+
+
+@st.cache_resource
+def load_conversation_store():
+    return open_conversation_store(conversation_db_from_env())
+
+
+conversations = load_conversation_store()
+
 if "ui_language" not in st.session_state:
     st.session_state.ui_language = "en"
 
-if "greeting_shown" not in st.session_state:
-    st.session_state.greeting_shown = False
+if "history_window" not in st.session_state:
+    st.session_state.history_window = RENDER_WINDOW
 
 if "error_count" not in st.session_state:
     st.session_state.error_count = 0
 
-# --- 12. HEADER WITH LANGUAGE TOGGLE ---
+if "query_embeddings" not in st.session_state:
+    st.session_state.query_embeddings = QueryEmbeddingCache()
+
+conversation = conversations.get(st.session_state.get("conversation_id"))
+if conversation is None:
+    # A new session, or one evicted after sitting idle (without a
+    # database its history is gone, so it starts again)
+    conversation = conversations.create(st.session_state.ui_language)
+    st.session_state.conversation_id = conversation.id
+
+# --- 9. HEADER WITH LANGUAGE TOGGLE ---
 query_params = st.query_params
 is_embedded = query_params.get("embed", "false").lower() == "true"
 
@@ -426,14 +418,12 @@ if not is_embedded:
         if st.session_state.ui_language == "en":
             if st.button("بالعربية", key="lang_toggle"):
                 st.session_state.ui_language = "ar"
-                st.session_state.messages = []
-                st.session_state.greeting_shown = False
+                conversations.set_language(conversation, "ar")
                 st.rerun()
         else:
             if st.button("English", key="lang_toggle"):
                 st.session_state.ui_language = "en"
-                st.session_state.messages = []
-                st.session_state.greeting_shown = False
+                conversations.set_language(conversation, "en")
                 st.rerun()
 else:
     col1, col2 = st.columns([5, 1])
@@ -441,137 +431,69 @@ else:
         if st.session_state.ui_language == "en":
             if st.button("عربي", key="lang_toggle_embed"):
                 st.session_state.ui_language = "ar"
-                st.session_state.messages = []
-                st.session_state.greeting_shown = False
+                conversations.set_language(conversation, "ar")
                 st.rerun()
         else:
             if st.button("EN", key="lang_toggle_embed"):
                 st.session_state.ui_language = "en"
-                st.session_state.messages = []
-                st.session_state.greeting_shown = False
+                conversations.set_language(conversation, "en")
                 st.rerun()
 
-# --- 13. SHOW GREETING ---
-if not st.session_state.greeting_shown:
-    if st.session_state.ui_language == "ar":
-        st.session_state.messages = [{"role": "assistant", "content": GREETING_AR}]
-    else:
-        st.session_state.messages = [{"role": "assistant", "content": GREETING_EN}]
-    st.session_state.greeting_shown = True
+# --- 10. LOAD EARLIER MESSAGES ---
+def show_earlier_messages():
+    st.session_state.history_window += RENDER_WINDOW
+
+
+visible_messages, earlier_count = conversations.window(conversation, st.session_state.history_window)
+if earlier_count:
+    earlier_label = "عرض الرسائل السابقة" if st.session_state.ui_language == "ar" else "Load earlier messages"
+    st.button(f"{earlier_label} ({earlier_count})", key="load_earlier", on_click=show_earlier_messages)
+
+# --- 11. DISPLAY CHAT HISTORY ---
+# The greeting isn't stored: it opens the conversation in the current language
+if not earlier_count:
+    with st.chat_message("assistant", avatar=logo_path):
+        st.markdown(greeting(st.session_state.ui_language), unsafe_allow_html=True)
 
-# --- 14. DISPLAY CHAT HISTORY ---
-for msg in st.session_state.messages:
+for msg in visible_messages:
     avatar = logo_path if msg["role"] == "assistant" else None
     with st.chat_message(msg["role"], avatar=avatar):
         st.markdown(msg["content"], unsafe_allow_html=True)
 
-# --- 15. CHAT INPUT ---
+# --- 12. CHAT INPUT ---
 input_placeholder = "اكتب رسالتك..." if st.session_state.ui_language == "ar" else "Type your message..."
+loading_text = "جار التحميل..." if st.session_state.ui_language == "ar" else "Getting ready..."
 
 if prompt := st.chat_input(input_placeholder):
-    st.session_state.messages.append({"role": "user", "content": prompt})
+    history = conversations.history(conversation)
+    conversations.append(conversation, "user", prompt)
     with st.chat_message("user"):
         st.markdown(prompt)
     
     with st.chat_message("assistant", avatar=logo_path):
-        response_placeholder = st.empty()
-        
-        # 1. Search knowledge base
-        context = ""
-        if retriever:
-            try:
-                # ENHANCED RAG: Include recent chat history
-                chat_history = "\n".join([f"{m['role']}: {m['content']}" for m in st.session_state.messages[-3:]])
-                enhanced_prompt = f"Chat History: {chat_history}\nCurrent Question: {prompt}"
-                
-                search_results = retriever.invoke(enhanced_prompt)
-                context = "\n".join([doc.page_content for doc in search_results])
-            except Exception as e:
-                print(f"DEBUG: Retriever failed: {e}")
-        
-        # 2. Check language
-        user_is_ar = is_arabic(prompt) or st.session_state.ui_language == "ar"
-        system_prompt = SYSTEM_INSTRUCTIONS_AR if user_is_ar else SYSTEM_INSTRUCTIONS_EN
-
-        # 3. Call API with Fallback Logic
-        stream = None
-        used_model = GROQ_MODEL
-        
-        try:
-            # Prepare Enforced Prompt (Guardrails)
-            enforced_prompt = f"""Answer the question using ONLY the information in the CONTEXT below.
-
-RULES:
-1. NO emojis
-2. Give a COMPLETE answer using the context - include all relevant details
-3. Only say "contact us" for pricing questions or if info is truly not in context
-4. Answer in {'Arabic' if user_is_ar else 'English'} only
-
-CONTEXT:
-{context}
-
-QUESTION:
-{prompt}
-
-ANSWER:"""
-
-            # Build Message Chain
-            api_messages = []
-            for m in st.session_state.messages[-5:]:
-                 api_messages.append({"role": m["role"], "content": m["content"]})
-            
-            api_messages.append({"role": "user", "content": enforced_prompt})
-
-            # Add System Instructions
-            system_reinforcement = system_prompt + "\n\nREMEMBER: Answer using the context provided. No emojis."
-            api_messages.append({"role": "system", "content": system_reinforcement})
-
-            # Try Primary Model
-            stream = client.chat.completions.create(
-                messages=api_messages,
-                model=GROQ_MODEL,
-                temperature=0.1,
-                stream=True,
-            )
-        except Exception as e:
-            print(f"Primary model failed: {e}")
-            # Try Backup Model
-            try:
-                stream = client.chat.completions.create(
-                    messages=api_messages,
-                    model=BACKUP_MODEL,
-                    temperature=0.1,
-                    stream=True,
-                )
-                used_model = BACKUP_MODEL
-            except Exception as e2:
-                print(f"Backup model also failed: {e2}")
-                stream = None
-
-        # 4. Process Stream or Show Static Fallback
-        if stream:
-            try:
-                full_response = ""
-                last_update_time = time.time()
-                
-                for chunk in stream:
-                    if chunk.choices[0].delta.content:
-                        full_response += chunk.choices[0].delta.content
-                        current_time = time.time()
-                        if current_time - last_update_time > 0.05:
-                            display_text = clean_response(full_response, user_is_ar)
-                            response_placeholder.markdown(display_text + "▌", unsafe_allow_html=True)
-                            last_update_time = current_time
-                
-                final_answer = clean_response(full_response, user_is_ar)
-                response_placeholder.markdown(final_answer, unsafe_allow_html=True)
-                st.session_state.messages.append({"role": "assistant", "content": final_answer})
-            
-            except Exception as e:
-                 print(f"Stream processing error: {e}")
-                 fallback = get_fallback_response(prompt, user_is_ar)
-                 response_placeholder.markdown(fallback)
+        # A question asked right after startup waits here for the background
+        # loads (the spinner only appears if that takes over half a second)
+        if any(load is not None and load.state == "loading" for load in (retriever_load, models_load, faq_load)):
+            wait_started = time.perf_counter()
+            with st.spinner(loading_text):
+                pipeline = build_pipeline()
+            print(f"DEBUG: Waited {time.perf_counter() - wait_started:.2f}s for startup to finish")
         else:
-            # If both models failed
-            fallback = get_fallback_response(prompt, user_is_ar)
-            response_placeholder.markdown(fallback)
\ No newline at end of file
+            pipeline = build_pipeline()
+
+        response_placeholder = st.empty()
+        last_update_time = time.time()
+
+        # FAQ / cache / RAG + Groq / static fallback: see ChatPipeline.run
+        for event in pipeline.run(prompt, history, st.session_state.ui_language,
+                                  st.session_state.query_embeddings):
+            if event.kind == "delta":
+                current_time = time.time()
+                if current_time - last_update_time > 0.05:
+                    response_placeholder.markdown(event.display + "▌", unsafe_allow_html=True)
+                    last_update_time = current_time
+            elif event.outcome == "static_fallback":
+                response_placeholder.markdown(event.display)
+            else:
+                response_placeholder.markdown(event.display, unsafe_allow_html=True)
+                conversations.append(conversation, "assistant", event.display)
\ No newline at end of file
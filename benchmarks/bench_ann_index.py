@@ -0,0 +1,119 @@
+"""
+Benchmark: recall vs latency vs memory for each ANN index type
+
+Builds flat, HNSW, IVF-PQ and SQ8 indexes (ann_index.build_ann_index) over
+synthetic clustered, normalized 384-d vectors (the size of
+paraphrase-multilingual-MiniLM-L12-v2), so it needs no model download.
+Recall@k is measured against the exact flat results; latency is for one
+query at a time, as the app searches. Each index is swept over its search
+knob (efSearch / nprobe); "*" marks what configure_search picks at load.
+Run from the repo root:
+    python -m benchmarks.bench_ann_index [--sizes 10000 100000 1000000]
+
+1M vectors need ~3 GB of RAM, and HNSW takes around ten minutes to build.
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+import faiss
+import numpy as np
+
+from ann_index import INDEX_TYPES, build_ann_index, configure_search
+
+DIM = 384
+CLUSTERS = 1000
+KNOB_SWEEP = {
+    "hnsw": ("efSearch", (16, 32, 64, 128, 256)),
+    "ivfpq": ("nprobe", (4, 16, 32, 64, 128)),
+}
+
+
+def make_vectors(count, seed, centers):
+    """Topic clusters plus noise, normalized like sentence embeddings"""
+    rng = np.random.default_rng(seed)
+    vectors = np.empty((count, DIM), dtype=np.float32)
+    for start in range(0, count, 100_000):
+        rows = min(100_000, count - start)
+        block = centers[rng.integers(0, len(centers), rows)]
+        block += rng.normal(scale=0.6 / np.sqrt(DIM), size=(rows, DIM)).astype(np.float32)
+        vectors[start:start + rows] = block / np.linalg.norm(block, axis=1, keepdims=True)
+    return vectors
+
+
+def index_bytes(index):
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, "index.faiss")
+        faiss.write_index(index, path)
+        return os.path.getsize(path)
+
+
+def measure(index, queries, truth, k):
+    found = []
+    times = []
+    for row in range(len(queries)):
+        started = time.perf_counter()
+        _, positions = index.search(queries[row:row + 1], k)
+        times.append(time.perf_counter() - started)
+        found.append(positions[0])
+    recall = np.mean([len(set(f) & set(t)) / k for f, t in zip(found, truth)])
+    return recall, np.percentile(times, 50) * 1000, np.percentile(times, 95) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000])
+    parser.add_argument("--types", nargs="+", choices=INDEX_TYPES, default=list(INDEX_TYPES))
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10, help="Recall@k (the app's fetch_k)")
+    args = parser.parse_args()
+
+    centers = np.random.default_rng(0).normal(size=(CLUSTERS, DIM)).astype(np.float32)
+    centers /= np.linalg.norm(centers, axis=1, keepdims=True)
+
+    print(f"{'chunks':>8} {'index':>6} {'knob':>13} {'recall@' + str(args.k):>9} "
+          f"{'p50 ms':>8} {'p95 ms':>8} {'MB':>9} {'build s':>8}")
+    for size in args.sizes:
+        vectors = make_vectors(size, 1, centers)
+        queries = make_vectors(args.queries, 2, centers)
+        exact = faiss.IndexFlatL2(DIM)
+        exact.add(vectors)
+        _, truth = exact.search(queries, args.k)
+        del exact
+
+        for index_type in args.types:
+            started = time.perf_counter()
+            try:
+                index, meta = build_ann_index(vectors, index_type)
+            except ValueError as e:
+                print(f"{size:>8} {index_type:>6} skipped: {e}")
+                continue
+            build_seconds = time.perf_counter() - started
+            megabytes = index_bytes(index) / 1e6
+
+            auto = configure_search(index, meta, args.k)
+            settings = [auto]
+            if index_type in KNOB_SWEEP:
+                name, values = KNOB_SWEEP[index_type]
+                settings += [{name: v} for v in values if v != auto[name]]
+                settings.sort(key=lambda s: s[name])
+
+            for setting in settings:
+                parameters = faiss.ParameterSpace()
+                for name, value in setting.items():
+                    parameters.set_index_parameter(index, name, value)
+                recall, p50, p95 = measure(index, queries, truth, args.k)
+                knob = ", ".join(f"{name}={value}" for name, value in setting.items()) or "-"
+                if setting is auto and index_type in KNOB_SWEEP:
+                    knob += "*"
+                print(f"{size:>8} {index_type:>6} {knob:>13} {recall:>9.3f} "
+                      f"{p50:>8.3f} {p95:>8.3f} {megabytes:>9.1f} {build_seconds:>8.1f}")
+            del index
+        del vectors
+    print("* = picked automatically at load (configure_search)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""
+Benchmark: chunking before and after token-sized, sentence-aligned chunks
+
+Splits the same corpus with the old character splitter (800 chars, 150
+overlap) and with ingest_data.py's chunker, then builds an index from each.
+Reports chunk count, chunk size in embedding-model tokens (and how many are
+too long for the model, so their tail is never embedded), text duplicated by
+overlap, near-duplicate chunks, index bytes on disk, and the prompt tokens
+of k retrieved chunks.
+
+Chunk sizes use the embedding model's tokenizer when it is in the local
+Hugging Face cache, else the rough estimate. Building the indexes needs the
+embedding model too (no network).
+Run from the repo root:
+    python -m benchmarks.bench_chunking [--data data] [--k 4]
+"""
+
+import argparse
+import contextlib
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+os.environ.setdefault("HF_HUB_OFFLINE", "1")
+
+import ingest_data
+from benchmarks.run_suite import write_corpus
+from context_builder import estimate_tokens
+from ingest_data import drop_near_duplicates, load_text_file, tag_chunks, token_counter, update_knowledge_base
+
+MODEL_MAX_TOKENS = 128  # paraphrase-multilingual-MiniLM-L12-v2 truncates beyond this
+LEGACY_SPLITTER = {"chunk_size": 800, "chunk_overlap": 150,
+                   "separators": ["\n\n", "\n", ".", "!", "?", ",", " ", ""]}
+
+
+def legacy_split_documents(documents):
+    """The character splitter ingest_data.py used before"""
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+    splitter = RecursiveCharacterTextSplitter(length_function=len, add_start_index=True, **LEGACY_SPLITTER)
+    chunks = []
+    for document in documents:
+        chunks.extend(tag_chunks(document, splitter.split_documents([document])))
+    return chunks
+
+
+def duplicated_share(documents, chunks):
+    """Share of chunk characters that repeat text of an earlier chunk of the same document"""
+    texts = {document.metadata["source"]: document.page_content for document in documents}
+    spans = {}
+    for chunk in chunks:
+        source = chunk.metadata["source"]
+        previous = spans.setdefault(source, [])
+        start = texts[source].find(chunk.page_content, previous[-1][0] if previous else 0)
+        previous.append((start, start + len(chunk.page_content)))
+    total = covered = 0
+    for intervals in spans.values():
+        end = 0
+        for start, stop in sorted(intervals):
+            total += stop - start
+            covered += max(0, stop - max(start, end))
+            end = max(end, stop)
+    return 1 - covered / total if total else 0.0
+
+
+def index_bytes(data_folder, split, dedupe):
+    """Bytes on disk of an index built with this splitter"""
+    folder = tempfile.mkdtemp(prefix="dp-chunking-")
+    original = ingest_data.split_documents, ingest_data.DEDUPE_CHUNKS
+    ingest_data.split_documents, ingest_data.DEDUPE_CHUNKS = split, dedupe
+    try:
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            update_knowledge_base(data_folder=data_folder, index_path=folder)
+        return sum(os.path.getsize(os.path.join(folder, name)) for name in os.listdir(folder))
+    finally:
+        ingest_data.split_documents, ingest_data.DEDUPE_CHUNKS = original
+        shutil.rmtree(folder, ignore_errors=True)
+
+
+def measure(documents, data_folder, split, dedupe, k):
+    count, _ = token_counter()
+    chunks = split(documents)
+    kept, _, duplicates = drop_near_duplicates(chunks, set())
+    if dedupe:
+        chunks = kept
+    # The model adds a start and an end token to every chunk
+    sizes = np.array([count(chunk.page_content) + 2 for chunk in chunks])
+    return {
+        "chunks": len(chunks),
+        "sizes": sizes,
+        "over_limit": float(np.mean(sizes > MODEL_MAX_TOKENS)),
+        "duplicated": duplicated_share(documents, chunks),
+        "near_duplicates": len(duplicates),
+        "prompt_tokens": k * np.mean([estimate_tokens(chunk.page_content) for chunk in chunks]),
+        "index_bytes": index_bytes(data_folder, split, dedupe),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--data", help="Folder of .txt files (default: the bilingual fixture corpus)")
+    parser.add_argument("--k", type=int, default=4, help="Chunks per prompt")
+    args = parser.parse_args()
+
+    folder = tempfile.mkdtemp(prefix="dp-chunking-data-")
+    try:
+        data_folder = args.data
+        if data_folder is None:
+            data_folder = os.path.join(folder, "data")
+            write_corpus(data_folder, 1)
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            documents = []
+            for name in sorted(os.listdir(data_folder)):
+                if name.endswith(".txt"):
+                    documents.extend(load_text_file(os.path.join(data_folder, name)) or [])
+        before = measure(documents, data_folder, legacy_split_documents, False, args.k)
+        after = measure(documents, data_folder, ingest_data.split_documents, True, args.k)
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+    print(f"{len(documents)} documents, chunk sizes in {token_counter()[1]} tokens\n")
+    print(f"{'':<30} {'before':>12} {'after':>12}")
+    rows = [
+        ("chunks", lambda r: f"{r['chunks']}"),
+        ("tokens p50", lambda r: f"{np.median(r['sizes']):.0f}"),
+        ("tokens p95", lambda r: f"{np.percentile(r['sizes'], 95):.0f}"),
+        ("tokens max", lambda r: f"{r['sizes'].max()}"),
+        (f"over {MODEL_MAX_TOKENS} tokens (cut off)", lambda r: f"{r['over_limit']:.0%}"),
+        ("text duplicated by overlap", lambda r: f"{r['duplicated']:.1%}"),
+        ("near-duplicate chunks", lambda r: f"{r['near_duplicates']}"),
+        ("index bytes", lambda r: f"{r['index_bytes']:,}"),
+        (f"prompt tokens ({args.k} chunks)", lambda r: f"{r['prompt_tokens']:.0f}"),
+    ]
+    for label, value in rows:
+        print(f"{label:<30} {value(before):>12} {value(after):>12}")
+    print("\nnear-duplicate chunks: found before, skipped after")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+Benchmark: query-embedding backends (torch vs ONNX vs int8 ONNX)
+
+Each backend runs in a fresh process so load time and peak RSS are not
+polluted by the others. For every backend it reports model load time,
+single-query latency, peak RSS, cosine similarity to the torch vectors and
+recall@4 on faiss_index/ (overlap with torch's top 4).
+Run from the repo root after `python ingest_data.py`:
+    python -m benchmarks.bench_embedding_backends [--backends torch onnx onnx-int8]
+"""
+
+import argparse
+import multiprocessing
+import os
+import resource
+import time
+
+import faiss
+import numpy as np
+
+from embedding_backends import BACKEND_MODEL_KWARGS, DEFAULT_BACKEND, cosine_similarities
+
+QUERIES = [
+    "What services do you offer?",
+    "Where are you located?",
+    "Do you help with ISO 27701 certification?",
+    "CBJ compliance requirements",
+    "Can you assess our WAF configuration?",
+    "IAM/PAM implementation",
+    "How much does a GDPR assessment cost?",
+    "ما هي الخدمات التي تقدمونها؟",
+    "اين يقع مكتبكم؟",
+    "هل تساعدون في الامتثال لتعليمات البنك المركزي الاردني؟",
+    "كم تكلفة تقييم الثغرات؟",
+    "ادارة الهوية والوصول",
+]
+
+
+def _run_backend(backend, repeats, results):
+    started = time.perf_counter()
+    from embedding_backends import create_embeddings
+    embeddings = create_embeddings(backend)
+    embeddings.embed_query("warm up")
+    load_seconds = time.perf_counter() - started
+
+    latencies = []
+    for _ in range(repeats):
+        for query in QUERIES:
+            t = time.perf_counter()
+            embeddings.embed_query(query)
+            latencies.append(time.perf_counter() - t)
+
+    results[backend] = {
+        "load_seconds": load_seconds,
+        "latencies": latencies,
+        "vectors": [embeddings.embed_query(query) for query in QUERIES],
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare embedding backends")
+    parser.add_argument("--backends", nargs="+", default=list(BACKEND_MODEL_KWARGS))
+    parser.add_argument("--repeats", type=int, default=20)
+    parser.add_argument("--index", default="faiss_index")
+    parser.add_argument("--k", type=int, default=4)
+    args = parser.parse_args()
+
+    backends = [DEFAULT_BACKEND] + [b for b in args.backends if b != DEFAULT_BACKEND]
+    context = multiprocessing.get_context("spawn")
+    with context.Manager() as manager:
+        results = manager.dict()
+        for backend in backends:
+            process = context.Process(target=_run_backend, args=(backend, args.repeats, results))
+            process.start()
+            process.join()
+            if backend not in results:
+                print(f"{backend}: failed (is sentence-transformers[onnx] installed?)")
+        results = dict(results)
+
+    index = None
+    index_file = os.path.join(args.index, "index.faiss")
+    if os.path.exists(index_file):
+        index = faiss.read_index(index_file)
+    reference = results.get(DEFAULT_BACKEND)
+
+    print(f"{'backend':>10} {'load s':>7} {'p50 ms':>7} {'p95 ms':>7} {'RSS MB':>7} "
+          f"{'min cos':>8} {'recall@' + str(args.k):>9}")
+    for backend in backends:
+        if backend not in results:
+            continue
+        result = results[backend]
+        latencies = np.array(result["latencies"]) * 1000
+        min_cos = recall = float("nan")
+        if reference:
+            min_cos = float(cosine_similarities(result["vectors"], reference["vectors"]).min())
+            if index is not None:
+                _, ours = index.search(np.array(result["vectors"], dtype=np.float32), args.k)
+                _, theirs = index.search(np.array(reference["vectors"], dtype=np.float32), args.k)
+                recall = float(np.mean([len(set(a) & set(b)) / args.k for a, b in zip(ours, theirs)]))
+        print(f"{backend:>10} {result['load_seconds']:>7.2f} {np.percentile(latencies, 50):>7.2f} "
+              f"{np.percentile(latencies, 95):>7.2f} {result['peak_rss_mb']:>7.0f} {min_cos:>8.4f} {recall:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
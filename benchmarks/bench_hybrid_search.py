@@ -0,0 +1,77 @@
+"""
+Benchmark: dense-only vs fused (dense + BM25 + RRF) search latency
+
+Uses a synthetic bilingual corpus and random 384-d vectors (the size of
+paraphrase-multilingual-MiniLM-L12-v2), so it needs no model download.
+Query embedding is excluded: it is the same for both paths.
+Run from the repo root:
+    python -m benchmarks.bench_hybrid_search [--chunks 5000]
+"""
+
+import argparse
+import random
+import tempfile
+import time
+
+import faiss
+import numpy as np
+
+from sparse_index import build_sparse_index, load_sparse_index, reciprocal_rank_fusion
+
+DIM = 384
+VOCAB = ("data protection privacy compliance gdpr iso 27701 cbj waf iam pam firewall risk "
+         "assessment vulnerability scanning policy audit consulting amman jordan "
+         "حماية البيانات الخصوصية الامتثال تقييم المخاطر جدران الحماية ادارة الهوية").split()
+QUERIES = ["ISO 27701", "CBJ compliance", "WAF", "IAM/PAM", "ما هي خدمات الامتثال",
+           "vulnerability scanning price", "جدران الحماية"]
+
+
+def make_corpus(chunks, seed=0):
+    rng = random.Random(seed)
+    return [" ".join(rng.choice(VOCAB) for _ in range(rng.randint(60, 140))) for _ in range(chunks)]
+
+
+def percentile_ms(samples, pct):
+    return float(np.percentile(samples, pct)) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--chunks", type=int, default=5000)
+    parser.add_argument("--repeats", type=int, default=200)
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--fetch-k", type=int, default=10)
+    args = parser.parse_args()
+
+    texts = make_corpus(args.chunks)
+    vectors = np.random.default_rng(0).random((args.chunks, DIM), dtype=np.float32)
+    index = faiss.IndexFlatL2(DIM)
+    index.add(vectors)
+
+    with tempfile.TemporaryDirectory() as folder:
+        build_sparse_index(texts, [str(i) for i in range(len(texts))], folder)
+        sparse = load_sparse_index(folder)
+
+    query_vectors = np.random.default_rng(1).random((len(QUERIES), DIM), dtype=np.float32)
+    dense_times, fused_times = [], []
+    for r in range(args.repeats):
+        q = r % len(QUERIES)
+        vector = query_vectors[q:q + 1]
+
+        started = time.perf_counter()
+        index.search(vector, args.k)
+        dense_times.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        _, found = index.search(vector, args.fetch_k)
+        hits = sparse.search(QUERIES[q], args.fetch_k)
+        reciprocal_rank_fusion([found[0].tolist(), [p for p, _ in hits]])[:args.k]
+        fused_times.append(time.perf_counter() - started)
+
+    print(f"chunks={args.chunks} k={args.k} fetch_k={args.fetch_k}")
+    for name, samples in (("dense only", dense_times), ("dense+bm25", fused_times)):
+        print(f"{name:>12}: p50={percentile_ms(samples, 50):.2f}ms p95={percentile_ms(samples, 95):.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
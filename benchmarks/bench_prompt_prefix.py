@@ -0,0 +1,155 @@
+"""
+Benchmark: prompt layout and prefix caching, before and after prompt_assembly.py
+
+Runs the same multi-turn conversations (the labelled questions in
+benchmarks/fixtures/queries.json, interleaved across conversations as live
+traffic is) through two prompt layouts against the stub Groq client with
+its prefix cache on:
+    before  rules rebuilt in the user message, system message last
+    after   prompt_assembly.py: static system message first
+Context is the fixture paragraphs sharing the most words with the question,
+so no embedding model is needed.
+
+Reports prompt tokens per section, cached prefix tokens, distinct first
+messages and stub time to first token. The prefill rate is made up; only the
+difference between layouts matters.
+Run from the repo root:
+    python -m benchmarks.bench_prompt_prefix [--conversations 8] [--turns 4]
+"""
+
+import argparse
+import json
+import os
+import random
+import re
+import time
+
+import numpy as np
+
+from benchmarks.stub_groq import ModelProfile, StubGroqClient
+from chat_pipeline import PROMPT_ASSEMBLER, SYSTEM_INSTRUCTIONS_AR, SYSTEM_INSTRUCTIONS_EN, create_context_builder
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures")
+CORPUS_FILES = ("corpus_en.txt", "corpus_ar.txt")
+MODEL = "stub-primary"
+WORD = re.compile(r"\w+")
+
+
+def legacy_messages(language, question, history, chunks, context_builder):
+    """The layout chat_pipeline.py used before: rules rebuilt every turn, system message last"""
+    system_prompt = SYSTEM_INSTRUCTIONS_AR if language == "ar" else SYSTEM_INSTRUCTIONS_EN
+    template = f"""Answer the question using ONLY the information in the CONTEXT below.
+
+RULES:
+1. NO emojis
+2. Give a COMPLETE answer using the context - include all relevant details
+3. Only say "contact us" for pricing questions or if info is truly not in context
+4. Answer in {'Arabic' if language == 'ar' else 'English'} only
+
+CONTEXT:
+{{context}}
+
+QUESTION:
+{question}
+
+ANSWER:"""
+    system_reinforcement = system_prompt + "\n\nREMEMBER: Answer using the context provided. No emojis."
+    built = context_builder.build(system_reinforcement + template, history, chunks)
+    messages = list(built.history)
+    messages.append({"role": "user", "content": template.replace("{context}", built.context, 1)})
+    messages.append({"role": "system", "content": system_reinforcement})
+    return messages, None
+
+
+def assembled_messages(language, question, history, chunks, context_builder):
+    assembled = PROMPT_ASSEMBLER.build(language, question, history, chunks, context_builder)
+    return assembled.messages, assembled.report
+
+
+def load_paragraphs():
+    paragraphs = []
+    for name in CORPUS_FILES:
+        with open(os.path.join(FIXTURES, name), encoding="utf-8") as f:
+            paragraphs.extend(p.strip() for p in f.read().split("\n\n") if len(p.strip()) > 40)
+    return paragraphs
+
+
+def top_paragraphs(question, paragraphs, k):
+    words = set(WORD.findall(question.lower()))
+    scored = sorted(paragraphs, key=lambda p: -len(words & set(WORD.findall(p.lower()))))
+    return [(text, 1.0 - rank / k) for rank, text in enumerate(scored[:k])]
+
+
+def run_layout(layout, conversations, paragraphs, k, profile):
+    client = StubGroqClient(default_profile=profile, prefix_cache=True)
+    context_builder = create_context_builder()
+    histories = [[] for _ in conversations]
+    rows = []
+    # Turn by turn across all conversations, as concurrent users arrive
+    for turn in range(max(len(questions) for _, questions in conversations)):
+        for (language, questions), history in zip(conversations, histories):
+            if turn >= len(questions):
+                continue
+            question = questions[turn]
+            messages, report = layout(language, question, history, top_paragraphs(question, paragraphs, k),
+                                      context_builder)
+            started = time.perf_counter()
+            stream = client.chat.completions.create(messages=messages, model=MODEL, stream=True)
+            answer = ""
+            for chunk in stream:
+                if not answer:
+                    ttft = time.perf_counter() - started
+                answer += chunk.choices[0].delta.content
+            history += [{"role": "user", "content": question}, {"role": "assistant", "content": answer}]
+            rows.append({"ttft": ttft, "first": json.dumps(messages[0], ensure_ascii=False),
+                         "report": report, **client.last_usage})
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--conversations", type=int, default=8)
+    parser.add_argument("--turns", type=int, default=4, help="Questions per conversation")
+    parser.add_argument("--k", type=int, default=4, help="Context paragraphs per question")
+    parser.add_argument("--ttft-ms", type=float, default=20, help="Stub time to first token with nothing to prefill")
+    parser.add_argument("--prefill-rate", type=float, default=4000, help="Stub prefill tokens per second")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    with open(os.path.join(FIXTURES, "queries.json"), encoding="utf-8") as f:
+        queries = json.load(f)
+    rng = random.Random(args.seed)
+    conversations = []
+    for i in range(args.conversations):
+        language = ("en", "ar")[i % 2]
+        pool = [item["query"] for item in queries if item["language"] == language]
+        conversations.append((language, rng.sample(pool, min(args.turns, len(pool)))))
+    paragraphs = load_paragraphs()
+    profile = ModelProfile(ttft_seconds=args.ttft_ms / 1000, tokens_per_second=0,
+                           prefill_tokens_per_second=args.prefill_rate)
+
+    for language, prefix in PROMPT_ASSEMBLER.prefixes.items():
+        print(f"Static prefix '{language}': {prefix.tokens} tokens (sha {prefix.sha})")
+    before = run_layout(legacy_messages, conversations, paragraphs, args.k, profile)
+    after = run_layout(assembled_messages, conversations, paragraphs, args.k, profile)
+
+    print(f"\n{len(before)} requests per layout\n")
+    print(f"{'':<28} {'before':>10} {'after':>10}")
+    rows = [
+        ("prompt tokens p50", lambda r: f"{np.median([x['prompt_tokens'] for x in r]):.0f}"),
+        ("cached prefix tokens p50", lambda r: f"{np.median([x['cached_tokens'] for x in r]):.0f}"),
+        ("cached share", lambda r: f"{sum(x['cached_tokens'] for x in r) / sum(x['prompt_tokens'] for x in r):.0%}"),
+        ("distinct first messages", lambda r: f"{len({x['first'] for x in r})}"),
+        ("stub ttft p50 (ms)", lambda r: f"{np.median([x['ttft'] for x in r]) * 1000:.0f}"),
+        ("stub ttft p95 (ms)", lambda r: f"{np.percentile([x['ttft'] for x in r], 95) * 1000:.0f}"),
+    ]
+    for label, value in rows:
+        print(f"{label:<28} {value(before):>10} {value(after):>10}")
+
+    print("\nPrompt tokens per section (after, p50):")
+    for section in ("prefix", "history", "context", "question", "total"):
+        print(f"  {section:<10} {np.median([x['report'][section] for x in after]):>6.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""
+Benchmark: app.py startup - import time, first paint and first answer
+
+Every measurement runs in a fresh interpreter, so nothing is imported or
+cached yet:
+    imports       python -X importtime of the modules app.py imports at the
+                  top, slowest packages first
+    first paint   the first full run of app.py (CSS, header, greeting,
+                  history) under Streamlit's AppTest
+    first answer  a question asked right after that run (or --think-seconds
+                  later); it waits for whatever is still loading in the
+                  background
+
+Without a GROQ_API_KEY the answer is the static fallback, so "first answer"
+is startup wait + FAQ/retrieval. The embedding model must be in the local
+Hugging Face cache (no network). Point --app-dir at another checkout (e.g.
+an older commit) to compare before and after.
+Run from the repo root:
+    python -m benchmarks.bench_startup [--runs 3] [--top 12]
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+import numpy as np
+
+APP_IMPORTS = "import streamlit; import chat_pipeline, request_pipeline, response_cache, query_rewriter, telemetry"
+HEAVY_MODULES = ("torch", "sentence_transformers", "transformers", "langchain_huggingface",
+                 "langchain_community", "faiss", "groq")
+
+PAINT_PROBE = r"""
+import json, sys, time
+from streamlit.testing.v1 import AppTest
+started = time.perf_counter()
+at = AppTest.from_file("app.py", default_timeout=600)
+at.run()
+paint = time.perf_counter() - started
+time.sleep(float(sys.argv[2]))
+started = time.perf_counter()
+at.chat_input[0].set_value(sys.argv[1]).run()
+answer = time.perf_counter() - started
+print("RESULT " + json.dumps({"paint": paint, "answer": answer, "errors": [str(e.value) for e in at.exception]}))
+"""
+
+
+def child_env():
+    env = dict(os.environ, DP_METRICS_PORT="0", PYTHONDONTWRITEBYTECODE="1")
+    env.setdefault("HF_HUB_OFFLINE", "1")
+    return env
+
+
+def importtime(app_dir, code):
+    """[(name, cumulative_ms, depth)] from python -X importtime -c code"""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                            cwd=app_dir, env=child_env(), capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or line.count("|") != 2:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if cumulative.strip().isdigit():  # Skips the header row
+            depth = (len(name) - len(name.lstrip()) - 1) // 2
+            rows.append((name.strip(), int(cumulative) / 1000, depth))
+    return rows
+
+
+def import_profile(app_dir, startup_modules):
+    """(total_ms, {package: cumulative_ms}) for the modules app.py imports
+
+    A package's time is that of its most expensive import line, which
+    includes everything it pulled in (so torch also counts under
+    sentence_transformers).
+    """
+    rows = importtime(app_dir, APP_IMPORTS)
+    total = sum(ms for name, ms, depth in rows if depth == 0 and name not in startup_modules)
+    packages = {}
+    for name, ms, _ in rows:
+        package = name.split(".")[0]
+        if package not in startup_modules:
+            packages[package] = max(packages.get(package, 0.0), ms)
+    return total, packages
+
+
+def first_paint(app_dir, question, think_seconds):
+    result = subprocess.run([sys.executable, "-c", PAINT_PROBE, question, str(think_seconds)],
+                            cwd=app_dir, env=child_env(), capture_output=True, text=True)
+    for line in result.stdout.splitlines():
+        if line.startswith("RESULT "):
+            return json.loads(line[len("RESULT "):])
+    raise RuntimeError((result.stderr or result.stdout).strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--app-dir", default=".", help="Checkout to measure (default: this one)")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--top", type=int, default=12, help="Slowest packages to list")
+    parser.add_argument("--question", default="What services do you offer?")
+    parser.add_argument("--think-seconds", type=float, default=0.0,
+                        help="Pause between first paint and the question (default 0: the worst case)")
+    args = parser.parse_args()
+
+    # Modules the interpreter imports before running anything are not app.py's
+    startup_modules = {name.split(".")[0] for name, _, _ in importtime(args.app_dir, "pass")}
+    profiles = [import_profile(args.app_dir, startup_modules) for _ in range(args.runs)]
+    totals = [total for total, _ in profiles]
+    packages = {name: np.median([p.get(name, 0.0) for _, p in profiles]) for name in profiles[0][1]}
+    print(f"Imports at the top of app.py: {np.median(totals):.0f} ms (median of {args.runs})")
+    for name, ms in sorted(packages.items(), key=lambda item: -item[1])[:args.top]:
+        print(f"  {name:<28} {ms:>8.0f} ms")
+    heavy = [name for name in HEAVY_MODULES if name in packages]
+    print(f"  heavy packages imported: {', '.join(heavy) or 'none'}")
+
+    print(f"\n{'run':>4} {'first paint':>12} {'first answer':>13}")
+    paints, answers = [], []
+    for run in range(1, args.runs + 1):
+        timing = first_paint(args.app_dir, args.question, args.think_seconds)
+        paints.append(timing["paint"])
+        answers.append(timing["answer"])
+        print(f"{run:>4} {timing['paint'] * 1000:>10.0f}ms {timing['answer'] * 1000:>11.0f}ms"
+              + (f"  errors: {timing['errors']}" if timing["errors"] else ""))
+    print(f"{'p50':>4} {np.median(paints) * 1000:>10.0f}ms {np.median(answers) * 1000:>11.0f}ms")
+
+
+if __name__ == "__main__":
+    main()
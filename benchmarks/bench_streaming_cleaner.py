@@ -0,0 +1,98 @@
+"""
+Micro-benchmark: per-token cleaning cost while streaming
+
+Compares the old approach (string += and clean_response() on the whole
+answer at every update) with StreamingCleaner, for growing answer lengths.
+Also times chat_pipeline's consumer loop, which turns each cleaned delta into
+a TurnEvent: reading the whole text and display() at every delta, as it used
+to, against yielding what feed() returns and building the display only when
+the UI repaints (every RENDER_EVERY tokens, about app.py's 50 ms at ~400 tokens/s).
+Run from the repo root:
+    python -m benchmarks.bench_streaming_cleaner
+"""
+
+import random
+import time
+
+from chat_pipeline import TurnEvent
+from text_cleaning import LABELS, StreamingCleaner, clean_response
+
+RENDER_EVERY = 20
+
+WORDS = ["data", "protection", "GDPR", "ISO", "27701", "assessment", "حماية", "البيانات",
+         "الامتثال", "\n", "\n\n\n", "-", "😀"] + LABELS
+
+
+def make_tokens(count, seed=0):
+    rng = random.Random(seed)
+    return [rng.choice(WORDS) + " " for _ in range(count)]
+
+
+def bench_full_reclean(tokens, is_arabic):
+    full_response = ""
+    started = time.perf_counter()
+    for token in tokens:
+        full_response += token
+        clean_response(full_response, is_arabic)
+    final = clean_response(full_response, is_arabic)
+    return time.perf_counter() - started, final
+
+
+def bench_streaming(tokens, is_arabic):
+    cleaner = StreamingCleaner(is_arabic)
+    started = time.perf_counter()
+    for token in tokens:
+        cleaner.feed(token)
+    final = cleaner.finish()
+    return time.perf_counter() - started, final
+
+
+def bench_consumer_full_text(tokens, is_arabic):
+    """The stream loop before: whole text and display() read at every delta"""
+    cleaner = StreamingCleaner(is_arabic)
+    sent = 0
+    started = time.perf_counter()
+    for i, token in enumerate(tokens):
+        cleaner.feed(token)
+        text = cleaner.text
+        if len(text) > sent:
+            event = TurnEvent("delta", text[sent:], cleaner.display())
+            sent = len(text)
+            if i % RENDER_EVERY == 0:
+                event.display
+    final = cleaner.finish()
+    return time.perf_counter() - started, final
+
+
+def bench_consumer_deltas(tokens, is_arabic):
+    """The stream loop now: feed()'s delta, display built on repaint only"""
+    cleaner = StreamingCleaner(is_arabic)
+    started = time.perf_counter()
+    for i, token in enumerate(tokens):
+        delta = cleaner.feed(token)
+        if delta:
+            event = TurnEvent("delta", delta, cleaner.display)
+            if i % RENDER_EVERY == 0:
+                event.display
+    final = cleaner.finish()
+    return time.perf_counter() - started, final
+
+
+def main():
+    print(f"{'tokens':>8} {'full re-clean us/token':>24} {'streaming us/token':>20}"
+          f" {'loop before us/token':>22} {'loop after us/token':>21}")
+    for count in (250, 500, 1000, 2000, 4000):
+        tokens = make_tokens(count, seed=count)
+        for is_arabic in (False, True):
+            full_seconds, full_final = bench_full_reclean(tokens, is_arabic)
+            stream_seconds, stream_final = bench_streaming(tokens, is_arabic)
+            before_seconds, before_final = bench_consumer_full_text(tokens, is_arabic)
+            after_seconds, after_final = bench_consumer_deltas(tokens, is_arabic)
+            assert full_final == stream_final == before_final == after_final, \
+                "StreamingCleaner output differs from clean_response"
+        print(f"{count:>8} {full_seconds / count * 1e6:>24.1f} {stream_seconds / count * 1e6:>20.1f}"
+              f" {before_seconds / count * 1e6:>22.1f} {after_seconds / count * 1e6:>21.1f}")
+
+
+if __name__ == "__main__":
+    main()
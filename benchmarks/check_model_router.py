@@ -0,0 +1,79 @@
+"""
+Checks for the hedged model router against the stub Groq client
+
+    censored TTFT   a slow primary that loses every hedge still adds its
+                    TTFT samples, so the adaptive deadline isn't biased low
+    half-open probe after the cooldown an open breaker lets exactly one
+                    call through until that call succeeds or fails
+
+Exits with status 1 if a check fails. Needs no network.
+Run from the repo root:
+    python -m benchmarks.check_model_router
+"""
+
+import sys
+import threading
+import time
+
+from benchmarks.stub_groq import ModelProfile, StubGroqClient
+from model_router import CircuitBreaker, HedgingPolicy, ModelRouter
+
+PRIMARY = "stub-primary"
+BACKUP = "stub-backup"
+
+
+def check_censored_ttft(primary_seconds=0.6, backup_seconds=0.05, turns=2):
+    client = StubGroqClient(profiles={
+        PRIMARY: ModelProfile(ttft_seconds=primary_seconds),
+        BACKUP: ModelProfile(ttft_seconds=backup_seconds),
+    })
+    router = ModelRouter(client, PRIMARY, BACKUP, policy=HedgingPolicy(deadline_seconds=0.1))
+    for _ in range(turns):
+        stream = router.stream([{"role": "user", "content": "QUESTION:\nWhat do you offer?"}])
+        assert stream.model == BACKUP, f"expected the backup to win, got {stream.model}"
+        "".join(stream)
+    # The cancelled primaries report once their first token arrives
+    time.sleep(primary_seconds + 0.2)
+    samples = router.histograms[PRIMARY].total
+    assert samples == turns, f"primary has {samples} TTFT samples after {turns} lost hedges"
+    slowest = router.histograms[PRIMARY].quantile(0.95)
+    assert slowest >= primary_seconds, f"primary p95 {slowest}s is below its {primary_seconds}s TTFT"
+
+
+def check_half_open_probe(callers=16):
+    breaker = CircuitBreaker(failure_threshold=1, cooldown_seconds=0)
+    breaker.record_failure()
+    allowed = []
+    barrier = threading.Barrier(callers)
+
+    def call():
+        barrier.wait()
+        allowed.append(breaker.allow())
+
+    threads = [threading.Thread(target=call) for _ in range(callers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sum(allowed) == 1, f"{sum(allowed)} of {callers} concurrent calls let through while half-open"
+    assert not breaker.allow(), "a second call was let through while the probe is in flight"
+    breaker.record_failure()
+    assert breaker.allow(), "no new probe after the failed probe's cooldown"
+    breaker.record_success()
+    assert breaker.state == breaker.CLOSED and breaker.allow() and breaker.allow(), "breaker did not close"
+
+
+def main():
+    failed = False
+    for check in (check_censored_ttft, check_half_open_probe):
+        try:
+            check()
+            print(f"✓ {check.__name__}")
+        except AssertionError as e:
+            print(f"✗ {check.__name__}: {e}")
+            failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
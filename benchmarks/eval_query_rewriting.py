@@ -0,0 +1,107 @@
+"""
+Offline eval: transcript-style retrieval query vs query_rewriter.build_search_query
+
+Replays short conversations against faiss_index/ and checks whether a chunk
+containing the expected text is in the top k, for the old
+"Chat History: ... Current Question: ..." query and for the rewritten one.
+Also reports how often the question starts past MiniLM's 128-token window.
+Run from the repo root (needs the embedding model):
+    python -m benchmarks.eval_query_rewriting [--k 4]
+"""
+
+import argparse
+import time
+
+from context_builder import estimate_tokens
+from knowledge_base import open_knowledge_base
+from query_rewriter import build_search_query
+
+MINILM_MAX_TOKENS = 128
+
+
+def ar(text):
+    return f'<div class="arabic-text">{text}</div>'
+
+
+# (earlier turns, follow-up question, text the right chunk contains)
+CONVERSATIONS = [
+    ([("user", "What is GDPR?"),
+      ("assistant", "The General Data Protection Regulation (GDPR) is a European Union regulation on data "
+                    "protection and privacy. It applies to organizations that process the personal data of "
+                    "EU residents, regardless of where the organization is located.")],
+     "Do you help companies comply with it?", "GDPR"),
+    ([("user", "What is PAM?"),
+      ("assistant", "Privileged Access Management (PAM) is a subset of IAM focused on controlling and "
+                    "monitoring access for users with elevated privileges such as administrators.")],
+     "Why does it matter for compliance?", "least privilege"),
+    ([("user", "What are the CBJ data protection requirements?"),
+      ("assistant", "The Central Bank of Jordan has established data protection and cybersecurity "
+                    "requirements for banks and financial institutions operating in Jordan.")],
+     "How long does a project like that usually take?", "weeks"),
+    ([("user", "What is the difference between vulnerability assessment and penetration testing?"),
+      ("assistant", "A vulnerability assessment systematically scans for weaknesses, while a penetration "
+                    "test actively exploits them to show real-world impact.")],
+     "Which one do you offer?", "Vulnerability"),
+    ([("user", "Where are you located?"),
+      ("assistant", "We are headquartered in Amman, Jordan, and serve clients throughout the MENA region.")],
+     "How can I contact you?", "info@dp-technologies.net"),
+    ([("user", "ما هو ISO 27701؟"),
+      ("assistant", ar("ISO 27701 هو امتداد لـ ISO 27001 يوفر إرشادات لإنشاء نظام إدارة معلومات الخصوصية."))],
+     "هل تساعدون في الحصول عليها؟", "27701"),
+    ([("user", "ما الفرق بين تقييم الثغرات واختبار الاختراق؟"),
+      ("assistant", ar("تقييم الثغرات هو فحص منهجي لنقاط الضعف، واختبار الاختراق يحاكي هجوما حقيقيا."))],
+     "ما الذي تقدمونه في هذا المجال؟", "الثغرات"),
+    ([("user", "ما هي حلول IAM و PAM؟"),
+      ("assistant", ar("حلول IAM و PAM تفرض أقل الامتيازات والمساءلة وتلبي متطلبات الامتثال الرئيسية."))],
+     "لماذا هي مهمة؟", "PAM"),
+    ([("user", "What services do you offer?"),
+      ("assistant", "We offer privacy and regulatory compliance, vulnerability assessments, network "
+                    "security, and identity and access governance.")],
+     "What is your pricing model?", "pricing"),
+    ([("user", "Tell me about your network security services"),
+      ("assistant", "We deliver next-generation firewalls, web application firewalls (WAF) and secure "
+                    "enterprise networks to support your compliance architecture.")],
+     "Who is it ideal for?", "Ideal For"),
+]
+
+
+def transcript_query(history, question):
+    """The query app.py used to embed: last 3 messages (including the question)"""
+    messages = [{"role": role, "content": content} for role, content in history]
+    messages.append({"role": "user", "content": question})
+    chat_history = "\n".join(f"{m['role']}: {m['content']}" for m in messages[-3:])
+    return f"Chat History: {chat_history}\nCurrent Question: {question}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--index", default="faiss_index")
+    parser.add_argument("--k", type=int, default=4)
+    args = parser.parse_args()
+
+    knowledge_base = open_knowledge_base(args.index, k=args.k)
+    results = {"transcript": [], "rewritten": []}
+    for history, question, expected in CONVERSATIONS:
+        messages = [{"role": role, "content": content} for role, content in history]
+        queries = {
+            "transcript": transcript_query(history, question),
+            "rewritten": build_search_query(question, messages),
+        }
+        for name, query in queries.items():
+            started = time.perf_counter()
+            docs, _ = knowledge_base.retrieve(query, sparse_query=question)
+            elapsed = time.perf_counter() - started
+            hit = any(expected.lower() in doc.page_content.lower() for doc in docs)
+            question_offset = estimate_tokens(query[:query.rfind(question)])
+            results[name].append((hit, elapsed, estimate_tokens(query), question_offset >= MINILM_MAX_TOKENS))
+
+    print(f"{len(CONVERSATIONS)} follow-up questions, k={args.k}\n")
+    print(f"{'query':<12}{'recall@k':>10}{'avg ms':>10}{'avg tokens':>12}{'question cut':>14}")
+    for name, rows in results.items():
+        n = len(rows)
+        print(f"{name:<12}{sum(r[0] for r in rows) / n:>10.2f}{sum(r[1] for r in rows) / n * 1000:>10.1f}"
+              f"{sum(r[2] for r in rows) / n:>12.0f}{sum(r[3] for r in rows):>14}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""
+Load test for the headless chat API (chat_api.py)
+
+Starts the API in this process with the stub Groq client (or targets a
+running server with --url) and runs simulated widget users at each
+concurrency level. Each user opens a session and asks --turns questions
+from benchmarks/fixtures/queries.json over SSE, one after another.
+
+Reports throughput, time to first streamed text, full answer time, answer
+outcomes and errors per concurrency level. Retrieval still needs the
+embedding model in the local Hugging Face cache (no network). Set
+DP_CONVERSATION_DB to include SQLite history writes.
+Run from the repo root:
+    python -m benchmarks.load_test_api [--concurrency 1 8 32] [--turns 3]
+    python -m benchmarks.load_test_api --url http://127.0.0.1:8000
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import threading
+import time
+from collections import Counter
+
+import httpx
+import numpy as np
+
+os.environ.setdefault("HF_HUB_OFFLINE", "1")
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures")
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(index_path):
+    """Serve chat_api with the stub Groq client from a background thread; returns its URL"""
+    import uvicorn
+    from chat_api import create_app, create_pipeline
+    from conversation_store import conversation_db_from_env, open_conversation_store
+
+    port = free_port()
+    conversations = open_conversation_store(conversation_db_from_env())
+    app = create_app(create_pipeline(stub_groq=True, index_path=index_path), conversations)
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, name="dp-api", daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return f"http://127.0.0.1:{port}", server
+
+
+async def ask(client, url, session_id, language, message):
+    """One turn over SSE; returns (ttft_seconds, total_seconds, outcome)"""
+    started = time.perf_counter()
+    ttft = None
+    outcome = None
+    event = None
+    async with client.stream("POST", f"{url}/chat", json={
+        "session_id": session_id, "language": language, "message": message,
+    }) as response:
+        response.raise_for_status()
+        async for line in response.aiter_lines():
+            if line.startswith("event: "):
+                event = line[7:]
+            elif line.startswith("data: ") and event in ("delta", "done"):
+                if ttft is None:
+                    ttft = time.perf_counter() - started
+                if event == "done":
+                    outcome = json.loads(line[6:])["outcome"]
+    return ttft, time.perf_counter() - started, outcome
+
+
+async def user(client, url, queries, turns, rng, results):
+    item = rng.choice(queries)
+    language = item["language"]
+    try:
+        response = await client.post(f"{url}/sessions", json={"language": language})
+        session_id = response.json()["session_id"]
+        for _ in range(turns):
+            question = rng.choice([q for q in queries if q["language"] == language])["query"]
+            results.append(await ask(client, url, session_id, language, question))
+    except Exception as e:
+        results.append(e)
+
+
+async def run_level(url, queries, concurrency, turns, seed):
+    rng = random.Random(seed)
+    results = []
+    limits = httpx.Limits(max_connections=concurrency + 4, max_keepalive_connections=concurrency + 4)
+    async with httpx.AsyncClient(timeout=120, limits=limits) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(user(client, url, queries, turns, rng, results) for _ in range(concurrency)))
+        seconds = time.perf_counter() - started
+    return results, seconds
+
+
+def report(concurrency, results, seconds):
+    turns = [r for r in results if not isinstance(r, Exception)]
+    errors = [r for r in results if isinstance(r, Exception)]
+    ttfts = [t for t, _, _ in turns if t is not None]
+    totals = [total for _, total, _ in turns]
+    outcomes = Counter(outcome for _, _, outcome in turns)
+
+    def pct(values, p):
+        return np.percentile(values, p) * 1000 if values else float("nan")
+
+    print(f"{concurrency:>5} {len(turns):>6} {len(turns) / seconds:>7.1f} "
+          f"{pct(ttfts, 50):>8.0f} {pct(ttfts, 95):>8.0f} {pct(totals, 50):>8.0f} {pct(totals, 95):>8.0f} "
+          f"{len(errors):>6}  {dict(outcomes)}")
+    for error in errors[:3]:
+        print(f"        error: {error!r}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--url", help="Test a running chat_api.py instead of starting one")
+    parser.add_argument("--index", default="faiss_index", help="Index for the in-process server")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--turns", type=int, default=3, help="Questions per simulated user")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    with open(os.path.join(FIXTURES, "queries.json"), encoding="utf-8") as f:
+        queries = json.load(f)
+
+    url = args.url
+    if url is None:
+        url, _ = start_server(args.index)
+        print(f"Started chat_api with the stub Groq client at {url}")
+
+    print(f"{'users':>5} {'turns':>6} {'turns/s':>7} {'ttft p50':>8} {'ttft p95':>8} "
+          f"{'all p50':>8} {'all p95':>8} {'errors':>6}  outcomes")
+    for concurrency in args.concurrency:
+        results, seconds = asyncio.run(run_level(url, queries, concurrency, args.turns, args.seed))
+        report(concurrency, results, seconds)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,315 @@
+"""
+Offline benchmark suite: ingestion, retrieval quality and per-stage latency
+
+Builds an index from the bilingual fixture corpus (benchmarks/fixtures/),
+then answers the labelled queries end to end through the app's pipeline
+(query construction, retrieval, context budget, hedged model router,
+streaming cleaner) with a stub Groq client streaming canned tokens.
+
+Reports recall@k and MRR (a query is answered if a top-k chunk contains its
+expected text, so labels survive chunking changes), p50/p95/p99 per stage,
+ingestion throughput and peak memory. --save-baseline stores the results in
+benchmarks/baselines/; later runs are compared with it and exit with status 1
+on a regression.
+
+Needs the embedding model in the local Hugging Face cache (no network).
+Run from the repo root:
+    python -m benchmarks.run_suite [--save-baseline] [--chunk-tokens 128]
+"""
+
+import argparse
+import contextlib
+import json
+import multiprocessing
+import os
+import resource
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+os.environ.setdefault("HF_HUB_OFFLINE", "1")
+
+from benchmarks.stub_groq import ModelProfile, StubGroqClient
+from chat_pipeline import PROMPT_ASSEMBLER
+from context_builder import ContextBuilder
+from embedding_backends import DEFAULT_BACKEND
+from knowledge_base import open_knowledge_base
+from reranker import load_reranker
+from model_router import HedgingPolicy, ModelRouter
+from query_rewriter import build_search_query
+from text_cleaning import StreamingCleaner, clean_response
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures")
+BASELINES = os.path.join(os.path.dirname(__file__), "baselines")
+CORPUS_FILES = ("corpus_en.txt", "corpus_ar.txt")
+PERCENTILES = (50, 95, 99)
+
+PRIMARY = "stub-primary"
+BACKUP = "stub-backup"
+
+# Allowed drift before a result counts as a regression
+QUALITY_TOLERANCE = 0.02         # Absolute, for recall@k and MRR
+LATENCY_TOLERANCE = 0.25         # Relative, p95 per stage
+LATENCY_FLOOR_MS = 1.0           # Ignore differences below this
+THROUGHPUT_TOLERANCE = 0.25      # Relative, ingestion chunks/s and peak memory
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _run_ingest(data_folder, index_path, settings, results):
+    """Child process: so peak memory is ingestion's alone"""
+    import ingest_data
+    from ingest_data import load_manifest, update_knowledge_base
+    ingest_data.CHUNK_TOKENS = settings["chunk_tokens"]
+    # Corpus copies are duplicates on purpose, to measure throughput
+    ingest_data.DEDUPE_CHUNKS = settings["corpus_copies"] == 1
+
+    started = time.perf_counter()
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        update_knowledge_base(batch_size=settings["batch_size"], workers=settings["workers"],
+                              embedding_backend=settings["embedding_backend"],
+                              data_folder=data_folder, index_path=index_path)
+    seconds = time.perf_counter() - started
+    chunks = sum(len(entry["chunks"]) for entry in load_manifest(index_path)["files"].values())
+    results["ingest"] = {
+        "seconds": seconds,
+        "chunks": chunks,
+        "chunks_per_second": chunks / seconds,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def write_corpus(data_folder, copies):
+    """The fixture files, repeated copies times for a bigger ingestion run"""
+    os.makedirs(data_folder)
+    for name in CORPUS_FILES:
+        with open(os.path.join(FIXTURES, name), encoding="utf-8") as f:
+            text = f.read()
+        for copy in range(copies):
+            filename = name if copy == 0 else name.replace(".txt", f"_{copy}.txt")
+            with open(os.path.join(data_folder, filename), "w", encoding="utf-8") as f:
+                # The header keeps chunk ids distinct across copies
+                f.write(f"# Copy {copy}\n\n{text}" if copy else text)
+
+
+def first_relevant_rank(docs, expected):
+    for rank, doc in enumerate(docs, start=1):
+        if expected.lower() in doc.page_content.lower():
+            return rank
+    return None
+
+
+def run_queries(knowledge_base, router, queries, repeats):
+    builder = ContextBuilder()
+    samples = {}
+    ranks = []
+
+    def record(stage, seconds):
+        samples.setdefault(stage, []).append(seconds)
+
+    for repeat in range(repeats):
+        for item in queries:
+            question = item["query"]
+            started = time.perf_counter()
+
+            docs, stages = knowledge_base.retrieve(build_search_query(question, []), sparse_query=question,
+                                                   language=item["language"])
+            for stage, seconds in stages.items():
+                record(stage, seconds)
+            if repeat == 0:
+                ranks.append((item["language"], first_relevant_rank(docs, item["expected"])))
+
+            t = time.perf_counter()
+            assembled = PROMPT_ASSEMBLER.build(item["language"], question, [],
+                                               [(d.page_content, d.metadata.get("relevance", 0.0)) for d in docs],
+                                               builder)
+            messages = assembled.messages
+            record("prompt", time.perf_counter() - t)
+
+            is_ar = item["language"] == "ar"
+            cleaner = StreamingCleaner(is_ar)
+            clean_seconds = 0.0
+            stream_started = time.perf_counter()
+            ttft = None
+            for content in router.stream(messages, temperature=0.1):
+                if ttft is None:
+                    ttft = time.perf_counter() - started
+                t = time.perf_counter()
+                cleaner.feed(content)
+                clean_seconds += time.perf_counter() - t
+            t = time.perf_counter()
+            answer = cleaner.finish()
+            clean_seconds += time.perf_counter() - t
+            record("stream", time.perf_counter() - stream_started)
+            record("ttft", ttft)
+            record("clean_stream", clean_seconds)
+            record("total", time.perf_counter() - started)
+
+            # The whole-answer cleaner the app used before streaming cleanup
+            t = time.perf_counter()
+            clean_response(answer, is_ar)
+            record("clean_response", time.perf_counter() - t)
+
+    return samples, ranks
+
+
+def quality(ranks, k):
+    if not ranks:
+        return {}
+    return {
+        f"recall@{k}": sum(rank is not None for rank in ranks) / len(ranks),
+        "mrr": sum(1.0 / rank for rank in ranks if rank) / len(ranks),
+    }
+
+
+def compare(results, baseline):
+    """Return a list of human-readable regressions"""
+    regressions = []
+    if baseline.get("settings") != results["settings"]:
+        print("NOTE: baseline was recorded with different settings; comparing anyway")
+
+    for scope, scores in results["quality"].items():
+        for metric, value in scores.items():
+            before = baseline.get("quality", {}).get(scope, {}).get(metric)
+            if before is not None and value < before - QUALITY_TOLERANCE:
+                regressions.append(f"{scope} {metric}: {value:.3f} < baseline {before:.3f}")
+
+    for stage, values in results["latency_ms"].items():
+        before = baseline.get("latency_ms", {}).get(stage, {}).get("p95")
+        now = values["p95"]
+        if before is not None and now > before * (1 + LATENCY_TOLERANCE) and now - before > LATENCY_FLOOR_MS:
+            regressions.append(f"{stage} p95: {now:.2f} ms > baseline {before:.2f} ms")
+
+    ingest, before = results["ingest"], baseline.get("ingest", {})
+    if before.get("chunks_per_second") and ingest["chunks_per_second"] < before["chunks_per_second"] * (1 - THROUGHPUT_TOLERANCE):
+        regressions.append(f"ingest: {ingest['chunks_per_second']:.1f} chunks/s < baseline {before['chunks_per_second']:.1f}")
+    for key in ("peak_rss_mb",):
+        for scope in ("ingest", "serving"):
+            now, then = results[scope].get(key), baseline.get(scope, {}).get(key)
+            if now and then and now > then * (1 + THROUGHPUT_TOLERANCE):
+                regressions.append(f"{scope} {key}: {now:.0f} > baseline {then:.0f}")
+    return regressions
+
+
+def print_report(results):
+    settings = results["settings"]
+    print(f"\nSettings: {json.dumps(settings)}")
+    ingest = results["ingest"]
+    print(f"Ingest: {ingest['chunks']} chunks in {ingest['seconds']:.2f}s "
+          f"({ingest['chunks_per_second']:.1f} chunks/s), peak RSS {ingest['peak_rss_mb']:.0f} MB")
+    serving = results["serving"]
+    print(f"Load retriever: {serving['load_seconds']:.2f}s, serving peak RSS {serving['peak_rss_mb']:.0f} MB\n")
+
+    print(f"{'queries':<10}" + "".join(f"{metric:>10}" for metric in results["quality"]["all"]))
+    for scope, scores in results["quality"].items():
+        print(f"{scope:<10}" + "".join(f"{value:>10.3f}" for value in scores.values()))
+
+    print(f"\n{'stage':<16}" + "".join(f"{'p' + str(p) + ' ms':>10}" for p in PERCENTILES))
+    for stage, values in results["latency_ms"].items():
+        print(f"{stage:<16}" + "".join(f"{values['p' + str(p)]:>10.2f}" for p in PERCENTILES))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--repeats", type=int, default=5, help="Passes over the labelled queries")
+    parser.add_argument("--corpus-copies", type=int, default=1, help="Repeat the fixture corpus for ingestion")
+    parser.add_argument("--chunk-tokens", type=int, default=128)
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--embedding-backend", default=DEFAULT_BACKEND)
+    parser.add_argument("--rerank", action="store_true", help="Add the cross-encoder reranking stage")
+    parser.add_argument("--ttft-ms", type=float, default=50, help="Stub time to first token")
+    parser.add_argument("--tokens-per-second", type=float, default=500, help="Stub streaming rate")
+    parser.add_argument("--baseline", default="default", help="Baseline name in benchmarks/baselines/")
+    parser.add_argument("--save-baseline", action="store_true", help="Store this run as the baseline")
+    args = parser.parse_args()
+
+    settings = {
+        "k": args.k,
+        "corpus_copies": args.corpus_copies,
+        "chunk_tokens": args.chunk_tokens,
+        "batch_size": args.batch_size,
+        "workers": args.workers,
+        "embedding_backend": args.embedding_backend,
+        "rerank": args.rerank,
+        "ttft_ms": args.ttft_ms,
+        "tokens_per_second": args.tokens_per_second,
+    }
+    with open(os.path.join(FIXTURES, "queries.json"), encoding="utf-8") as f:
+        queries = json.load(f)
+
+    folder = tempfile.mkdtemp(prefix="dp-bench-")
+    try:
+        data_folder = os.path.join(folder, "data")
+        index_path = os.path.join(folder, "faiss_index")
+        write_corpus(data_folder, args.corpus_copies)
+
+        context = multiprocessing.get_context("spawn")
+        with context.Manager() as manager:
+            shared = manager.dict()
+            process = context.Process(target=_run_ingest, args=(data_folder, index_path, settings, shared))
+            process.start()
+            process.join()
+            if "ingest" not in shared:
+                raise SystemExit("Ingestion failed (is the embedding model in the local cache?)")
+            ingest = dict(shared["ingest"])
+
+        reranker = None
+        if args.rerank:
+            reranker = load_reranker()
+            if reranker is None:
+                raise SystemExit("Reranker failed to load (is the cross-encoder in the local cache?)")
+        started = time.perf_counter()
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            knowledge_base = open_knowledge_base(index_path, args.embedding_backend, k=args.k, reranker=reranker)
+        load_seconds = time.perf_counter() - started
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+    profile = ModelProfile(ttft_seconds=args.ttft_ms / 1000, tokens_per_second=args.tokens_per_second)
+    router = ModelRouter(StubGroqClient(default_profile=profile), PRIMARY, BACKUP,
+                         policy=HedgingPolicy(mode="sequential"))
+    samples, ranks = run_queries(knowledge_base, router, queries, args.repeats)
+
+    results = {
+        "settings": settings,
+        "ingest": ingest,
+        "serving": {"load_seconds": load_seconds, "peak_rss_mb": peak_rss_mb()},
+        "quality": {
+            "all": quality([rank for _, rank in ranks], args.k),
+            "en": quality([rank for language, rank in ranks if language == "en"], args.k),
+            "ar": quality([rank for language, rank in ranks if language == "ar"], args.k),
+        },
+        "latency_ms": {
+            stage: {f"p{p}": float(np.percentile(values, p)) * 1000 for p in PERCENTILES}
+            for stage, values in samples.items()
+        },
+    }
+    print_report(results)
+
+    baseline_path = os.path.join(BASELINES, f"{args.baseline}.json")
+    if args.save_baseline:
+        os.makedirs(BASELINES, exist_ok=True)
+        with open(baseline_path, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"\n✓ Baseline saved to {baseline_path}")
+    elif os.path.exists(baseline_path):
+        with open(baseline_path, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f))
+        if regressions:
+            print("\n✗ Regressions against baseline:")
+            for regression in regressions:
+                print(f"  - {regression}")
+            raise SystemExit(1)
+        print(f"\n✓ No regressions against {baseline_path}")
+    else:
+        print(f"\nNo baseline at {baseline_path} (run with --save-baseline to create one)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""
+A stand-in for groq.Groq that streams canned answers without the network
+
+Implements the two calls the app makes, chat.completions.create(stream=True)
+and models.list(). Time to first token and token rate are configurable per
+model, so hedging and fallback can be exercised too.
+
+With prefix_cache=True the stub also mimics provider-side prompt caching:
+the longest prefix a request shares with an earlier one to the same model
+is free, and every other prompt token adds prefill time to the first token.
+"""
+
+import json
+import re
+import time
+from collections import deque
+from types import SimpleNamespace
+
+from context_builder import estimate_tokens
+
+DEFAULT_ANSWER = (
+    "Digital Protection offers privacy and regulatory compliance, vulnerability assessments, "
+    "network and application security, and identity and access governance. A compliance gap "
+    "assessment usually takes 4 to 8 weeks. Contact info@dp-technologies.net for details."
+)
+DEFAULT_ANSWER_AR = (
+    "تقدم الحماية الرقمية خدمات الامتثال التنظيمي وتقييم الثغرات وأمن الشبكات والتطبيقات وحوكمة "
+    "الهوية والوصول. يستغرق تقييم فجوات الامتثال عادة من 4 إلى 8 أسابيع. تواصل معنا على "
+    "info@dp-technologies.net"
+)
+TOKEN_PATTERN = re.compile(r"\S+\s*")
+
+
+def _shared_prefix(a, b):
+    """Length of the longest common prefix of two strings"""
+    low, high = 0, min(len(a), len(b))
+    while low < high:
+        middle = (low + high + 1) // 2
+        if a[:middle] == b[:middle]:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+class ModelProfile:
+    """How one stubbed model behaves"""
+
+    def __init__(self, ttft_seconds=0.3, tokens_per_second=250.0, fail=False, prefill_tokens_per_second=None):
+        self.ttft_seconds = ttft_seconds
+        self.tokens_per_second = tokens_per_second
+        self.fail = fail
+        self.prefill_tokens_per_second = prefill_tokens_per_second  # Only used with prefix_cache
+
+
+class _Stream:
+    def __init__(self, tokens, profile, prefill_seconds=0.0):
+        self.tokens = tokens
+        self.profile = profile
+        self.prefill_seconds = prefill_seconds
+        self.closed = False
+
+    def __iter__(self):
+        time.sleep(self.profile.ttft_seconds + self.prefill_seconds)
+        if self.profile.fail:
+            raise RuntimeError("stubbed model failure")
+        interval = 1.0 / self.profile.tokens_per_second if self.profile.tokens_per_second else 0.0
+        for i, token in enumerate(self.tokens):
+            if self.closed:
+                return
+            if i and interval:
+                time.sleep(interval)
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=token))])
+
+    def close(self):
+        self.closed = True
+
+
+class StubGroqClient:
+    """groq.Groq look-alike; answers in Arabic when the question is Arabic"""
+
+    def __init__(self, profiles=None, default_profile=None, answer=DEFAULT_ANSWER, answer_ar=DEFAULT_ANSWER_AR,
+                 prefix_cache=False, cache_entries=256):
+        self.profiles = profiles or {}
+        self.default_profile = default_profile or ModelProfile()
+        self.answer = answer
+        self.answer_ar = answer_ar
+        self.requests = 0
+        self.prefix_cache = prefix_cache
+        self.cache_entries = cache_entries
+        self.prompts = {}        # model -> recent serialized prompts
+        self.last_usage = None   # {"prompt_tokens", "cached_tokens"} of the latest request
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+        self.models = SimpleNamespace(list=lambda: SimpleNamespace(data=[]))
+
+    def _create(self, messages, model, temperature=None, stream=False, **kwargs):
+        self.requests += 1
+        profile = self.profiles.get(model, self.default_profile)
+        question = next((m["content"] for m in reversed(messages) if m["role"] == "user"), "")
+        question = question.rsplit("QUESTION:", 1)[-1]  # Ignore the retrieved context
+        answer = self.answer_ar if re.search(r"[؀-ۿ]", question) else self.answer
+        tokens = TOKEN_PATTERN.findall(answer)
+        prefill_seconds = self._prefill(model, messages, profile)
+        if not stream:
+            time.sleep(profile.ttft_seconds + prefill_seconds)
+            message = SimpleNamespace(content=answer)
+            return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+        return _Stream(tokens, profile, prefill_seconds)
+
+    def _prefill(self, model, messages, profile):
+        """Seconds to process the prompt tokens not covered by a cached prefix"""
+        if not self.prefix_cache:
+            return 0.0
+        prompt = json.dumps(messages, ensure_ascii=False)
+        recent = self.prompts.setdefault(model, deque(maxlen=self.cache_entries))
+        cached = max((_shared_prefix(prompt, earlier) for earlier in recent), default=0)
+        recent.append(prompt)
+        prompt_tokens = estimate_tokens(prompt)
+        uncached = prompt_tokens - estimate_tokens(prompt[:cached])
+        self.last_usage = {"prompt_tokens": prompt_tokens, "cached_tokens": prompt_tokens - uncached}
+        rate = profile.prefill_tokens_per_second
+        return uncached / rate if rate else 0.0
@@ -0,0 +1,315 @@
+"""
+Digital Protection - Headless Chat API
+The website widget talks to this instead of an iframe of the Streamlit app:
+no CSS block, footer script or history rerender per interaction, just the
+same ChatPipeline (FAQ fast path, cache, retrieval, prompt budget, model
+fallback, clean_response) with answers streamed as Server-Sent Events.
+
+Usage:
+    GROQ_API_KEY=... python chat_api.py --port 8000
+    python chat_api.py --stub-groq          # canned answers, no network (load tests)
+
+Endpoints:
+    POST /sessions  {"language": "en"}                    -> {"session_id", "greeting"}
+    POST /chat      {"session_id", "message", "language"} -> text/event-stream
+        event: session  data: {"session_id"}       (only when a new session was started)
+        event: delta    data: {"text"}             (cleaned text, appended in order)
+        event: done     data: {"text", "outcome", "direction"}
+    GET  /health
+"""
+
+import os
+import copy
+import json
+import time
+import argparse
+import threading
+import tomllib
+from concurrent.futures import ThreadPoolExecutor
+
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+import uvicorn
+
+from conversation_store import ConversationStore, conversation_db_from_env, open_conversation_store
+from chat_pipeline import (
+    BACKUP_MODEL, GROQ_MODEL, INDEX_PATH, ChatPipeline, create_context_builder, create_faq_router,
+    create_groq_client, create_model_router, create_reranker, create_response_cache, greeting, open_retriever,
+    rerank_in_process, sidecar_from_env,
+)
+from query_rewriter import QueryEmbeddingCache
+from request_pipeline import ConnectionWarmer, TimingLog
+from response_cache import read_index_version
+from telemetry import MetricsRegistry, start_metrics_server
+from text_cleaning import unwrap_arabic
+
+MAX_MESSAGE_CHARS = 2000
+TURN_TIMEOUT_SECONDS = 120   # A session whose answer was never read unlocks after this
+INDEX_CHECK_SECONDS = 5      # How often /chat looks for a re-ingested index
+LANGUAGES = ("en", "ar")
+
+
+class LivePipeline:
+    """The pipeline for the index being served now, as app.py rebuilds it per rerun
+
+    Every INDEX_CHECK_SECONDS the index version is read again, so cached
+    answers from a replaced index are never served. An in-process knowledge
+    base is reopened in the background and swapped in with its version; the
+    sidecar reloads its own, and reports the version it serves.
+    """
+
+    def __init__(self, pipeline, index_path=INDEX_PATH, reranker=None):
+        self.pipeline = pipeline
+        self.index_path = index_path
+        self.reranker = reranker
+        self._checked_at = time.monotonic()
+        self._reloading = False
+        self._lock = threading.Lock()
+
+    def current(self):
+        """The pipeline to answer with (blocking: may read the version file or ping the sidecar)"""
+        with self._lock:
+            now = time.monotonic()
+            if now - self._checked_at < INDEX_CHECK_SECONDS:
+                return self.pipeline
+            self._checked_at = now
+        if sidecar_from_env():
+            self._check_sidecar()
+        else:
+            self._check_local()
+        return self.pipeline
+
+    def _swap(self, **changes):
+        pipeline = copy.copy(self.pipeline)
+        for name, value in changes.items():
+            setattr(pipeline, name, value)
+        self.pipeline = pipeline
+
+    def _check_sidecar(self):
+        try:
+            retriever = self.pipeline.retriever
+            version = retriever.ping()["index_version"] if retriever is not None else None
+            if retriever is not None and version != self.pipeline.index_version:
+                print(f"DEBUG: Sidecar serves index version {version}")
+                self._swap(index_version=version)
+        except Exception as e:
+            print(f"DEBUG: Sidecar index version not read: {e}")
+
+    def _check_local(self):
+        version = read_index_version(self.index_path)
+        if version == self.pipeline.index_version:
+            return
+        with self._lock:
+            if self._reloading:
+                return
+            self._reloading = True
+        threading.Thread(target=self._reload, args=(version,), name="dp-index-reload", daemon=True).start()
+
+    def _reload(self, version):
+        """Open the new index; the old pipeline keeps answering until it is ready"""
+        try:
+            print(f"Loading index '{self.index_path}' (version {version})")
+            self._swap(retriever=open_retriever(self.index_path, self.reranker), index_version=version)
+        except Exception as e:
+            print(f"DEBUG: Index version {version} not loaded, still serving the old one: {e}")
+        finally:
+            self._reloading = False
+
+
+class TurnState:
+    """One turn at a time per session; kept in the conversation's runtime extras"""
+
+    def __init__(self):
+        self.query_embeddings = QueryEmbeddingCache()
+        self.turn_started = None
+        self._lock = threading.Lock()
+
+    def begin_turn(self):
+        """False while another turn is answering; a turn whose stream was never read expires"""
+        with self._lock:
+            now = time.monotonic()
+            if self.turn_started is not None and now - self.turn_started < TURN_TIMEOUT_SECONDS:
+                return False
+            self.turn_started = now
+            return True
+
+    def end_turn(self):
+        with self._lock:
+            self.turn_started = None
+
+
+def _turn_state(conversation):
+    state = conversation.runtime.get("turn")
+    if state is None:
+        state = conversation.runtime["turn"] = TurnState()
+    return state
+
+
+def _language(value):
+    return value if value in LANGUAGES else "en"
+
+
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def create_app(pipeline, conversations=None):
+    """Starlette app serving pipeline (a LivePipeline, or a ChatPipeline over INDEX_PATH);
+    conversations defaults to a memory-only ConversationStore"""
+    live = pipeline if isinstance(pipeline, LivePipeline) else LivePipeline(pipeline)
+    conversations = conversations if conversations is not None else ConversationStore()
+
+    async def health(request):
+        pipeline = live.pipeline
+        return JSONResponse({
+            "status": "ok",
+            "retriever": pipeline.retriever is not None,
+            "index_version": pipeline.index_version,
+            "model_router": pipeline.model_router is not None,
+            "sessions": len(conversations),
+            "sessions_evicted": conversations.evicted,
+        })
+
+    async def create_session(request):
+        body = await _json_body(request)
+        conversation = conversations.create(_language(body.get("language")))
+        return JSONResponse({"session_id": conversation.id, "greeting": greeting(conversation.ui_language)})
+
+    async def chat(request):
+        body = await _json_body(request)
+        message = str(body.get("message") or "").strip()
+        if not message:
+            return JSONResponse({"error": "message is required"}, status_code=400)
+        if len(message) > MAX_MESSAGE_CHARS:
+            return JSONResponse({"error": f"message is longer than {MAX_MESSAGE_CHARS} characters"},
+                                status_code=413)
+
+        conversation = conversations.get(body.get("session_id"))
+        is_new = conversation is None
+        if is_new:
+            conversation = conversations.create(_language(body.get("language")))
+        turn = _turn_state(conversation)
+        if not turn.begin_turn():
+            return JSONResponse({"error": "this session is already answering"}, status_code=409)
+
+        history = conversations.history(conversation)
+        conversations.append(conversation, "user", message)
+
+        def events():
+            # Sync generator: Starlette iterates it in its thread pool, which
+            # suits the pipeline's blocking Groq stream
+            try:
+                if is_new:
+                    yield _sse("session", {"session_id": conversation.id})
+                for event in live.current().run(message, history, conversation.ui_language, turn.query_embeddings):
+                    if event.kind == "delta":
+                        yield _sse("delta", {"text": event.delta})
+                        continue
+                    if event.outcome != "static_fallback":
+                        conversations.append(conversation, "assistant", event.display)
+                    text = unwrap_arabic(event.display)
+                    yield _sse("done", {
+                        "text": text,
+                        "outcome": event.outcome,
+                        "direction": "rtl" if text != event.display else "ltr",
+                    })
+            finally:
+                turn.end_turn()
+
+        return StreamingResponse(events(), media_type="text/event-stream",
+                                 headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+    return Starlette(routes=[
+        Route("/health", health, methods=["GET"]),
+        Route("/sessions", create_session, methods=["POST"]),
+        Route("/chat", chat, methods=["POST"]),
+    ])
+
+
+async def _json_body(request):
+    try:
+        body = await request.json()
+    except ValueError:
+        return {}
+    return body if isinstance(body, dict) else {}
+
+
+def _api_key():
+    """GROQ_API_KEY from the environment, else from .streamlit/secrets.toml"""
+    if os.environ.get("GROQ_API_KEY"):
+        return os.environ["GROQ_API_KEY"]
+    try:
+        with open(os.path.join(".streamlit", "secrets.toml"), "rb") as f:
+            return tomllib.load(f).get("GROQ_API_KEY")
+    except (OSError, tomllib.TOMLDecodeError):
+        return None
+
+
+def create_pipeline(stub_groq=False, metrics=None, index_path=INDEX_PATH):
+    """Load the index, Groq client and routers once, as app.py does per process;
+    returns a LivePipeline that follows re-ingested indexes"""
+    reranker = create_reranker(metrics) if rerank_in_process() else None
+    retriever = None
+    try:
+        retriever = open_retriever(index_path, reranker)
+    except Exception as e:
+        print(f"DEBUG: Knowledge base not loaded: {e}")
+
+    client = None
+    rate_limits = None
+    if stub_groq:
+        # Imported here: the stub is a test fixture, not a runtime dependency
+        from benchmarks.stub_groq import ModelProfile, StubGroqClient
+        client = StubGroqClient({GROQ_MODEL: ModelProfile(), BACKUP_MODEL: ModelProfile(ttft_seconds=0.15)})
+        rate_limits = {}  # The stub has no Groq plan to respect
+        print("✓ Using the stub Groq client")
+    elif _api_key():
+        client = create_groq_client(_api_key())
+    else:
+        print("DEBUG: GROQ_API_KEY not set - every answer will be the static fallback")
+
+    faq_router = None
+    if retriever:
+        try:
+            faq_router = create_faq_router(retriever, metrics)
+        except Exception as e:
+            print(f"DEBUG: FAQ fast path disabled: {e}")
+
+    router_kwargs = {} if rate_limits is None else {"rate_limits": rate_limits}
+    pipeline = ChatPipeline(
+        retriever=retriever,
+        model_router=create_model_router(client, metrics, **router_kwargs) if client else None,
+        context_builder=create_context_builder(),
+        response_cache=create_response_cache(),
+        faq_router=faq_router,
+        index_version=read_index_version(index_path),
+        executor=ThreadPoolExecutor(max_workers=8, thread_name_prefix="dp-request"),
+        connection_warmer=ConnectionWarmer(client) if client else None,
+        timing_log=TimingLog(),
+        metrics=metrics,
+    )
+    return LivePipeline(pipeline, index_path, reranker)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Digital Protection headless chat API (SSE)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--index", default=INDEX_PATH)
+    parser.add_argument("--stub-groq", action="store_true", help="Canned answers instead of Groq (load tests)")
+    parser.add_argument("--metrics-port", type=int, default=int(os.environ.get("DP_METRICS_PORT", "9109")),
+                        help="Prometheus /metrics port, 0 disables it (default 9109)")
+    args = parser.parse_args()
+
+    metrics = MetricsRegistry()
+    if args.metrics_port:
+        start_metrics_server(metrics, port=args.metrics_port)
+        print(f"✓ Metrics at http://127.0.0.1:{args.metrics_port}/metrics")
+    conversations = open_conversation_store(conversation_db_from_env())
+    app = create_app(create_pipeline(args.stub_groq, metrics, args.index), conversations)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,550 @@
+"""
+Digital Protection - Chat Turn Pipeline
+Everything that answers one chat turn, shared by the Streamlit UI (app.py)
+and the headless HTTP/SSE API (chat_api.py): FAQ fast path, response cache,
+retrieval, prompt budget, hedged model routing, streaming cleanup, static
+fallbacks, timings, trace and metrics.
+"""
+
+import os
+import re
+import time
+import threading
+
+from response_cache import SemanticResponseCache
+from model_router import ModelRouter, HedgingPolicy
+from text_cleaning import StreamingCleaner
+from request_pipeline import RequestTimings, format_timings
+from context_builder import ContextBuilder
+from prompt_assembly import PromptAssembler, format_prompt_report
+from query_rewriter import QueryEmbeddingCache, build_search_query, is_follow_up
+from faq_router import FAQ_MARGIN, FAQ_THRESHOLD, FaqRouter
+from reranker import rerank_from_env
+from telemetry import (
+    RequestTrace, faq_collector, log_json, record_turn, reranker_collector, router_collector, scheduler_collector,
+)
+from groq_scheduler import GroqScheduler, ScheduledGroqClient
+
+# The knowledge base (langchain, FAISS, torch via sentence-transformers) and
+# the Groq SDK are imported inside the functions that load them, so app.py
+# can render its first page before any of them have been imported
+
+INDEX_PATH = "faiss_index"
+
+# --- RESPONSE CACHE CONFIGURATION ---
+CACHE_SIMILARITY_THRESHOLD = 0.92  # Cosine similarity needed to replay an answer
+CACHE_TTL_SECONDS = 3600
+CACHE_MAX_ENTRIES = 256
+
+# --- MODEL CONFIGURATION ---
+GROQ_MODEL = "llama-3.3-70b-versatile"
+BACKUP_MODEL = "llama-3.1-8b-instant"  # Faster backup model
+
+# Hedging: start BACKUP_MODEL if GROQ_MODEL has no first token by the deadline
+HEDGE_MODE = "hedge"             # "hedge", "race" or "sequential"
+HEDGE_DEADLINE_SECONDS = 2.0     # Used until enough TTFT samples exist
+BREAKER_FAILURE_THRESHOLD = 3    # Consecutive failures before a model is skipped
+BREAKER_COOLDOWN_SECONDS = 60
+
+# Groq limits per model as (requests/min, tokens/min): the free tier, raise to match your plan
+GROQ_RATE_LIMITS = {
+    GROQ_MODEL: (30, 12000),
+    BACKUP_MODEL: (30, 6000),
+}
+GROQ_MAX_IN_FLIGHT = 16          # Concurrent streams across all sessions
+GROQ_MAX_QUEUE = 64              # More waiting requests than this are refused at once
+GROQ_MAX_WAIT_SECONDS = 10.0     # Longest a request waits for budget before falling back
+
+# --- PROMPT TOKEN BUDGET ---
+PROMPT_TOKEN_BUDGET = 2000     # System prompt + history + chunks + question
+HISTORY_SHARE = 0.35           # Most of what is left after fixed text that history may use
+MAX_HISTORY_MESSAGES = 6       # Older turns are dropped
+RECENT_VERBATIM_MESSAGES = 2   # Older kept turns shrink to their first sentence
+
+# --- GREETINGS ---
+GREETING_EN = """Hello! Welcome to **Digital Protection**.
+
+I am here to help you with your questions.
+
+How can I help you?"""
+
+GREETING_AR = """<div class="arabic-text">
+
+مرحبا! اهلا بك في **Digital Protection**.
+
+انا هنا لمساعدتك في اسئلتك.
+
+كيف يمكنني مساعدتك؟
+
+</div>"""
+
+# --- SYSTEM INSTRUCTIONS ---
+SYSTEM_INSTRUCTIONS_EN = """You are DP Assistant for Digital Protection, a data protection consultancy in Amman, Jordan.
+
+LANGUAGE: Respond in ENGLISH only.
+
+RULES:
+1. NO EMOJIS ever
+2. NO LEGAL ADVICE - say "I cannot provide legal advice. Please consult a qualified legal professional."
+3. NO CONTRACTS - say "I cannot generate contracts. Please contact our team."
+4. NO SPECIFIC PRICES - say pricing depends on scope
+5. NO IT SUPPORT for printers, WiFi, hardware
+
+STYLE: Give complete, helpful answers. Use bullet points for lists. Professional but friendly.
+
+SERVICES:
+- Privacy & Compliance: GDPR, ISO 27701, CBJ
+- Security Assessments: Vulnerability scanning, risk analysis
+- Network Security: Firewalls, WAF
+- Identity & Access Management: IAM/PAM
+
+CONTACT: info@dp-technologies.net | +962 790 552 879 | Amman, Jordan"""
+
+SYSTEM_INSTRUCTIONS_AR = """انت مساعد DP لشركة Digital Protection في عمان، الاردن.
+
+اللغة: رد بالعربية فقط.
+
+القواعد:
+1. بدون رموز تعبيرية ابدا
+2. بدون استشارات قانونية - قل "لا استطيع تقديم استشارات قانونية. يرجى استشارة محام مختص."
+3. بدون عقود - قل "لا استطيع انشاء عقود. يرجى التواصل مع فريقنا."
+4. بدون اسعار محددة - قل التسعير يعتمد على نطاق المشروع
+5. بدون دعم تقني للطابعات والواي فاي
+
+الاسلوب: قدم اجابات كاملة ومفيدة. استخدم النقاط للقوائم. مهني وودود.
+
+الخدمات:
+- الخصوصية والامتثال: GDPR، ISO 27701، البنك المركزي الاردني
+- تقييمات الامن: فحص الثغرات، تحليل المخاطر
+- امن الشبكات: جدران الحماية، WAF
+- ادارة الهوية والوصول: IAM/PAM
+
+التواصل: info@dp-technologies.net | +962 790 552 879 | عمان، الاردن"""
+
+# Built once per process: the same system message bytes open every request
+PROMPT_ASSEMBLER = PromptAssembler({"en": SYSTEM_INSTRUCTIONS_EN, "ar": SYSTEM_INSTRUCTIONS_AR})
+
+# --- FALLBACK RESPONSES ---
+FALLBACK_EN = {
+    "services": "We offer cybersecurity and compliance services including GDPR, ISO 27701, CBJ compliance, security assessments, and identity management. Contact us at info@dp-technologies.net for details.",
+    "pricing": "Pricing depends on the scope of your project. We offer fixed-price, time and materials, and retainer options. Contact info@dp-technologies.net for a quote.",
+    "location": "We are located in Amman, Jordan. Contact us at info@dp-technologies.net or +962 790 552 879.",
+    "default": "Thank you for your message. For detailed assistance, please contact our team at info@dp-technologies.net or +962 790 552 879."
+}
+
+FALLBACK_AR = {
+    "services": "نقدم خدمات الامن السيبراني والامتثال بما في ذلك GDPR و ISO 27701 والبنك المركزي الاردني وتقييمات الامن. تواصل معنا على info@dp-technologies.net",
+    "pricing": "التسعير يعتمد على نطاق مشروعك. نقدم خيارات السعر الثابت والوقت والمواد والاشتراك. تواصل معنا للحصول على عرض سعر.",
+    "location": "نحن في عمان، الاردن. تواصل معنا على info@dp-technologies.net او +962 790 552 879",
+    "default": "شكرا لرسالتك. للمساعدة التفصيلية، يرجى التواصل مع فريقنا على info@dp-technologies.net او +962 790 552 879"
+}
+
+
+# --- HELPER FUNCTIONS ---
+def is_arabic(text):
+    """Detect if text contains Arabic characters"""
+    arabic_pattern = re.compile(r'[\u0600-\u06FF\u0750-\u077F\u08A0-\u08FF]+')
+    return bool(arabic_pattern.search(text))
+
+def get_fallback_response(prompt, is_arabic_lang, intent=None):
+    """Get a fallback response when API fails"""
+    prompt_lower = prompt.lower()
+    fallback = FALLBACK_AR if is_arabic_lang else FALLBACK_EN
+    
+    # Nearest FAQ intent, when the classifier ran (even below its threshold)
+    if intent in fallback:
+        return fallback[intent]
+    if any(word in prompt_lower for word in ["service", "خدم", "offer", "تقدم"]):
+        return fallback["services"]
+    elif any(word in prompt_lower for word in ["price", "cost", "سعر", "تكلف", "كم"]):
+        return fallback["pricing"]
+    elif any(word in prompt_lower for word in ["where", "location", "اين", "موقع"]):
+        return fallback["location"]
+    else:
+        return fallback["default"]
+
+
+# --- SHARED RESOURCES (one of each per process) ---
+def open_retriever(index_path=INDEX_PATH, reranker=None):
+    """The knowledge base: the shared sidecar if DP_SIDECAR_SOCKET is set, else in-process"""
+    # Several app processes on one box can share a single model + index
+    # through embedding_sidecar.py instead of each loading their own copy
+    sidecar_socket = sidecar_from_env()
+    if sidecar_socket:
+        from embedding_sidecar import SidecarKnowledgeBase
+        knowledge_base = SidecarKnowledgeBase(sidecar_socket)
+        knowledge_base.ping()
+        return knowledge_base
+
+    # Reads faiss_index/ (checked against its bundle manifest) or, on
+    # Cloud deployments, faiss_index.zip unpacked once to faiss_index.cache/;
+    # either way the vectors are memory-mapped.
+    # The BM25 index next to it is loaded here too, once per version.
+    # DP_EMBEDDING_BACKEND picks torch (default), onnx or onnx-int8.
+    # reranker (create_reranker) over-fetches and keeps the best k chunks.
+    from knowledge_base import open_knowledge_base
+    from embedding_backends import backend_from_env
+    return open_knowledge_base(index_path, backend_from_env(), k=4, reranker=reranker)
+
+
+def sidecar_from_env():
+    return os.environ.get("DP_SIDECAR_SOCKET")
+
+
+def rerank_in_process():
+    """DP_RERANK=1, unless the sidecar serves the knowledge base: it reranks itself (--rerank)"""
+    return rerank_from_env() and not sidecar_from_env()
+
+
+def create_reranker(metrics=None):
+    """Cross-encoder stage (DP_RERANK=1), or None if it can't load; process-wide,
+    since the model doesn't change when the index is rebuilt"""
+    from reranker import load_reranker
+    reranker = load_reranker()
+    if reranker is not None and metrics is not None:
+        metrics.add_collector(reranker_collector(reranker))
+    return reranker
+
+
+def create_groq_client(api_key):
+    """Pooled, keep-alive HTTP connections shared by every session"""
+    import httpx
+    from groq import Groq
+    http_client = httpx.Client(
+        limits=httpx.Limits(max_connections=50, max_keepalive_connections=20, keepalive_expiry=60),
+        timeout=httpx.Timeout(60.0, connect=5.0),
+    )
+    return Groq(api_key=api_key, http_client=http_client)
+
+
+def create_response_cache():
+    return SemanticResponseCache(
+        similarity_threshold=CACHE_SIMILARITY_THRESHOLD,
+        ttl_seconds=CACHE_TTL_SECONDS,
+        max_entries=CACHE_MAX_ENTRIES,
+    )
+
+
+def create_model_router(client, metrics=None, rate_limits=GROQ_RATE_LIMITS):
+    """Groq scheduler + hedged router; process-wide, since Groq's limits apply
+    to the API key and the latency histograms should see every session"""
+    scheduler = GroqScheduler(
+        rate_limits,
+        max_in_flight=GROQ_MAX_IN_FLIGHT,
+        max_queue=GROQ_MAX_QUEUE,
+        max_wait_seconds=GROQ_MAX_WAIT_SECONDS,
+    )
+    router = ModelRouter(
+        ScheduledGroqClient(client, scheduler),
+        GROQ_MODEL,
+        BACKUP_MODEL,
+        policy=HedgingPolicy(mode=HEDGE_MODE, deadline_seconds=HEDGE_DEADLINE_SECONDS),
+        failure_threshold=BREAKER_FAILURE_THRESHOLD,
+        cooldown_seconds=BREAKER_COOLDOWN_SECONDS,
+    )
+    if metrics is not None:
+        metrics.add_collector(scheduler_collector(scheduler))
+        metrics.add_collector(router_collector(router))
+    return router
+
+
+def create_context_builder():
+    return ContextBuilder(
+        total_budget=PROMPT_TOKEN_BUDGET,
+        history_share=HISTORY_SHARE,
+        max_history_messages=MAX_HISTORY_MESSAGES,
+        recent_verbatim=RECENT_VERBATIM_MESSAGES,
+    )
+
+
+def create_faq_router(retriever, metrics=None):
+    """Intent centroids are embedded once per process"""
+    router = FaqRouter(retriever.embed_queries, threshold=FAQ_THRESHOLD, margin=FAQ_MARGIN)
+    if metrics is not None:
+        metrics.add_collector(faq_collector(router))
+    print(f"✓ FAQ fast path ready (threshold {FAQ_THRESHOLD}, margin {FAQ_MARGIN})")
+    return router
+
+
+def greeting(ui_language):
+    return GREETING_AR if ui_language == "ar" else GREETING_EN
+
+
+# --- STAGED STARTUP ---
+class BackgroundLoad:
+    """Runs load(*args) on a daemon thread so the page renders meanwhile
+
+    state is "loading", "ready" or "failed". result() blocks only for as
+    long as the load still has to run, then returns its value (None if it
+    failed; the error is in .error).
+    """
+
+    def __init__(self, name, load, *args):
+        self.name = name
+        self.value = None
+        self.error = None
+        self.seconds = None
+        self._started = time.perf_counter()
+        self._done = threading.Event()
+        threading.Thread(target=self._run, args=(load, args), name=f"dp-load-{name}", daemon=True).start()
+
+    def _run(self, load, args):
+        try:
+            self.value = load(*args)
+            self.seconds = time.perf_counter() - self._started
+            print(f"✓ {self.name} ready in {self.seconds:.2f}s (background)")
+        except Exception as e:
+            self.error = str(e)
+            self.seconds = time.perf_counter() - self._started
+            print(f"DEBUG: {self.name} failed to load: {e}")
+        finally:
+            self._done.set()
+
+    @property
+    def state(self):
+        if not self._done.is_set():
+            return "loading"
+        return "failed" if self.error is not None else "ready"
+
+    def result(self, timeout=None):
+        self._done.wait(timeout)
+        return self.value
+
+
+# --- CHAT TURN ---
+class TurnEvent:
+    """One step of an answer: "delta" while streaming, then one "done"
+
+    delta: cleaned text added since the previous event
+    display: the whole answer so far, ready to render (Arabic is RTL-wrapped);
+        on "delta" it is only built when read, since that costs O(answer)
+    outcome: on "done" - answer, faq, cache_hit or static_fallback
+    """
+
+    def __init__(self, kind, delta="", display="", outcome=None):
+        self.kind = kind
+        self.delta = delta
+        self._display = display  # The text, or a function returning it
+        self.outcome = outcome
+
+    @property
+    def display(self):
+        if callable(self._display):
+            self._display = self._display()
+        return self._display
+
+
+class ChatPipeline:
+    """Answers chat turns; holds no per-session state, so one serves every session
+
+    Any component may be None (no index, no API key...): the turn then takes
+    the path that doesn't need it, down to the static fallback answer.
+    """
+
+    def __init__(self, retriever=None, model_router=None, context_builder=None, response_cache=None,
+                 faq_router=None, index_version=None, executor=None, connection_warmer=None,
+                 timing_log=None, metrics=None, prompt_assembler=None):
+        self.retriever = retriever
+        self.model_router = model_router
+        self.context_builder = context_builder or create_context_builder()
+        self.prompt_assembler = prompt_assembler or PROMPT_ASSEMBLER
+        self.response_cache = response_cache
+        self.faq_router = faq_router
+        self.index_version = index_version
+        self.executor = executor
+        self.connection_warmer = connection_warmer
+        self.timing_log = timing_log
+        self.metrics = metrics
+
+    def _submit(self, fn, *args, **kwargs):
+        if self.executor is None:
+            return _Finished(fn, *args, **kwargs)
+        return self.executor.submit(fn, *args, **kwargs)
+
+    def run(self, prompt, history, ui_language="en", query_embeddings=None):
+        """Answer prompt, given the conversation before it; yields TurnEvents
+
+        The caller adds the question and the final answer to its own history
+        (the static fallback answer is not meant to be kept).
+        """
+        # Only the opening question of a conversation is answered from the cache;
+        # follow-ups depend on the history and always go through RAG + Groq
+        is_first_question = not any(m["role"] == "user" for m in history)
+        query_embeddings = query_embeddings if query_embeddings is not None else QueryEmbeddingCache()
+        timings = RequestTimings()
+        trace = RequestTrace(first_question=is_first_question)
+        try:
+            yield from self._answer(prompt, history, ui_language, query_embeddings,
+                                    is_first_question, timings, trace)
+        finally:
+            # 7. Record per-stage timings, the JSON trace and metrics
+            stages = timings.finish()
+            if self.timing_log is not None:
+                self.timing_log.add(stages)
+            print(format_timings(stages, self.timing_log))
+            turn_record = trace.finish(stages)
+            log_json(turn_record)
+            if self.metrics is not None:
+                record_turn(self.metrics, turn_record)
+
+    def _answer(self, prompt, history, ui_language, query_embeddings, is_first_question, timings, trace):
+        retriever = self.retriever
+
+        # 0. Detect language and warm the Groq connection
+        user_is_ar = is_arabic(prompt) or ui_language == "ar"
+        cache_language = "ar" if user_is_ar else "en"
+        trace.set(language=cache_language)
+        if self.connection_warmer:
+            self._submit(self.connection_warmer.warm)
+
+        # 1. A standalone question is embedded once, for the FAQ fast path,
+        # the response cache and the search
+        query_vector = None
+        if retriever and (is_first_question or not is_follow_up(prompt)):
+            try:
+                query_vector = query_embeddings.embed(prompt, retriever.embed_query)
+            except Exception as e:
+                print(f"DEBUG: Query embedding failed: {e}")
+
+        direct_answer = None
+        faq_match = None
+        if self.faq_router and query_vector is not None:
+            faq_match = self.faq_router.classify(query_vector)
+            trace.set(faq_intent=faq_match.intent, faq_score=round(faq_match.score, 3))
+            print(f"DEBUG: FAQ intent={faq_match.intent} score={faq_match.score:.3f} "
+                  f"margin={faq_match.margin:.3f} threshold={self.faq_router.threshold} "
+                  f"hit={faq_match.hit} hit_rate={self.faq_router.hit_rate():.1%}")
+            if faq_match.hit:
+                direct_answer = self.faq_router.answer(faq_match.intent, user_is_ar)
+                trace.set(outcome="faq")
+        if (direct_answer is None and query_vector is not None and is_first_question
+                and self.response_cache is not None):
+            try:
+                direct_answer = self.response_cache.lookup(query_vector, cache_language, self.index_version)
+                if direct_answer:
+                    trace.set(outcome="cache_hit")
+            except Exception as e:
+                print(f"DEBUG: Response cache lookup failed: {e}")
+
+        if direct_answer:
+            # Answered without FAISS or Groq
+            yield TurnEvent("done", direct_answer, direct_answer, trace.attributes["outcome"])
+            return
+
+        # 2. Search the knowledge base while the rest of the prompt is prepared
+        retrieval_future = None
+        if retriever:
+            try:
+                # Standalone query: the question plus salient terms from earlier
+                # turns (not the transcript); BM25 matches the question's exact tokens
+                search_query = build_search_query(prompt, history)
+                print(f"DEBUG: Search query: {search_query}")
+                retrieval_started = time.perf_counter()
+                retrieval_future = self._submit(
+                    retriever.retrieve, search_query, sparse_query=prompt, embedding_cache=query_embeddings,
+                    language=cache_language,
+                )
+            except Exception as e:
+                print(f"DEBUG: Retriever failed: {e}")
+
+        # Static system prefix and the history fitted to its share of the token
+        # budget (current question excluded) don't depend on the chunks
+        prompt_started = time.perf_counter()
+        prepared = self.prompt_assembler.prepare(cache_language, prompt, history, self.context_builder)
+        prompt_seconds = time.perf_counter() - prompt_started
+
+        # 3. Wait for the knowledge base search
+        chunks = []
+        if retrieval_future:
+            try:
+                search_results, retrieval_timings = retrieval_future.result()
+                timings.record(retrieval_timings)
+                chunks = [(doc.page_content, doc.metadata.get("relevance", 0.0)) for doc in search_results]
+            except Exception as e:
+                print(f"DEBUG: Retriever failed: {e}")
+                trace.set(retrieval_error=str(e))
+            trace.add_span("retrieval", time.perf_counter() - retrieval_started, retrieval_started)
+            trace.set(chunks=len(chunks))
+
+        # 4. Call API with Fallback Logic
+        stream = None
+        try:
+            if self.model_router is None:
+                raise RuntimeError("No Groq client configured")
+            finish_started = time.perf_counter()
+            # Prefix first, then history, then context and question
+            assembled = prepared.finish(chunks)
+            report = assembled.report
+            print(format_prompt_report(report))
+            prompt_seconds += time.perf_counter() - finish_started
+            trace.add_span("prompt_build", prompt_seconds, prompt_started)
+            trace.set(prompt_tokens=report["total"], prefix_sha=report["prefix_sha"], prompt_sections={
+                section: report[section] for section in ("prefix", "history", "context", "question")})
+
+            # Primary model, hedged with the backup when it is slow or failing
+            stream = self.model_router.stream(assembled.messages, temperature=0.1)
+            trace.set(model=stream.model, fallback_reason=stream.fallback_reason)
+            if stream.fallback_reason:
+                print(f"Using {stream.model}: {stream.fallback_reason}")
+        except Exception as e:
+            print(f"All models failed: {e}")
+            trace.set(error=str(e), fallback_reason=getattr(e, "reason", None))
+            stream = None
+
+        # 5. Process Stream or Show Static Fallback
+        fallback_intent = faq_match.intent if faq_match else None
+        if stream is None:
+            # If both models failed
+            fallback = get_fallback_response(prompt, user_is_ar, fallback_intent)
+            trace.set(outcome="static_fallback")
+            yield TurnEvent("done", fallback, fallback, "static_fallback")
+            return
+
+        # Cleans each delta as it arrives instead of re-cleaning the whole answer
+        cleaner = StreamingCleaner(user_is_ar)
+        try:
+            stream_started = time.perf_counter()
+            tokens_out = 0
+            for content in stream:
+                timings.mark_first_token()
+                tokens_out += 1
+                delta = cleaner.feed(content)
+                if delta:
+                    yield TurnEvent("delta", delta, cleaner.display)
+            sent = len(cleaner.text)
+            final_answer = cleaner.finish()
+            trace.add_span("stream", time.perf_counter() - stream_started, stream_started)
+            trace.set(outcome="answer", tokens_out=tokens_out, chars_out=len(final_answer))
+        except GeneratorExit:
+            # The reader went away (closed tab, dropped SSE connection)
+            stream.close()
+            trace.set(outcome="abandoned")
+            raise
+        except Exception as e:
+            print(f"Stream processing error: {e}")
+            fallback = get_fallback_response(prompt, user_is_ar, fallback_intent)
+            trace.set(outcome="static_fallback", error=str(e))
+            yield TurnEvent("done", fallback, fallback, "static_fallback")
+            return
+
+        # 6. Remember the answer for near-identical opening questions
+        if is_first_question and query_vector is not None and final_answer and self.response_cache is not None:
+            self.response_cache.store(query_vector, cache_language, final_answer, self.index_version)
+        yield TurnEvent("done", cleaner.text[sent:], final_answer, "answer")
+
+
+class _Finished:
+    """Runs fn now; stands in for a Future when there is no executor"""
+
+    def __init__(self, fn, *args, **kwargs):
+        self._error = None
+        self._value = None
+        try:
+            self._value = fn(*args, **kwargs)
+        except Exception as e:
+            self._error = e
+
+    def result(self):
+        if self._error is not None:
+            raise self._error
+        return self._value
@@ -0,0 +1,179 @@
+"""
+Digital Protection - Token-Budgeted Context Assembly
+Decides how much chat history and how many retrieved chunks go into each Groq
+request, so prompts stay within a fixed token budget.
+"""
+
+import math
+import re
+
+ARABIC_CHARS = re.compile(r"[\u0600-\u06FF\u0750-\u077F\u08A0-\u08FF]")
+HTML_TAGS = re.compile(r"</?[a-zA-Z][^>]*>")
+SENTENCE_END = re.compile(r"(?<=[.!?؟])\s")
+
+MIN_OVERLAP_CHARS = 30   # Shorter shared text is coincidence, not splitter overlap
+MAX_OVERLAP_CHARS = 400  # Indexes from the old character splitter overlap 150 chars
+
+
+def estimate_tokens(text):
+    """Rough Llama 3 token count: ~4 chars/token for Latin, ~2.5 for Arabic"""
+    if not text:
+        return 0
+    arabic = len(ARABIC_CHARS.findall(text))
+    return math.ceil(arabic / 2.5 + (len(text) - arabic) / 4)
+
+
+def strip_html(text):
+    """Drop the <div class="arabic-text"> wrappers (and any other tags)"""
+    return HTML_TAGS.sub("", text).strip()
+
+
+def truncate_to_tokens(text, max_tokens):
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    # Binary search on length keeps this exact w.r.t. estimate_tokens
+    low, high = 0, len(text)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if estimate_tokens(text[:middle]) + 1 <= max_tokens:
+            low = middle
+        else:
+            high = middle - 1
+    return text[:low].rstrip() + "…"
+
+
+def first_sentence(text):
+    return SENTENCE_END.split(text, maxsplit=1)[0]
+
+
+def _overlap(left, right):
+    """Length of the longest suffix of left that is a prefix of right"""
+    longest = min(len(left), len(right), MAX_OVERLAP_CHARS)
+    for size in range(longest, MIN_OVERLAP_CHARS - 1, -1):
+        if left.endswith(right[:size]):
+            return size
+    return 0
+
+
+def dedupe_chunks(texts):
+    """Remove repeated chunks and the text shared by overlapping neighbours"""
+    kept = []
+    for text in texts:
+        text = text.strip()
+        if not text or any(text in other for other in kept):
+            continue
+        for other in kept:
+            text = text[_overlap(other, text):]
+            cut = _overlap(text, other)
+            if cut:
+                text = text[:-cut]
+        text = text.strip()
+        if len(text) >= MIN_OVERLAP_CHARS:
+            kept.append(text)
+    return kept
+
+
+class BuiltContext:
+    def __init__(self, history, context, report):
+        self.history = history    # [{"role", "content"}] oldest first
+        self.context = context    # Retrieved chunks joined for the prompt
+        self.report = report      # Token estimate per section
+
+
+class FittedHistory:
+    """The part of a build that doesn't need the retrieved chunks; finish() adds them"""
+
+    def __init__(self, builder, fixed, available, messages, tokens):
+        self.builder = builder
+        self.fixed = fixed
+        self.available = available
+        self.messages = messages
+        self.tokens = tokens
+
+    def finish(self, chunks):
+        kept_chunks, chunk_tokens = self.builder._fit_chunks(chunks, self.available - self.tokens)
+        report = {
+            "fixed": self.fixed,
+            "history": self.tokens,
+            "history_messages": len(self.messages),
+            "chunks": chunk_tokens,
+            "chunks_kept": len(kept_chunks),
+            "chunks_retrieved": len(chunks),
+            "total": self.fixed + self.tokens + chunk_tokens,
+        }
+        return BuiltContext(self.messages, "\n\n".join(kept_chunks), report)
+
+
+class ContextBuilder:
+    """Fit history and retrieved chunks into a fixed prompt token budget
+
+    fixed_text (system prompt, rules and question) is always sent; what is
+    left goes to history (at most history_share of it) and then to chunks.
+    The newest recent_verbatim history messages are kept as written, older
+    ones shrink to their first sentence, and anything beyond that is dropped.
+    Chunks are (text, relevance) pairs; they are deduplicated and then
+    dropped, or the last one trimmed, from the least relevant end.
+    """
+
+    def __init__(self, total_budget=2000, history_share=0.35, max_history_messages=6,
+                 recent_verbatim=2, per_message_tokens=250):
+        self.total_budget = total_budget
+        self.history_share = history_share
+        self.max_history_messages = max_history_messages
+        self.recent_verbatim = recent_verbatim
+        self.per_message_tokens = per_message_tokens
+
+    def _fit_history(self, messages, budget):
+        # Whatever precedes the first question is just the greeting
+        while messages and messages[0]["role"] != "user":
+            messages = messages[1:]
+        messages = messages[-self.max_history_messages:]
+
+        fitted = []
+        used = 0
+        for age, message in enumerate(reversed(messages)):
+            content = strip_html(message["content"])
+            if age >= self.recent_verbatim:
+                content = first_sentence(content)
+            content = truncate_to_tokens(content, self.per_message_tokens)
+            if used + estimate_tokens(content) > budget:
+                # The newest turn matters most: keep a shortened copy rather than nothing
+                if fitted or budget - used < 40:
+                    break
+                content = truncate_to_tokens(content, budget - used)
+            cost = estimate_tokens(content)
+            fitted.append({"role": message["role"], "content": content})
+            used += cost
+        fitted.reverse()
+        return fitted, used
+
+    def _fit_chunks(self, chunks, budget):
+        ranked = sorted(chunks, key=lambda chunk: chunk[1], reverse=True)
+        kept = []
+        used = 0
+        for text in dedupe_chunks([text for text, _ in ranked]):
+            cost = estimate_tokens(text)
+            if used + cost > budget:
+                remaining = budget - used
+                # Only worth including a partial chunk if a useful piece fits
+                if remaining >= 60:
+                    text = truncate_to_tokens(text, remaining)
+                    kept.append(text)
+                    used += estimate_tokens(text)
+                break
+            kept.append(text)
+            used += cost
+        return kept, used
+
+    def fit_history(self, fixed_text, history, prefix_tokens=0):
+        """Fit the history before the chunks are known (it gets its share either way)
+
+        prefix_tokens: fixed text counted once elsewhere (a precomputed prompt prefix)
+        """
+        fixed = prefix_tokens + estimate_tokens(fixed_text)
+        available = max(0, self.total_budget - fixed)
+        messages, tokens = self._fit_history(history, int(available * self.history_share))
+        return FittedHistory(self, fixed, available, messages, tokens)
+
+    def build(self, fixed_text, history, chunks, prefix_tokens=0):
+        return self.fit_history(fixed_text, history, prefix_tokens).finish(chunks)
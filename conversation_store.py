@@ -0,0 +1,256 @@
+"""
+Digital Protection - Conversation Store
+Chat history lives here instead of growing in st.session_state. Each
+conversation keeps only its most recent messages in memory, conversations
+are held in an LRU and evicted when idle, so memory per replica stays
+bounded however many widget users are connected.
+
+With a SQLite backend the full history is also written to disk: older
+messages are read only when someone asks to see them, and a conversation
+evicted from memory is reloaded on its next turn.
+
+    DP_CONVERSATION_DB=/var/lib/dp/conversations.sqlite   # default: memory only
+"""
+
+import os
+import time
+import uuid
+import sqlite3
+import threading
+from collections import OrderedDict
+
+MAX_CONVERSATIONS = 5000          # In memory at once; least recently used beyond this are evicted
+IDLE_SECONDS = 1800               # Conversations untouched this long are evicted from memory
+MAX_CACHED_MESSAGES = 40          # Newest messages kept in memory per conversation
+MAX_MESSAGE_CHARS = 8000          # Longer messages are cut before storing
+RETENTION_SECONDS = 30 * 86400    # SQLite: conversations idle this long are deleted
+PURGE_INTERVAL_SECONDS = 3600
+
+
+def conversation_db_from_env():
+    return os.environ.get("DP_CONVERSATION_DB") or None
+
+
+class Conversation:
+    """A conversation's settings and its newest messages
+
+    total counts every message, including older ones only the backend has.
+    runtime holds per-process extras (e.g. the API's turn state) that are
+    never persisted and go with the conversation when it is evicted.
+    """
+
+    def __init__(self, conversation_id, ui_language="en", messages=None, total=None, updated=None):
+        self.id = conversation_id
+        self.ui_language = ui_language
+        self.messages = list(messages or [])
+        self.total = len(self.messages) if total is None else total
+        self.updated = updated or time.time()
+        self.last_used = time.monotonic()
+        self.runtime = {}
+
+
+class SQLiteConversationBackend:
+    """Every message of every conversation, one row each"""
+
+    def __init__(self, db_path):
+        self._connection = sqlite3.connect(db_path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.executescript("""
+                CREATE TABLE IF NOT EXISTS conversations (
+                    id TEXT PRIMARY KEY,
+                    ui_language TEXT NOT NULL,
+                    total INTEGER NOT NULL,
+                    updated REAL NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS messages (
+                    conversation_id TEXT NOT NULL,
+                    seq INTEGER NOT NULL,
+                    role TEXT NOT NULL,
+                    content TEXT NOT NULL,
+                    PRIMARY KEY (conversation_id, seq)
+                ) WITHOUT ROWID;
+                CREATE INDEX IF NOT EXISTS conversations_updated ON conversations (updated);
+            """)
+
+    def save_conversation(self, conversation):
+        with self._lock, self._connection:
+            self._upsert(conversation)
+
+    def _upsert(self, conversation):
+        self._connection.execute(
+            "INSERT INTO conversations (id, ui_language, total, updated) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (id) DO UPDATE SET ui_language = excluded.ui_language, total = excluded.total, "
+            "updated = excluded.updated",
+            (conversation.id, conversation.ui_language, conversation.total, conversation.updated),
+        )
+
+    def add_message(self, conversation, seq, message):
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO messages (conversation_id, seq, role, content) VALUES (?, ?, ?, ?)",
+                (conversation.id, seq, message["role"], message["content"]),
+            )
+            self._upsert(conversation)
+
+    def load(self, conversation_id, limit):
+        """The conversation with its newest limit messages, or None"""
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT ui_language, total, updated FROM conversations WHERE id = ?", (conversation_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        ui_language, total, updated = row
+        messages = self.messages(conversation_id, max(0, total - limit), total)
+        return Conversation(conversation_id, ui_language, messages, total, updated)
+
+    def messages(self, conversation_id, start, end):
+        """Messages start <= seq < end, oldest first"""
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT role, content FROM messages WHERE conversation_id = ? AND seq >= ? AND seq < ? "
+                "ORDER BY seq",
+                (conversation_id, start, end),
+            ).fetchall()
+        return [{"role": role, "content": content} for role, content in rows]
+
+    def purge(self, updated_before):
+        """Delete conversations idle since updated_before; returns how many"""
+        with self._lock, self._connection:
+            ids = [(cid,) for (cid,) in self._connection.execute(
+                "SELECT id FROM conversations WHERE updated < ?", (updated_before,))]
+            self._connection.executemany("DELETE FROM messages WHERE conversation_id = ?", ids)
+            self._connection.executemany("DELETE FROM conversations WHERE id = ?", ids)
+        return len(ids)
+
+
+class ConversationStore:
+    """Bounded in-memory conversations, over an optional persistent backend"""
+
+    def __init__(self, backend=None, max_conversations=MAX_CONVERSATIONS, idle_seconds=IDLE_SECONDS,
+                 max_cached_messages=MAX_CACHED_MESSAGES, max_message_chars=MAX_MESSAGE_CHARS,
+                 retention_seconds=RETENTION_SECONDS):
+        self.backend = backend
+        self.max_conversations = max_conversations
+        self.idle_seconds = idle_seconds
+        self.max_cached_messages = max_cached_messages
+        self.max_message_chars = max_message_chars
+        self.retention_seconds = retention_seconds
+        self.evicted = 0
+        self._conversations = OrderedDict()
+        self._lock = threading.Lock()
+        self._purged_at = 0.0
+
+    def __len__(self):
+        return len(self._conversations)
+
+    def create(self, ui_language="en"):
+        conversation = Conversation(uuid.uuid4().hex, ui_language)
+        if self.backend is not None:
+            self.backend.save_conversation(conversation)
+        self._remember(conversation)
+        return conversation
+
+    def get(self, conversation_id):
+        """The conversation (reloaded from the backend if it was evicted), or None"""
+        if not conversation_id:
+            return None
+        with self._lock:
+            self._expire()
+            conversation = self._conversations.get(conversation_id)
+            if conversation is not None:
+                self._conversations.move_to_end(conversation_id)
+                conversation.last_used = time.monotonic()
+                return conversation
+        if self.backend is None:
+            return None
+        conversation = self.backend.load(conversation_id, self.max_cached_messages)
+        if conversation is not None:
+            self._remember(conversation)
+        return conversation
+
+    def append(self, conversation, role, content):
+        message = {"role": role, "content": content[:self.max_message_chars]}
+        with self._lock:
+            conversation.messages.append(message)
+            del conversation.messages[:-self.max_cached_messages]
+            conversation.total += 1
+            conversation.updated = time.time()
+            conversation.last_used = time.monotonic()
+            seq = conversation.total - 1
+        if self.backend is not None:
+            self.backend.add_message(conversation, seq, message)
+            self._purge()
+        return message
+
+    def set_language(self, conversation, ui_language):
+        conversation.ui_language = ui_language
+        conversation.updated = time.time()
+        if self.backend is not None:
+            self.backend.save_conversation(conversation)
+
+    def history(self, conversation):
+        """The messages in memory, oldest first: plenty for a prompt"""
+        with self._lock:
+            return list(conversation.messages)
+
+    def window(self, conversation, size):
+        """The newest size messages to display; returns (messages, earlier)
+
+        earlier is how many older messages could still be shown. Messages
+        past the in-memory ones are read from the backend (without one they
+        are gone).
+        """
+        with self._lock:
+            cached = list(conversation.messages)
+            total = conversation.total
+        available = total if self.backend is not None else len(cached)
+        size = min(size, available)
+        if size <= len(cached):
+            messages = cached[len(cached) - size:]
+        else:
+            messages = self.backend.messages(conversation.id, total - size, total)
+        return messages, available - len(messages)
+
+    def _remember(self, conversation):
+        with self._lock:
+            self._conversations[conversation.id] = conversation
+            self._conversations.move_to_end(conversation.id)
+            self._expire()
+            while len(self._conversations) > self.max_conversations:
+                self._conversations.popitem(last=False)
+                self.evicted += 1
+
+    def _expire(self):
+        # Least recently used first, so this stops at the first active one
+        cutoff = time.monotonic() - self.idle_seconds
+        while self._conversations:
+            oldest = next(iter(self._conversations.values()))
+            if oldest.last_used >= cutoff:
+                break
+            self._conversations.popitem(last=False)
+            self.evicted += 1
+
+    def _purge(self):
+        now = time.time()
+        if now - self._purged_at < PURGE_INTERVAL_SECONDS:
+            return
+        self._purged_at = now
+        try:
+            purged = self.backend.purge(now - self.retention_seconds)
+            if purged:
+                print(f"DEBUG: Deleted {purged} conversations idle for over {self.retention_seconds // 86400} days")
+        except sqlite3.Error as e:
+            print(f"DEBUG: Conversation purge failed: {e}")
+
+
+def open_conversation_store(db_path=None):
+    """Memory-only store, or one backed by SQLite at db_path"""
+    if not db_path:
+        return ConversationStore()
+    store = ConversationStore(SQLiteConversationBackend(db_path))
+    print(f"✓ Conversations stored in {db_path}")
+    return store
@@ -0,0 +1,74 @@
+"""
+Digital Protection - Embedding Backends
+The same paraphrase-multilingual-MiniLM-L12-v2 model, run either in full
+precision PyTorch (the reference) or through ONNX Runtime, optionally with the
+int8-quantized export published alongside the model.
+
+Select with DP_EMBEDDING_BACKEND (app/sidecar) or --embedding-backend (ingest).
+"""
+
+import os
+
+import numpy as np
+
+EMBEDDING_MODEL = "paraphrase-multilingual-MiniLM-L12-v2"
+DEFAULT_BACKEND = "torch"
+
+# sentence-transformers loads these through its ONNX Runtime backend
+# (needs `pip install sentence-transformers[onnx]`)
+BACKEND_MODEL_KWARGS = {
+    "torch": {},
+    "onnx": {"backend": "onnx"},
+    "onnx-int8": {"backend": "onnx", "model_kwargs": {"file_name": "onnx/model_quint8_avx2.onnx"}},
+}
+
+# Minimum cosine similarity to the reference vectors for a backend to be used
+MIN_COSINE = 0.98
+
+
+def backend_from_env():
+    return os.environ.get("DP_EMBEDDING_BACKEND", DEFAULT_BACKEND)
+
+
+def create_embeddings(backend=None, model_name=EMBEDDING_MODEL):
+    """HuggingFaceEmbeddings running on the chosen backend"""
+    backend = backend or backend_from_env()
+    if backend not in BACKEND_MODEL_KWARGS:
+        raise ValueError(f"Unknown embedding backend '{backend}' (choose from {', '.join(BACKEND_MODEL_KWARGS)})")
+    # Imported here: it pulls in torch and sentence-transformers, which take
+    # seconds and are only needed once a model is actually loaded
+    from langchain_huggingface import HuggingFaceEmbeddings
+    return HuggingFaceEmbeddings(model_name=model_name, model_kwargs=BACKEND_MODEL_KWARGS[backend])
+
+
+def cosine_similarities(vectors_a, vectors_b):
+    a = np.asarray(vectors_a, dtype=np.float32)
+    b = np.asarray(vectors_b, dtype=np.float32)
+    a /= np.maximum(np.linalg.norm(a, axis=1, keepdims=True), 1e-12)
+    b /= np.maximum(np.linalg.norm(b, axis=1, keepdims=True), 1e-12)
+    return np.sum(a * b, axis=1)
+
+
+def check_against_index(vectorstore, samples=8, min_cosine=MIN_COSINE):
+    """Re-embed a few indexed chunks and compare with their stored vectors
+
+    The stored vectors were written by the reference backend at ingestion, so
+    this catches a backend that drifts too far without loading PyTorch.
+    Returns the lowest cosine seen, or None if the index can't reconstruct
+    vectors. Raises ValueError below min_cosine.
+    """
+    total = vectorstore.index.ntotal
+    if total == 0:
+        return None
+    positions = np.linspace(0, total - 1, num=min(samples, total), dtype=np.int64)
+    try:
+        stored = np.stack([vectorstore.index.reconstruct(int(p)) for p in positions])
+    except RuntimeError:
+        return None
+
+    texts = [vectorstore.docstore.search(vectorstore.index_to_docstore_id[int(p)]).page_content
+             for p in positions]
+    lowest = float(cosine_similarities(vectorstore.embeddings.embed_documents(texts), stored).min())
+    if lowest < min_cosine:
+        raise ValueError(f"Embedding backend drifts from the index vectors (cosine {lowest:.4f} < {min_cosine})")
+    return lowest
@@ -0,0 +1,265 @@
+"""
+Digital Protection - Embedding/Search Sidecar
+One process on the box loads the embedding model and the index; every
+Streamlit process talks to it over a Unix socket instead of loading its own
+copy. Query embeddings that arrive together from different sessions are
+encoded in one forward pass.
+
+Usage:
+    python embedding_sidecar.py --socket /tmp/dp-knowledge.sock
+    DP_SIDECAR_SOCKET=/tmp/dp-knowledge.sock streamlit run app.py
+
+Protocol: one JSON object per line in each direction.
+    {"op": "ping"}
+    {"op": "embed", "text": "..."}
+    {"op": "retrieve", "query": "...", "sparse_query": "...", "language": "ar"}
+    {"op": "search", "vector": [...], "query": "...", "sparse_query": "...", "language": "ar"}
+"""
+
+import os
+import json
+import time
+import socket
+import asyncio
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from langchain_core.documents import Document
+
+from knowledge_base import open_knowledge_base
+from response_cache import read_index_version
+from embedding_backends import backend_from_env
+from reranker import load_reranker, rerank_from_env
+
+DEFAULT_SOCKET = "/tmp/dp-knowledge.sock"
+
+
+# --- CLIENT (used by app.py) ---
+class SidecarError(Exception):
+    """The sidecar returned an error or could not be reached"""
+
+
+class SidecarKnowledgeBase:
+    """Same interface as knowledge_base.LocalKnowledgeBase, served by the sidecar"""
+
+    def __init__(self, socket_path=DEFAULT_SOCKET, timeout=30):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self._local = threading.local()  # One connection per Streamlit thread
+
+    def _connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._local.sock = sock  # Set first, so _close() gets it if connect fails
+        sock.settimeout(self.timeout)
+        sock.connect(self.socket_path)
+        self._local.stream = sock.makefile("rwb")
+        return self._local.stream
+
+    def _close(self):
+        for name in ("stream", "sock"):
+            handle = getattr(self._local, name, None)
+            setattr(self._local, name, None)
+            if handle is not None:
+                try:
+                    handle.close()
+                except OSError:
+                    pass
+
+    def _call(self, payload):
+        line = json.dumps(payload, ensure_ascii=False).encode("utf-8") + b"\n"
+        for attempt in (1, 2):
+            try:
+                stream = getattr(self._local, "stream", None) or self._connect()
+                stream.write(line)
+                stream.flush()
+                reply = stream.readline()
+                if not reply:
+                    raise ConnectionError("sidecar closed the connection")
+                break
+            except OSError as e:
+                # Stale connection (e.g. sidecar restarted): close it, reconnect once
+                self._close()
+                if attempt == 2:
+                    raise SidecarError(f"Sidecar unreachable at {self.socket_path}: {e}")
+        response = json.loads(reply)
+        if "error" in response:
+            raise SidecarError(response["error"])
+        return response
+
+    def ping(self):
+        return self._call({"op": "ping"})
+
+    def embed_query(self, text):
+        return self._call({"op": "embed", "text": text})["vector"]
+
+    def embed_queries(self, texts):
+        return [self.embed_query(text) for text in texts]
+
+    def retrieve(self, query, sparse_query=None, embedding_cache=None, language=None):
+        vector = embedding_cache.get(query) if embedding_cache is not None else None
+        if vector is not None:
+            response = self._call({"op": "search", "vector": vector, "query": query,
+                                   "sparse_query": sparse_query, "language": language})
+            response["stages"]["embed"] = 0.0
+        else:
+            response = self._call({"op": "retrieve", "query": query, "sparse_query": sparse_query,
+                                   "language": language})
+            if embedding_cache is not None:
+                embedding_cache.put(query, response["vector"])
+        docs = [Document(id=d["id"], page_content=d["page_content"], metadata=d["metadata"])
+                for d in response["docs"]]
+        return docs, response["stages"]
+
+
+# --- SERVER ---
+class EmbeddingBatcher:
+    """Collects concurrent embed requests and encodes them in one forward pass"""
+
+    def __init__(self, server, executor, max_batch=32, max_wait_seconds=0.005):
+        self.server = server
+        self.executor = executor
+        self.max_batch = max_batch
+        self.max_wait_seconds = max_wait_seconds
+        self.queue = asyncio.Queue()
+        self.batches = 0
+        self.requests = 0
+
+    async def embed(self, text):
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((text, future))
+        return await future
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_wait_seconds
+            while len(batch) < self.max_batch:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+
+            texts = [text for text, _ in batch]
+            try:
+                knowledge_base = self.server.knowledge_base()
+                vectors = await loop.run_in_executor(self.executor, knowledge_base.embed_queries, texts)
+                for (_, future), vector in zip(batch, vectors):
+                    future.set_result(vector)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+            self.batches += 1
+            self.requests += len(batch)
+
+
+class SidecarServer:
+    def __init__(self, index_path, max_batch, max_wait_seconds, threads, backend, rerank=False):
+        self.index_path = index_path
+        self.backend = backend
+        self.reranker = load_reranker() if rerank else None  # Kept across index reloads
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="dp-sidecar")
+        self.batcher = EmbeddingBatcher(self, self.executor, max_batch, max_wait_seconds)
+        self._knowledge_base = None
+        self._index_version = None
+        self._checked_at = 0.0
+        self._reload = None  # Future of the version check in flight
+
+    def knowledge_base(self):
+        """Current index. Every 5 s the executor checks for a new version stamped
+        by ingest_data.py and loads it; the old index serves until it is ready"""
+        now = time.time()
+        if now - self._checked_at > 5 and (self._reload is None or self._reload.done()):
+            self._checked_at = now
+            self._reload = self.executor.submit(self.reload)
+        return self._knowledge_base
+
+    def reload(self):
+        """Open the index if its version changed (blocking: runs on the executor)"""
+        version = read_index_version(self.index_path)
+        if version == self._index_version and self._knowledge_base is not None:
+            return
+        print(f"Loading index '{self.index_path}' (version {version})")
+        try:
+            knowledge_base = open_knowledge_base(self.index_path, self.backend, reranker=self.reranker)
+        except Exception as e:
+            if self._knowledge_base is None:
+                raise
+            print(f"DEBUG: Index version {version} failed to load, still serving {self._index_version}: {e}")
+            return
+        self._knowledge_base, self._index_version = knowledge_base, version
+
+    async def handle(self, request):
+        op = request.get("op")
+        if op == "ping":
+            return {"ok": True, "index_version": self._index_version, "pid": os.getpid(),
+                    "batches": self.batcher.batches, "requests": self.batcher.requests}
+        if op == "embed":
+            return {"vector": list(await self.batcher.embed(request["text"]))}
+        if op in ("retrieve", "search"):
+            started = time.perf_counter()
+            if op == "search":
+                vector = request["vector"]  # Already embedded by the client
+            else:
+                vector = list(await self.batcher.embed(request["query"]))
+            embed_seconds = time.perf_counter() - started
+            docs, stages = await asyncio.get_running_loop().run_in_executor(
+                self.executor, self.knowledge_base().search, vector, request.get("sparse_query"),
+                request.get("language"), request.get("query")
+            )
+            stages["embed"] = embed_seconds
+            response = {
+                "docs": [{"id": d.id, "page_content": d.page_content, "metadata": d.metadata} for d in docs],
+                "stages": stages,
+            }
+            if op == "retrieve":
+                response["vector"] = vector  # Lets the client cache it
+            return response
+        return {"error": f"unknown op {op!r}"}
+
+    async def serve_client(self, reader, writer):
+        try:
+            while line := await reader.readline():
+                try:
+                    response = await self.handle(json.loads(line))
+                except Exception as e:
+                    response = {"error": str(e)}
+                writer.write(json.dumps(response, ensure_ascii=False).encode("utf-8") + b"\n")
+                await writer.drain()
+        finally:
+            writer.close()
+
+    async def serve(self, socket_path):
+        # Load before accepting connections so the first query isn't slow
+        await asyncio.get_running_loop().run_in_executor(self.executor, self.reload)
+        self._checked_at = time.time()
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        server = await asyncio.start_unix_server(self.serve_client, path=socket_path)
+        asyncio.create_task(self.batcher.run())
+        print(f"✓ Sidecar listening on {socket_path}")
+        async with server:
+            await server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Shared embedding/search sidecar for app.py")
+    parser.add_argument("--socket", default=DEFAULT_SOCKET, help=f"Unix socket path (default {DEFAULT_SOCKET})")
+    parser.add_argument("--index", default="faiss_index", help="Index folder (default faiss_index)")
+    parser.add_argument("--max-batch", type=int, default=32, help="Most queries per forward pass")
+    parser.add_argument("--max-wait-ms", type=float, default=5.0,
+                        help="How long to wait for more queries before encoding a batch")
+    parser.add_argument("--threads", type=int, default=4, help="Threads for encoding and search")
+    parser.add_argument("--embedding-backend", default=backend_from_env(),
+                        help="torch, onnx or onnx-int8 (default: DP_EMBEDDING_BACKEND or torch)")
+    parser.add_argument("--rerank", action="store_true", default=rerank_from_env(),
+                        help="Rerank candidates with the cross-encoder (default: DP_RERANK)")
+    args = parser.parse_args()
+
+    server = SidecarServer(args.index, args.max_batch, args.max_wait_ms / 1000, args.threads,
+                           args.embedding_backend, args.rerank)
+    asyncio.run(server.serve(args.socket))
@@ -0,0 +1,156 @@
+"""
+Digital Protection - FAQ Fast Path
+Canonical questions (contact, location, pricing policy, services) are
+recognised by nearest-centroid classification over the query embedding the
+app computes anyway, and answered from curated text without FAISS or Groq.
+"""
+
+import threading
+
+import numpy as np
+
+from text_cleaning import wrap_arabic
+
+# Cosine to the nearest intent centroid needed for a direct answer, and how
+# far ahead of the runner-up (including "other") that intent must be
+FAQ_THRESHOLD = 0.80
+FAQ_MARGIN = 0.05
+
+# Example phrasings per intent; each intent's centroid is their mean embedding.
+# "other" holds in-domain questions that need the knowledge base, so that a
+# detailed question about, say, ISO 27701 is not mistaken for "services".
+FAQ_EXAMPLES = {
+    "contact": [
+        "How can I contact you?", "What is your email address?", "What is your phone number?",
+        "How do I reach your team?", "I want to talk to someone", "Contact details please",
+        "كيف يمكنني التواصل معكم؟", "ما هو بريدكم الالكتروني؟", "ما هو رقم هاتفكم؟",
+        "اريد التحدث مع فريقكم", "معلومات الاتصال",
+    ],
+    "location": [
+        "Where are you located?", "Where is your office?", "What is your address?",
+        "Which city are you in?", "Where are you based?",
+        "اين تقع شركتكم؟", "اين مكتبكم؟", "ما هو عنوانكم؟", "في اي مدينة انتم؟",
+    ],
+    "pricing": [
+        "How much do your services cost?", "What are your prices?", "How does your pricing work?",
+        "Can I get a quote?", "What is your pricing model?", "Are your services expensive?",
+        "كم تكلفة خدماتكم؟", "ما هي اسعاركم؟", "كيف يتم التسعير؟", "اريد عرض سعر",
+    ],
+    "services": [
+        "What services do you offer?", "What do you do?", "What can you help me with?",
+        "List your services", "What does Digital Protection provide?",
+        "ما هي الخدمات التي تقدمونها؟", "ماذا تقدمون؟", "ما هي خدماتكم؟", "بماذا يمكنكم مساعدتي؟",
+    ],
+    "other": [
+        "What is GDPR?", "How long does an ISO 27701 implementation take?",
+        "What is the difference between a vulnerability assessment and a penetration test?",
+        "Do you help banks with CBJ cybersecurity instructions?", "What is PAM?",
+        "How do you configure a WAF?", "Which sectors do you work with?",
+        "What is a Data Protection Impact Assessment?",
+        "ما هو ISO 27701؟", "ما الفرق بين تقييم الثغرات واختبار الاختراق؟",
+        "هل تساعدون البنوك في تعليمات البنك المركزي؟", "ما هي ادارة الوصول المميز؟",
+    ],
+}
+
+FAQ_ANSWERS = {
+    "contact": {
+        "en": "You can reach our team at:\n\n"
+              "- **Email:** info@dp-technologies.net\n"
+              "- **Phone:** +962 790 552 879\n\n"
+              "We usually reply within one business day.",
+        "ar": "يمكنك التواصل مع فريقنا عبر:\n\n"
+              "- **البريد الالكتروني:** info@dp-technologies.net\n"
+              "- **الهاتف:** +962 790 552 879\n\n"
+              "نرد عادة خلال يوم عمل واحد.",
+    },
+    "location": {
+        "en": "We are based in **Amman, Jordan**, and work with clients across the Middle East and "
+              "North Africa.\n\nContact us at info@dp-technologies.net or +962 790 552 879.",
+        "ar": "مقرنا في **عمان، الاردن**، ونعمل مع عملاء في الشرق الاوسط وشمال افريقيا.\n\n"
+              "تواصل معنا على info@dp-technologies.net او +962 790 552 879",
+    },
+    "pricing": {
+        "en": "Pricing depends on the scope and complexity of your project. We offer:\n\n"
+              "- Fixed-price projects for defined deliverables\n"
+              "- Time and materials for open-ended work\n"
+              "- Retainers for ongoing support\n\n"
+              "For a quote, contact info@dp-technologies.net.",
+        "ar": "يعتمد التسعير على نطاق مشروعك ومدى تعقيده. نقدم:\n\n"
+              "- مشاريع بسعر ثابت لمخرجات محددة\n"
+              "- الوقت والمواد للاعمال المفتوحة\n"
+              "- اشتراكات للدعم المستمر\n\n"
+              "للحصول على عرض سعر تواصل معنا على info@dp-technologies.net",
+    },
+    "services": {
+        "en": "Digital Protection offers:\n\n"
+              "- **Privacy & Compliance:** GDPR, ISO 27701, CBJ requirements\n"
+              "- **Security Assessments:** vulnerability scanning and risk analysis\n"
+              "- **Network Security:** firewalls and WAF\n"
+              "- **Identity & Access Management:** IAM and PAM\n\n"
+              "Ask me about any of them for details.",
+        "ar": "تقدم Digital Protection:\n\n"
+              "- **الخصوصية والامتثال:** GDPR و ISO 27701 ومتطلبات البنك المركزي الاردني\n"
+              "- **تقييمات الامن:** فحص الثغرات وتحليل المخاطر\n"
+              "- **امن الشبكات:** جدران الحماية و WAF\n"
+              "- **ادارة الهوية والوصول:** IAM و PAM\n\n"
+              "اسالني عن اي منها لمزيد من التفاصيل.",
+    },
+}
+
+
+class FaqMatch:
+    def __init__(self, intent, score, margin, hit):
+        self.intent = intent    # Nearest intent (may be "other")
+        self.score = score      # Cosine to its centroid
+        self.margin = margin    # Lead over the runner-up
+        self.hit = hit          # Confident enough to answer directly
+
+
+def _normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=-1, keepdims=True), 1e-12)
+
+
+class FaqRouter:
+    """Nearest-centroid intent classifier with curated bilingual answers"""
+
+    def __init__(self, embed_queries, examples=FAQ_EXAMPLES, answers=FAQ_ANSWERS,
+                 threshold=FAQ_THRESHOLD, margin=FAQ_MARGIN):
+        self.intents = list(examples)
+        self.answers = answers
+        self.threshold = threshold
+        self.margin = margin
+        texts = [text for intent in self.intents for text in examples[intent]]
+        vectors = _normalize(embed_queries(texts))
+        centroids = []
+        start = 0
+        for intent in self.intents:
+            count = len(examples[intent])
+            centroids.append(vectors[start:start + count].mean(axis=0))
+            start += count
+        self.centroids = _normalize(centroids)
+        self.lookups = 0
+        self.hits = {intent: 0 for intent in answers}
+        self._lock = threading.Lock()
+
+    def classify(self, vector):
+        scores = self.centroids @ _normalize(vector)
+        order = np.argsort(-scores)
+        best, runner_up = int(order[0]), int(order[1])
+        intent = self.intents[best]
+        margin = float(scores[best] - scores[runner_up])
+        hit = intent in self.answers and scores[best] >= self.threshold and margin >= self.margin
+        with self._lock:
+            self.lookups += 1
+            if hit:
+                self.hits[intent] += 1
+        return FaqMatch(intent, float(scores[best]), margin, hit)
+
+    def answer(self, intent, is_arabic_lang):
+        if is_arabic_lang:
+            return wrap_arabic(self.answers[intent]["ar"])
+        return self.answers[intent]["en"]
+
+    def hit_rate(self):
+        with self._lock:
+            return sum(self.hits.values()) / self.lookups if self.lookups else 0.0
@@ -0,0 +1,254 @@
+"""
+Digital Protection - Groq Request Scheduler
+One scheduler per process sits in front of the Groq client. It keeps every
+session's chat requests within each model's requests-per-minute and
+tokens-per-minute limits, queues what doesn't fit (bounded, short turns
+first), and backs off with jitter when Groq answers 429 anyway.
+"""
+
+import time
+import heapq
+import random
+import itertools
+import threading
+from collections import deque
+from types import SimpleNamespace
+
+from context_builder import estimate_tokens
+from model_router import LatencyHistogram
+
+WAIT_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0, float("inf"))
+DEFAULT_COMPLETION_TOKENS = 512  # Reserved for the answer when max_tokens isn't given
+WINDOW_SECONDS = 60.0
+
+
+class SchedulerBusy(Exception):
+    """The queue is full; the request was not sent"""
+
+
+class SchedulerTimeout(Exception):
+    """The request waited longer than max_wait_seconds for budget"""
+
+
+class RateBudget:
+    """Sliding one-minute window of requests and tokens for one model"""
+
+    def __init__(self, requests_per_minute, tokens_per_minute):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.window = deque()  # [timestamp, tokens]
+        self.tokens = 0
+        self.blocked_until = 0.0  # Set from 429 responses
+
+    def _expire(self, now):
+        while self.window and now - self.window[0][0] >= WINDOW_SECONDS:
+            self.tokens -= self.window.popleft()[1]
+
+    def wait_time(self, tokens, now):
+        """Seconds until a request of this size fits (0 = now)"""
+        self._expire(now)
+        waits = [self.blocked_until - now]
+        if len(self.window) >= self.requests_per_minute:
+            waits.append(self.window[len(self.window) - self.requests_per_minute][0] + WINDOW_SECONDS - now)
+        # A request bigger than the whole budget still goes once the window is empty
+        excess = self.tokens + min(tokens, self.tokens_per_minute) - self.tokens_per_minute
+        if excess > 0:
+            freed = 0
+            for timestamp, used in self.window:
+                freed += used
+                if freed >= excess:
+                    waits.append(timestamp + WINDOW_SECONDS - now)
+                    break
+        return max(0.0, *waits)
+
+    def reserve(self, tokens, now):
+        entry = [now, tokens]
+        self.window.append(entry)
+        self.tokens += tokens
+        return entry
+
+    def settle(self, entry, actual_tokens):
+        """Replace a reservation's estimate with what was actually used"""
+        if any(e is entry for e in self.window):  # Still inside the window
+            self.tokens += actual_tokens - entry[1]
+            entry[1] = actual_tokens
+
+
+class _Ticket:
+    def __init__(self, model, tokens, key):
+        self.model = model
+        self.tokens = tokens
+        self.key = key
+        self.entry = None
+        self.released = False
+
+    def __lt__(self, other):
+        return self.key < other.key
+
+
+class GroqScheduler:
+    """Admission control for chat completions across all sessions
+
+    limits: {model: (requests_per_minute, tokens_per_minute)}
+    Waiting requests are ordered by arrival time, with turns estimated above
+    short_turn_tokens treated as if they arrived long_turn_delay seconds
+    later, so quick interactive turns overtake big ones without starving them.
+    """
+
+    def __init__(self, limits, max_in_flight=16, max_queue=64, max_wait_seconds=10.0,
+                 short_turn_tokens=1500, long_turn_delay=2.0, max_retries=3, backoff_seconds=1.0):
+        self.budgets = {model: RateBudget(rpm, tpm) for model, (rpm, tpm) in limits.items()}
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.max_wait_seconds = max_wait_seconds
+        self.short_turn_tokens = short_turn_tokens
+        self.long_turn_delay = long_turn_delay
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+
+        self._queues = {model: [] for model in limits}
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self.in_flight = 0
+        self.wait_histogram = LatencyHistogram(WAIT_BUCKETS)
+        self.rejected = {"busy": 0, "timeout": 0}
+        self.rate_limited = 0
+
+    def queue_depth(self, model=None):
+        with self._condition:
+            if model is not None:
+                return len(self._queues.get(model, ()))
+            return sum(len(q) for q in self._queues.values())
+
+    def _budget(self, model):
+        if model not in self.budgets:
+            # Unknown model: no limits known, only concurrency applies
+            self.budgets[model] = RateBudget(float("inf"), float("inf"))
+            self._queues[model] = []
+        return self.budgets[model]
+
+    def acquire(self, model, tokens):
+        """Block until the request may be sent; returns a ticket for release()"""
+        started = time.monotonic()
+        with self._condition:
+            budget = self._budget(model)
+            if self.queue_depth() >= self.max_queue:
+                self.rejected["busy"] += 1
+                raise SchedulerBusy(f"{self.max_queue} requests already queued")
+            delay = self.long_turn_delay if tokens > self.short_turn_tokens else 0.0
+            ticket = _Ticket(model, tokens, (started + delay, next(self._sequence)))
+            queue = self._queues[model]
+            heapq.heappush(queue, ticket)
+            try:
+                while True:
+                    now = time.monotonic()
+                    wait = budget.wait_time(tokens, now)
+                    if queue[0] is ticket and wait == 0 and self.in_flight < self.max_in_flight:
+                        heapq.heappop(queue)
+                        ticket.entry = budget.reserve(tokens, now)
+                        self.in_flight += 1
+                        self._condition.notify_all()  # The next in line may fit too
+                        break
+                    remaining = started + self.max_wait_seconds - now
+                    if remaining <= 0:
+                        self.rejected["timeout"] += 1
+                        raise SchedulerTimeout(f"No {model} capacity within {self.max_wait_seconds:.0f}s")
+                    self._condition.wait(min(remaining, wait or remaining, 1.0))
+            except BaseException:
+                if ticket in queue:
+                    queue.remove(ticket)
+                    heapq.heapify(queue)
+                    self._condition.notify_all()
+                raise
+        self.wait_histogram.record(time.monotonic() - started)
+        return ticket
+
+    def release(self, ticket, actual_tokens=None):
+        with self._condition:
+            if ticket.released:
+                return
+            ticket.released = True
+            self.in_flight -= 1
+            if actual_tokens is not None:
+                self.budgets[ticket.model].settle(ticket.entry, actual_tokens)
+            self._condition.notify_all()
+
+    def rate_limited_by_server(self, model, retry_after, attempt):
+        """Hold every request for model after a 429 (jittered exponential backoff)"""
+        backoff = self.backoff_seconds * 2 ** attempt * random.uniform(0.5, 1.5)
+        with self._condition:
+            self.rate_limited += 1
+            budget = self._budget(model)
+            budget.blocked_until = max(budget.blocked_until, time.monotonic() + max(retry_after or 0.0, backoff))
+            self._condition.notify_all()
+
+
+def _retry_after(error):
+    """Seconds from a 429's Retry-After header, if any"""
+    response = getattr(error, "response", None)
+    try:
+        return float(response.headers.get("retry-after"))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+def _is_rate_limit(error):
+    return getattr(error, "status_code", None) == 429
+
+
+class _MeteredStream:
+    """Passes a Groq stream through and settles the token budget when it ends"""
+
+    def __init__(self, stream, scheduler, ticket, prompt_tokens):
+        self.stream = stream
+        self.scheduler = scheduler
+        self.ticket = ticket
+        self.prompt_tokens = prompt_tokens
+        self.deltas = 0
+
+    def __iter__(self):
+        try:
+            for chunk in self.stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    self.deltas += 1
+                yield chunk
+        finally:
+            self._release()
+
+    def _release(self):
+        self.scheduler.release(self.ticket, self.prompt_tokens + self.deltas)
+
+    def close(self):
+        try:
+            self.stream.close()
+        finally:
+            self._release()
+
+
+class ScheduledGroqClient:
+    """Drop-in for groq.Groq where chat.completions.create goes through a GroqScheduler"""
+
+    def __init__(self, client, scheduler):
+        self.client = client
+        self.scheduler = scheduler
+        self.models = client.models
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    def _create(self, messages, model, **kwargs):
+        prompt_tokens = sum(estimate_tokens(m["content"]) for m in messages)
+        tokens = prompt_tokens + (kwargs.get("max_tokens") or DEFAULT_COMPLETION_TOKENS)
+        for attempt in range(self.scheduler.max_retries + 1):
+            ticket = self.scheduler.acquire(model, tokens)
+            try:
+                response = self.client.chat.completions.create(messages=messages, model=model, **kwargs)
+            except Exception as e:
+                self.scheduler.release(ticket, 0 if _is_rate_limit(e) else None)
+                if not _is_rate_limit(e) or attempt == self.scheduler.max_retries:
+                    raise
+                print(f"DEBUG: Groq rate limit on {model}, backing off (attempt {attempt + 1})")
+                self.scheduler.rate_limited_by_server(model, _retry_after(e), attempt)
+                continue
+            if kwargs.get("stream"):
+                return _MeteredStream(response, self.scheduler, ticket, prompt_tokens)
+            self.scheduler.release(ticket)
+            return response
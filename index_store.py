@@ -0,0 +1,382 @@
+"""
+Digital Protection - Pickle-free Index Store
+FAISS vectors are memory-mapped from index.faiss; chunk texts and metadata
+live in a SQLite file and are only read for the ids a search returns.
+Per-language sub-indexes (index.<language>.faiss) sit next to index.faiss.
+A deployed faiss_index.zip is unpacked once to faiss_index.cache/ and then
+memory-mapped the same way.
+
+A bundle manifest (sha256 of every serving file) is written last, so a stale
+or half-written index is rejected before the app serves from it. Loading
+checks file sizes and the version stamp; ingest_data.py --verify (and an
+incremental ingest) hash every file.
+"""
+
+import os
+import re
+import json
+import shutil
+import hashlib
+import sqlite3
+import zipfile
+import tempfile
+import threading
+from collections.abc import Mapping
+
+import faiss
+from langchain_core.documents import Document
+from langchain_community.docstore.base import Docstore
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+from response_cache import INDEX_VERSION_FILE
+from sparse_index import SPARSE_INDEX_FILE
+from ann_index import INDEX_META_FILE
+
+VECTORS_FILE = "index.faiss"
+DOCSTORE_FILE = "docstore.sqlite"
+LEGACY_PICKLE_FILE = "index.pkl"
+BUNDLE_MANIFEST_FILE = "bundle_manifest.json"
+BUNDLE_FILES = (VECTORS_FILE, DOCSTORE_FILE, SPARSE_INDEX_FILE, INDEX_VERSION_FILE, INDEX_META_FILE)
+PARTITION_FILE = "index.{}.faiss"
+PARTITION_PATTERN = re.compile(r"^index\.([a-z]{2,3})\.faiss$")
+ZIP_CACHE_DIR = os.environ.get("DP_INDEX_CACHE")  # Where '<folder>.cache' goes; default next to the zip
+
+
+def has_sqlite_docstore(index_path):
+    return os.path.exists(os.path.join(index_path, DOCSTORE_FILE))
+
+
+def _mmap_flags():
+    # IO_FLAG_MMAP_IFC maps flat codes straight from the file (no copy);
+    # older FAISS builds only have the generic IO_FLAG_MMAP
+    flags = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP)
+    return flags | faiss.IO_FLAG_READ_ONLY
+
+
+class _SQLiteReader:
+    """One read-only connection shared by Streamlit's script threads"""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_file(cls, db_path):
+        return cls(sqlite3.connect(f"file:{db_path}?mode=ro", uri=True, check_same_thread=False))
+
+    def fetchone(self, sql, params=()):
+        with self.lock:
+            return self.connection.execute(sql, params).fetchone()
+
+
+class SQLiteDocstore(Docstore):
+    """Docstore that loads chunk text + metadata lazily by id"""
+
+    def __init__(self, reader):
+        self.reader = reader
+
+    def search(self, search):
+        row = self.reader.fetchone(
+            "SELECT text, metadata FROM chunks WHERE id = ?", (search,)
+        )
+        if row is None:
+            return f"ID {search} not found."
+        return Document(id=search, page_content=row[0], metadata=json.loads(row[1]))
+
+
+class SQLiteIndexMap(Mapping):
+    """FAISS position -> docstore id, read from SQLite on demand"""
+
+    def __init__(self, reader):
+        self.reader = reader
+        self._length = reader.fetchone("SELECT COUNT(*) FROM chunks")[0]
+
+    def __getitem__(self, position):
+        row = self.reader.fetchone(
+            "SELECT id FROM chunks WHERE position = ?", (int(position),)
+        )
+        if row is None:
+            raise KeyError(position)
+        return row[0]
+
+    def __len__(self):
+        return self._length
+
+    def __iter__(self):
+        return iter(range(self._length))
+
+
+def save_index(vectorstore, index_path):
+    """Write vectors to index.faiss and chunks to docstore.sqlite (no pickle)"""
+    os.makedirs(index_path, exist_ok=True)
+    vectors_path = os.path.join(index_path, VECTORS_FILE)
+    db_path = os.path.join(index_path, DOCSTORE_FILE)
+
+    # Write to temporary names first so a crash never leaves a mixed index
+    faiss.write_index(vectorstore.index, vectors_path + ".tmp")
+
+    if os.path.exists(db_path + ".tmp"):
+        os.remove(db_path + ".tmp")
+    connection = sqlite3.connect(db_path + ".tmp")
+    connection.execute(
+        "CREATE TABLE chunks (position INTEGER PRIMARY KEY, id TEXT NOT NULL UNIQUE, "
+        "text TEXT NOT NULL, metadata TEXT NOT NULL)"
+    )
+    rows = []
+    for position, doc_id in sorted(vectorstore.index_to_docstore_id.items()):
+        doc = vectorstore.docstore.search(doc_id)
+        rows.append((position, doc_id, doc.page_content,
+                     json.dumps(doc.metadata, ensure_ascii=False)))
+    connection.executemany("INSERT INTO chunks VALUES (?, ?, ?, ?)", rows)
+    connection.commit()
+    connection.close()
+
+    os.replace(vectors_path + ".tmp", vectors_path)
+    os.replace(db_path + ".tmp", db_path)
+
+    # The pickle from older builds would be stale now
+    legacy_path = os.path.join(index_path, LEGACY_PICKLE_FILE)
+    if os.path.exists(legacy_path):
+        os.remove(legacy_path)
+
+
+def save_partitions(index_path, partitions):
+    """Write {language: index} sub-indexes and remove ones no longer built"""
+    for name in os.listdir(index_path):
+        match = PARTITION_PATTERN.match(name)
+        if match and match.group(1) not in partitions:
+            os.remove(os.path.join(index_path, name))
+    for language, index in partitions.items():
+        path = os.path.join(index_path, PARTITION_FILE.format(language))
+        faiss.write_index(index, path + ".tmp")
+        os.replace(path + ".tmp", path)
+
+
+def _bundle_files(index_path):
+    """BUNDLE_FILES plus whichever language sub-indexes exist"""
+    partitions = sorted(name for name in os.listdir(index_path) if PARTITION_PATTERN.match(name))
+    return BUNDLE_FILES + tuple(partitions)
+
+
+def _read_faiss_file(path):
+    try:
+        return faiss.read_index(path, _mmap_flags())
+    except RuntimeError as e:
+        print(f"DEBUG: mmap load not supported for this index, reading into memory: {e}")
+        return faiss.read_index(path)
+
+
+def load_index(index_path, embeddings):
+    """Open the index for serving: vectors memory-mapped, chunks loaded lazily"""
+    index = _read_faiss_file(os.path.join(index_path, VECTORS_FILE))
+
+    reader = _SQLiteReader.from_file(os.path.join(index_path, DOCSTORE_FILE))
+    return FAISS(embeddings, index, SQLiteDocstore(reader), SQLiteIndexMap(reader))
+
+
+def load_index_for_update(index_path, embeddings):
+    """Load the whole index into memory so ingestion can add/delete chunks"""
+    index = faiss.read_index(os.path.join(index_path, VECTORS_FILE))
+
+    connection = sqlite3.connect(os.path.join(index_path, DOCSTORE_FILE))
+    rows = connection.execute(
+        "SELECT position, id, text, metadata FROM chunks ORDER BY position"
+    ).fetchall()
+    connection.close()
+
+    docstore = InMemoryDocstore({
+        doc_id: Document(id=doc_id, page_content=text, metadata=json.loads(metadata))
+        for _, doc_id, text, metadata in rows
+    })
+    index_to_docstore_id = {position: doc_id for position, doc_id, _, _ in rows}
+    return FAISS(embeddings, index, docstore, index_to_docstore_id)
+
+
+# --- BUNDLE MANIFEST ---
+def _sha256_file(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _bundle_hash(files):
+    digest = hashlib.sha256()
+    for name in sorted(files):
+        digest.update(f"{name}:{files[name]['sha256']}\n".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def write_bundle_manifest(index_path):
+    """Record the hash of every serving file; call after everything else is written"""
+    files = {}
+    for name in _bundle_files(index_path):
+        path = os.path.join(index_path, name)
+        if os.path.exists(path):
+            files[name] = {"sha256": _sha256_file(path), "bytes": os.path.getsize(path)}
+
+    manifest = {"bundle_sha256": _bundle_hash(files), "files": files}
+    manifest_path = os.path.join(index_path, BUNDLE_MANIFEST_FILE)
+    with open(manifest_path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(manifest_path + ".tmp", manifest_path)
+    return manifest["bundle_sha256"]
+
+
+def _check_files(manifest, read_size, read_hash, full=False):
+    """Every file's size, and its sha256 too if full; without full only the
+    version stamp (rewritten by every ingest, a few bytes) is hashed"""
+    for name, expected in manifest["files"].items():
+        size = read_size(name)
+        if size is None:
+            raise ValueError(f"Index bundle is missing {name}")
+        hashed = full or name == INDEX_VERSION_FILE
+        if size != expected["bytes"] or (hashed and read_hash(name) != expected["sha256"]):
+            raise ValueError(f"Index bundle file {name} does not match its manifest (stale or half-written index)")
+    if _bundle_hash(manifest["files"]) != manifest["bundle_sha256"]:
+        raise ValueError("Index bundle manifest is corrupt")
+
+
+def verify_bundle(index_path, full=False):
+    """Raise ValueError if the files on disk don't match the bundle manifest;
+    False if there is no manifest to check
+
+    full hashes every file, which reads the whole index: ingest_data.py does
+    that, the app only checks sizes and the version stamp when it loads.
+    """
+    manifest_path = os.path.join(index_path, BUNDLE_MANIFEST_FILE)
+    if not os.path.exists(manifest_path):
+        print(f"DEBUG: No {BUNDLE_MANIFEST_FILE} in '{index_path}', skipping validation")
+        return False
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+
+    def read_size(name):
+        path = os.path.join(index_path, name)
+        return os.path.getsize(path) if os.path.exists(path) else None
+
+    _check_files(manifest, read_size, lambda name: _sha256_file(os.path.join(index_path, name)), full)
+    return True
+
+
+def write_bundle_zip(index_path, zip_path):
+    """Pack the serving files uncompressed, so the app can unpack them with a plain copy"""
+    with zipfile.ZipFile(zip_path + ".tmp", "w", compression=zipfile.ZIP_STORED) as archive:
+        for name in _bundle_files(index_path) + (BUNDLE_MANIFEST_FILE,):
+            path = os.path.join(index_path, name)
+            if os.path.exists(path):
+                archive.write(path, arcname=name)
+    os.replace(zip_path + ".tmp", zip_path)
+
+
+def _zip_members(archive):
+    """Map file name -> zip member, whether or not it sits under a folder"""
+    return {os.path.basename(name): name for name in archive.namelist() if not name.endswith("/")}
+
+
+def _check_zip(archive, members, full=False):
+    if BUNDLE_MANIFEST_FILE not in members:
+        return False
+
+    def read_hash(name):
+        digest = hashlib.sha256()
+        with archive.open(members[name]) as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        return digest.hexdigest()
+
+    _check_files(
+        json.loads(archive.read(members[BUNDLE_MANIFEST_FILE])),
+        lambda name: archive.getinfo(members[name]).file_size if name in members else None,
+        read_hash,
+        full,
+    )
+    return True
+
+
+def verify_bundle_zip(zip_path, full=False):
+    """verify_bundle() for an index packed by write_bundle_zip()"""
+    with zipfile.ZipFile(zip_path, "r") as archive:
+        return _check_zip(archive, _zip_members(archive), full)
+
+
+def _zip_cache_key(archive, members, zip_path):
+    if BUNDLE_MANIFEST_FILE in members:
+        return json.loads(archive.read(members[BUNDLE_MANIFEST_FILE]))["bundle_sha256"][:16]
+    # Archive from before bundle manifests
+    stat = os.stat(zip_path)
+    return f"{stat.st_size}-{stat.st_mtime_ns}"
+
+
+def extract_bundle_zip(zip_path, cache_dir=None):
+    """Unpack the zip once and return the folder, for load_index() to memory-map
+
+    Members are stored uncompressed, so this is a streamed copy, made once
+    per bundle: later starts and other processes reuse the folder (named
+    after the bundle hash) and older bundles' folders are removed.
+    """
+    name = os.path.splitext(os.path.basename(zip_path))[0] + ".cache"
+    root = os.path.join(cache_dir or ZIP_CACHE_DIR or os.path.dirname(zip_path), name)
+    with zipfile.ZipFile(zip_path, "r") as archive:
+        members = _zip_members(archive)
+        key = _zip_cache_key(archive, members, zip_path)
+        folder = os.path.join(root, key)
+        if os.path.isdir(folder):
+            try:
+                verify_bundle(folder)
+            except ValueError as e:
+                print(f"DEBUG: Unpacked index in '{folder}' is damaged, unpacking again: {e}")
+                shutil.rmtree(folder, ignore_errors=True)
+        if not os.path.isdir(folder):
+            _check_zip(archive, members)
+            print(f"Unpacking {zip_path} to '{folder}'")
+            os.makedirs(root, exist_ok=True)
+            staging = tempfile.mkdtemp(prefix=".unpack-", dir=root)
+            for name, member in members.items():
+                with archive.open(member) as source, open(os.path.join(staging, name), "wb") as target:
+                    shutil.copyfileobj(source, target, 1 << 20)
+            try:
+                os.rename(staging, folder)
+            except OSError:
+                # Another process unpacked the same bundle first
+                shutil.rmtree(staging, ignore_errors=True)
+                if not os.path.isdir(folder):
+                    raise
+    # Open files of a removed folder stay readable until they are closed
+    for name in os.listdir(root):
+        if name != key and not name.startswith(".unpack-"):
+            shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+    return folder
+
+
+def open_index(index_path, embeddings):
+    """Load the serving index from its folder, or from '<folder>.zip' unpacked once"""
+    if not os.path.isdir(index_path):
+        zip_path = index_path + ".zip"
+        if not os.path.exists(zip_path):
+            raise FileNotFoundError(f"No index found at '{index_path}/' or '{zip_path}'")
+        index_path = extract_bundle_zip(zip_path)
+    else:
+        verify_bundle(index_path)
+
+    if has_sqlite_docstore(index_path):
+        return load_index(index_path, embeddings)
+    # Older index built with a pickled docstore
+    return FAISS.load_local(index_path, embeddings, allow_dangerous_deserialization=True)
+
+
+def open_partitions(index_path, languages):
+    """Load the language sub-indexes named in index_meta.json; {language: index}"""
+    if not os.path.isdir(index_path):
+        zip_path = index_path + ".zip"
+        if not os.path.exists(zip_path):
+            return {}
+        index_path = extract_bundle_zip(zip_path)
+
+    partitions = {}
+    for language in languages:
+        path = os.path.join(index_path, PARTITION_FILE.format(language))
+        if os.path.exists(path):
+            partitions[language] = _read_faiss_file(path)
+    return partitions
@@ -1,99 +1,767 @@
 """
 Digital Protection - Knowledge Base Ingestion Script
 Supports both English and Arabic content (UTF-8)
+
+Usage:
+    python ingest_data.py                 # Full rebuild
+    python ingest_data.py --incremental   # Only embed new/changed chunks
+    python ingest_data.py --workers 4 --batch-size 128
+    python ingest_data.py --index-type hnsw --index-param ef_search=96
 """
 
 import os
+import re
+import sys
+import json
+import time
+import hashlib
+import argparse
+import unicodedata
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_core.documents import Document
 from langchain_community.document_loaders import TextLoader
-from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_community.vectorstores import FAISS
-from langchain_huggingface import HuggingFaceEmbeddings
-import shutil
+from context_builder import estimate_tokens
+from embedding_backends import EMBEDDING_MODEL, DEFAULT_BACKEND, create_embeddings
+from response_cache import write_index_version
+from sparse_index import build_sparse_index
+from ann_index import (
+    INDEX_TYPES, build_ann_index, flat_vectors, index_meta, index_type_of,
+    read_index_meta, to_flat_index, write_index_meta,
+)
+from index_store import (
+    save_index, save_partitions, load_index_for_update, has_sqlite_docstore,
+    verify_bundle, verify_bundle_zip, write_bundle_manifest, write_bundle_zip,
+)
+
+# --- SETTINGS ---
+DATA_FOLDER = "data"
+INDEX_PATH = "faiss_index"
+MANIFEST_FILE = "ingest_manifest.json"
+EMBEDDING_BACKEND = DEFAULT_BACKEND  # torch, onnx or onnx-int8
+CHUNK_TOKENS = 128      # The embedding model reads at most 128 tokens; the rest of a longer chunk is ignored
+TOKENIZER_MODEL = f"sentence-transformers/{EMBEDDING_MODEL}"
+DEDUPE_CHUNKS = True    # Skip chunks whose normalised text is already indexed
+BATCH_SIZE = 64         # Chunks per embedding call
+WORKERS = 1             # Embedding processes (0 = one per CPU core)
+INDEX_TYPE = "flat"     # flat, hnsw, ivfpq or sq8 (see ann_index.py)
+CHUNK_METADATA = ["source", "language", "heading", "content_hash"]
+
+HEADING_PATTERN = re.compile(r"^(#{1,6})\s+(.*\w.*?)\s*$", flags=re.MULTILINE)
+RULE_PATTERN = re.compile(r"^[ \t]*(?:-{3,}|\*{3,}|_{3,})[ \t]*$", flags=re.MULTILINE)
+# Line breaks, and whitespace after . ! ? ؟ … (optionally followed by a closing quote or bracket)
+SENTENCE_BOUNDARY = re.compile(r"\s*\n\s*|(?:(?<=[.!?؟…])|(?<=[.!?؟…][\"'”’»)\]]))\s+")
+CLAUSE_BOUNDARY = re.compile(r"(?<=[,،;؛:])\s+")
+WORD_BOUNDARY = re.compile(r"\s+")
+UNIT_BOUNDARIES = (SENTENCE_BOUNDARY, CLAUSE_BOUNDARY, WORD_BOUNDARY)
+ARABIC_DIACRITICS = re.compile(r"[\u0610-\u061A\u064B-\u065F\u0670\u06D6-\u06ED\u0640]")  # Incl. tatweel
+ARABIC_VARIANTS = str.maketrans({"أ": "ا", "إ": "ا", "آ": "ا", "ٱ": "ا", "ى": "ي", "ة": "ه"})
+NON_WORD = re.compile(r"[\W_]+")
+ARABIC_LETTERS = re.compile(r"[\u0600-\u06FF\u0750-\u077F\u08A0-\u08FF]")
+LETTERS = re.compile(r"[^\W\d_]")
+
+
+def file_hash(file_path):
+    """SHA-256 of a file's bytes"""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 16), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def assign_chunk_ids(chunks):
+    """Give each chunk a content-hashed docstore id (stable across runs)"""
+    seen = {}
+    ids = []
+    for chunk in chunks:
+        source = chunk.metadata.get("source", "")
+        key = hashlib.sha256(f"{source}\0{chunk.page_content}".encode("utf-8")).hexdigest()
+        # Identical text repeated inside one file still needs distinct ids
+        occurrence = seen.get(key, 0)
+        seen[key] = occurrence + 1
+        ids.append(f"{key[:32]}-{occurrence}")
+    return ids
+
+
+def load_text_file(file_path):
+    """Load one .txt file, retrying with utf-8-sig if plain UTF-8 fails"""
+    filename = os.path.basename(file_path)
+    print(f"Loading: {file_path}")
+
+    try:
+        # Use UTF-8 encoding to support Arabic
+        loader = TextLoader(file_path, encoding="utf-8")
+        documents = loader.load()
+        print(f"  ✓ Loaded {len(documents)} document(s) from {filename}")
+        return documents
+    except Exception as e:
+        print(f"  ✗ Error loading {filename}: {e}")
+
+        # Try alternative encoding if UTF-8 fails
+        try:
+            print(f"  Trying alternative encoding...")
+            loader = TextLoader(file_path, encoding="utf-8-sig")
+            documents = loader.load()
+            print(f"  ✓ Loaded with utf-8-sig encoding")
+            return documents
+        except Exception as e2:
+            print(f"  ✗ Still failed: {e2}")
+            return None
+
+
+def chunk_language(text):
+    """'ar' when most letters are Arabic, else 'en' (chunks mix in Latin acronyms)"""
+    letters = len(LETTERS.findall(text))
+    return "ar" if letters and len(ARABIC_LETTERS.findall(text)) * 2 >= letters else "en"
+
+
+def heading_path(headings, position):
+    """'Title > Section > Subsection' in force at a character position"""
+    stack = []
+    for start, level, title in headings:
+        if start > position:
+            break
+        stack = [entry for entry in stack if entry[0] < level] + [(level, title)]
+    return " > ".join(title for _, title in stack)
+
+
+def tag_chunks(document, chunks):
+    """Add language, section heading and content hash to each chunk's metadata"""
+    text = document.page_content
+    headings = [(m.start(), len(m.group(1)), m.group(2)) for m in HEADING_PATTERN.finditer(text)]
+    for chunk in chunks:
+        start = chunk.metadata.pop("start_index", -1)
+        # A chunk that opens with headings belongs to the last of them
+        body = re.search(r"^(?!\s*#|\s*$)", chunk.page_content, flags=re.MULTILINE)
+        position = start + (body.start() if body else len(chunk.page_content))
+        chunk.metadata.update(
+            language=chunk_language(chunk.page_content),
+            heading=heading_path(headings, position) if start >= 0 else "",
+            content_hash=hashlib.sha256(chunk.page_content.encode("utf-8")).hexdigest(),
+        )
+    return chunks
+
+
+_token_counter = None
+
+
+def token_counter():
+    """(count, name): the embedding model's own tokenizer, or the rough estimate if it can't load"""
+    global _token_counter
+    if _token_counter is None:
+        try:
+            # transformers comes with sentence-transformers
+            from transformers import AutoTokenizer
+            tokenizer = AutoTokenizer.from_pretrained(TOKENIZER_MODEL)
+            _token_counter = (lambda text: len(tokenizer.encode(text, add_special_tokens=False)), TOKENIZER_MODEL)
+        except Exception as e:
+            print(f"  ✗ Tokenizer not loaded, sizing chunks by estimate: {e}")
+            _token_counter = (estimate_tokens, "estimate")
+    return _token_counter
+
+
+class _Section:
+    """A heading, the text up to its first subheading (own_end) and its subsections (up to end)"""
+
+    def __init__(self, level, start):
+        self.level = level
+        self.start = start
+        self.own_end = start
+        self.end = start
+        self.children = []
+
+    def close(self, text, end):
+        self.end = end
+        self.own_end = self.children[0].start if self.children else end
+        # Headings with no text of their own go with the first subsection
+        if self.children and not HEADING_PATTERN.sub("", text[self.start:self.own_end]).strip():
+            self.children[0].start = self.start
+            self.own_end = self.start
+        for child, following in zip(self.children, self.children[1:] + [None]):
+            child.close(text, following.start if following else end)
+
+
+def _section_tree(text, start, end, headings):
+    """Headings between start and end as a tree under a level-0 root"""
+    root = _Section(0, start)
+    stack = [root]
+    for position, level in headings:
+        if start <= position < end:
+            while stack[-1].level >= level:
+                stack.pop()
+            section = _Section(level, position)
+            stack[-1].children.append(section)
+            stack.append(section)
+    root.close(text, end)
+    return root
+
+
+def _units(text, start, end, budget, count, depth=0):
+    """(start, end, tokens) of the sentences in text[start:end]; longer ones are cut at clauses, then words"""
+    edges = [start]
+    for match in UNIT_BOUNDARIES[depth].finditer(text, start, end):
+        edges += [match.start(), match.end()]
+    edges.append(end)
+    units = []
+    for piece_start, piece_end in zip(edges[::2], edges[1::2]):
+        piece = text[piece_start:piece_end]
+        if not piece.strip():
+            continue
+        tokens = count(piece)
+        if tokens > budget and depth + 1 < len(UNIT_BOUNDARIES):
+            units.extend(_units(text, piece_start, piece_end, budget, count, depth + 1))
+        else:
+            units.append((piece_start, piece_end, tokens))
+    return units
+
+
+def _pack(units, budget):
+    """Consecutive units joined into spans of at most budget tokens, evenly sized"""
+    total = sum(tokens for _, _, tokens in units)
+    target = total / max(1, -(-total // budget))
+    spans = []
+    for start, end, tokens in units:
+        if spans and spans[-1][2] + tokens <= budget and spans[-1][2] < target:
+            spans[-1] = (spans[-1][0], end, spans[-1][2] + tokens)
+        else:
+            spans.append((start, end, tokens))
+    return spans
+
+
+def _chunk_section(text, section, budget, count):
+    """[(start, end, tokens, whole)] covering a section; whole spans may merge with their neighbours
+
+    A section that fits is one span. Otherwise its own text is packed by
+    sentence and each subsection is chunked the same way; whole subsections
+    (and own text that fit in one span) are then joined while they fit.
+    """
+    body = text[section.start:section.end]
+    if not body.strip():
+        return []
+    tokens = count(body)
+    if tokens <= budget:
+        return [(section.start, section.end, tokens, True)]
+
+    own = _pack(_units(text, section.start, section.own_end, budget, count), budget)
+    spans = [(start, end, tokens, len(own) == 1) for start, end, tokens in own]
+    for child in section.children:
+        child_spans = _chunk_section(text, child, budget, count)
+        if len(child_spans) > 1:
+            # Pieces of a split subsection stay apart from their neighbours
+            child_spans = [(start, end, tokens, False) for start, end, tokens, _ in child_spans]
+        spans.extend(child_spans)
+
+    merged = []
+    for span in spans:
+        if merged and merged[-1][3] and span[3] and merged[-1][2] + span[2] <= budget:
+            merged[-1] = (merged[-1][0], span[1], merged[-1][2] + span[2], True)
+        else:
+            merged.append(span)
+    return merged
+
+
+def chunk_text(text, budget, count):
+    """(start, end) spans of text: sections by heading, split at sentence boundaries to fit budget
+
+    Horizontal rules are hard breaks. Chunks never overlap: each one
+    carries its heading path in metadata instead.
+    """
+    headings = [(m.start(), len(m.group(1))) for m in HEADING_PATTERN.finditer(text)]
+    breaks = [0] + [position for m in RULE_PATTERN.finditer(text) for position in (m.start(), m.end())] + [len(text)]
+    spans = []
+    for start, end in zip(breaks[::2], breaks[1::2]):
+        for span_start, span_end, _, _ in _chunk_section(text, _section_tree(text, start, end, headings), budget, count):
+            piece = text[span_start:span_end]
+            if piece.strip():
+                span_start += len(piece) - len(piece.lstrip())
+                spans.append((span_start, span_start + len(piece.strip())))
+    return spans
+
+
+def split_documents(documents):
+    """Split documents into tagged chunks of at most CHUNK_TOKENS model tokens"""
+    count, _ = token_counter()
+    # Leave room for the start and end tokens the model adds
+    budget = CHUNK_TOKENS - 2
+    chunks = []
+    for document in documents:
+        text = document.page_content
+        pieces = [
+            Document(page_content=text[start:end], metadata={**document.metadata, "start_index": start})
+            for start, end in chunk_text(text, budget, count)
+        ]
+        chunks.extend(tag_chunks(document, pieces))
+    return chunks
+
+
+def near_duplicate_key(text):
+    """Hash of text ignoring case, punctuation, spacing, Arabic diacritics and letter variants"""
+    text = unicodedata.normalize("NFKC", text).casefold()
+    text = ARABIC_DIACRITICS.sub("", text).translate(ARABIC_VARIANTS)
+    text = NON_WORD.sub(" ", text).strip()
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:32]
+
+
+def drop_near_duplicates(chunks, seen):
+    """(kept chunks, their keys, keys of dropped chunks); seen (keys already indexed) is updated"""
+    kept, keys, duplicates = [], [], []
+    for chunk in chunks:
+        key = near_duplicate_key(chunk.page_content)
+        if key in seen:
+            duplicates.append(key)
+            continue
+        seen.add(key)
+        kept.append(chunk)
+        keys.append(key)
+    return kept, keys, duplicates
+
+
+def manifest_settings(embedding_backend=EMBEDDING_BACKEND):
+    """Settings that invalidate every stored vector when they change"""
+    return {
+        "embedding_model": EMBEDDING_MODEL,
+        "embedding_backend": embedding_backend,
+        "chunk_tokens": CHUNK_TOKENS,
+        "tokenizer": token_counter()[1],
+        "dedupe_chunks": DEDUPE_CHUNKS,
+        "chunk_metadata": CHUNK_METADATA,
+    }
+
+
+def load_manifest(index_path):
+    """Read the per-file/per-chunk hash manifest written by the last run"""
+    manifest_path = os.path.join(index_path, MANIFEST_FILE)
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_manifest(index_path, files, embedding_backend=EMBEDDING_BACKEND, index_settings=None):
+    manifest = {"settings": manifest_settings(embedding_backend), "files": files, "index": index_settings}
+    with open(os.path.join(index_path, MANIFEST_FILE), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False)
+
+
+# --- EMBEDDING WORKERS ---
+_worker_embeddings = None
+
+
+def _init_embedding_worker(backend, threads):
+    """Load the embedding model once per worker process"""
+    global _worker_embeddings
+    try:
+        import torch
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+    _worker_embeddings = create_embeddings(backend)
+
+
+def _embed_batch(texts):
+    return _worker_embeddings.embed_documents(texts)
+
+
+class PooledEmbeddings(Embeddings):
+    """Embeddings that fan batches out to a pool of worker processes"""
+
+    def __init__(self, backend, workers):
+        threads = max(1, (os.cpu_count() or 1) // workers)
+        # spawn, not fork: torch's thread pools don't survive a fork
+        self.executor = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_embedding_worker,
+            initargs=(backend, threads),
+        )
+        self.workers = workers
+
+    def submit(self, texts):
+        return self.executor.submit(_embed_batch, texts)
+
+    def embed_documents(self, texts):
+        return self.submit(list(texts)).result()
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+    def close(self):
+        self.executor.shutdown()
+
+
+class _Done:
+    """Already-finished stand-in for a Future (single-process embedding)"""
+
+    def __init__(self, value):
+        self.value = value
+
+    def result(self):
+        return self.value
+
+
+def create_ingest_embeddings(workers, backend):
+    print(f"Embedding backend: {backend}")
+    if workers > 1:
+        print(f"Embedding with {workers} worker processes")
+        return PooledEmbeddings(backend, workers)
+    return create_embeddings(backend)
+
+
+def iter_batches(items, batch_size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def embed_into_index(vectorstore, chunk_stream, embeddings, batch_size):
+    """Embed (chunk, id) pairs in batches and add each batch to the index
+
+    At most two batches per worker are in flight, so memory stays bounded no
+    matter how large the corpus is. Returns (vectorstore, chunks_added).
+    """
+    max_in_flight = 2 * getattr(embeddings, "workers", 1)
+    pending = deque()
+    added = 0
+    started = time.time()
+
+    def flush_one(vectorstore):
+        batch, future = pending.popleft()
+        vectors = future.result()
+        texts = [chunk.page_content for chunk, _ in batch]
+        metadatas = [chunk.metadata for chunk, _ in batch]
+        ids = [chunk_id for _, chunk_id in batch]
+        if vectorstore is None:
+            vectorstore = FAISS.from_embeddings(
+                zip(texts, vectors), embeddings, metadatas=metadatas, ids=ids
+            )
+        else:
+            vectorstore.add_embeddings(zip(texts, vectors), metadatas=metadatas, ids=ids)
+        return vectorstore, len(batch)
+
+    for batch in iter_batches(chunk_stream, batch_size):
+        texts = [chunk.page_content for chunk, _ in batch]
+        if isinstance(embeddings, PooledEmbeddings):
+            pending.append((batch, embeddings.submit(texts)))
+        else:
+            pending.append((batch, _Done(embeddings.embed_documents(texts))))
+
+        while len(pending) >= max_in_flight:
+            vectorstore, count = flush_one(vectorstore)
+            added += count
+            elapsed = time.time() - started
+            print(f"  ✓ {added} chunks embedded ({added / elapsed:.1f} chunks/s)")
+
+    while pending:
+        vectorstore, count = flush_one(vectorstore)
+        added += count
+        elapsed = time.time() - started
+        print(f"  ✓ {added} chunks embedded ({added / elapsed:.1f} chunks/s)")
+
+    return vectorstore, added
+
+
+def _build_or_flat(vectors, index_type, index_params=None, ids=None):
+    try:
+        return build_ann_index(vectors, index_type, index_params, ids=ids)
+    except ValueError as e:
+        print(f"  ✗ {e} - using a flat index")
+        return build_ann_index(vectors, "flat", ids=ids)
+
+
+def chunk_languages(vectorstore):
+    """{language: [positions]} from the chunks' metadata"""
+    languages = {}
+    for position, doc_id in sorted(vectorstore.index_to_docstore_id.items()):
+        language = vectorstore.docstore.search(doc_id).metadata.get("language")
+        if language:
+            languages.setdefault(language, []).append(position)
+    return languages
+
+
+def build_search_index(vectorstore, index_type, index_params=None):
+    """Swap the flat index ingestion built for the requested type, plus one
+    sub-index per chunk language; returns (metadata, {language: index})
+
+    Sub-index ids are positions in the main index, so a language-filtered
+    search gets a full k from its own language without a post-filter.
+    """
+    flat = to_flat_index(vectorstore.index)
+    started = time.time()
+    if index_type == "flat":
+        meta = index_meta(flat, "flat")
+    else:
+        vectorstore.index, meta = _build_or_flat(flat_vectors(flat), index_type, index_params)
+        print(f"  ✓ Built {meta['type']} index in {time.time() - started:.1f}s ({meta['build']})")
+
+    partitions = {}
+    meta["partitions"] = {}
+    languages = chunk_languages(vectorstore)
+    if len(languages) > 1:  # One language: the main index already is its partition
+        for language, positions in sorted(languages.items()):
+            vectors = flat.reconstruct_batch(np.array(positions, dtype=np.int64))
+            partitions[language], meta["partitions"][language] = _build_or_flat(
+                vectors, meta["type"], index_params, ids=positions
+            )
+            print(f"  ✓ '{language}' sub-index: {len(positions)} chunks")
+    return meta, partitions
+
+
+def data_unchanged(data_folder, manifest):
+    """True if the .txt files are exactly those the manifest was built from"""
+    names = sorted(name for name in os.listdir(data_folder) if name.endswith(".txt"))
+    return names == sorted(manifest["files"]) and all(
+        file_hash(os.path.join(data_folder, name)) == manifest["files"][name]["sha256"] for name in names
+    )
+
+
+def recorded_index_settings(index_path):
+    """{"type", "params"} the existing index was asked for by the last run (or,
+    before runs recorded it, built with per index_meta.json); None if no index"""
+    manifest = load_manifest(index_path)
+    if manifest and manifest.get("index"):
+        return manifest["index"]
+    meta = read_index_meta(index_path) if os.path.isdir(index_path) else None
+    if meta:
+        return {"type": meta["type"], "params": {**meta.get("build", {}), **meta.get("search", {})}}
+    return None
+
+
+def pack_zip(index_path):
+    write_bundle_zip(index_path, index_path + ".zip")
+    print(f"✓ Packed '{index_path}.zip' (uncompressed; the app unpacks it once and memory-maps it)")
+
+
+def update_knowledge_base(incremental=False, batch_size=BATCH_SIZE, workers=WORKERS, write_zip=False,
+                          embedding_backend=EMBEDDING_BACKEND, data_folder=DATA_FOLDER, index_path=INDEX_PATH,
+                          index_type=None, index_params=None):
+    """Load knowledge base files and create (or incrementally update) the FAISS index
+
+    index_type / index_params default to those of the existing index, so a
+    run without --index-type doesn't turn an HNSW or SQ8 index back into flat.
+    """
 
-def update_knowledge_base():
-    """Load knowledge base files and create FAISS index"""
-    
     print("--- Starting Knowledge Base Ingestion ---")
-    
-    # Path to data folder
-    data_folder = "data"
-    
+
+    if workers == 0:
+        workers = os.cpu_count() or 1
+
     # Check if data folder exists
     if not os.path.exists(data_folder):
         print(f"Error: '{data_folder}' folder not found!")
         print("Please create a 'data' folder and add your knowledge_base.txt file.")
         return
-    
-    # Find all text files
-    all_documents = []
-    
-    for filename in os.listdir(data_folder):
-        if filename.endswith(".txt"):
-            file_path = os.path.join(data_folder, filename)
-            print(f"Loading: {file_path}")
-            
-            try:
-                # Use UTF-8 encoding to support Arabic
-                loader = TextLoader(file_path, encoding="utf-8")
-                documents = loader.load()
-                all_documents.extend(documents)
-                print(f"  ✓ Loaded {len(documents)} document(s) from {filename}")
-            except Exception as e:
-                print(f"  ✗ Error loading {filename}: {e}")
-                
-                # Try alternative encoding if UTF-8 fails
-                try:
-                    print(f"  Trying alternative encoding...")
-                    loader = TextLoader(file_path, encoding="utf-8-sig")
-                    documents = loader.load()
-                    all_documents.extend(documents)
-                    print(f"  ✓ Loaded with utf-8-sig encoding")
-                except Exception as e2:
-                    print(f"  ✗ Still failed: {e2}")
-                    continue
-    
-    if not all_documents:
+
+    recorded = recorded_index_settings(index_path)
+    if index_type is None and recorded:
+        print(f"Keeping the existing index type: {recorded['type']} {recorded['params'] or ''}")
+    if index_type is None:
+        index_type = recorded["type"] if recorded else INDEX_TYPE
+    if index_params is None:
+        index_params = recorded["params"] if recorded and recorded["type"] == index_type else {}
+    index_settings = {"type": index_type, "params": index_params}
+
+    # Decide whether the existing index can be updated in place
+    manifest = load_manifest(index_path) if incremental else None
+    if incremental:
+        if manifest is None or not os.path.exists(os.path.join(index_path, "index.faiss")):
+            print("No manifest from a previous run - doing a full rebuild.")
+            manifest = None
+        elif manifest.get("settings") != manifest_settings(embedding_backend):
+            print("Embedding model or chunking settings changed - doing a full rebuild.")
+            manifest = None
+        elif (read_index_meta(index_path) or {}).get("type") in ("ivfpq", "sq8"):
+            # PQ codes can't be turned back into the vectors they came from, and
+            # SQ8 codes only approximately: re-quantizing them each run adds error
+            if manifest.get("index") == index_settings and data_unchanged(data_folder, manifest):
+                print("\n✓ Knowledge base already up to date - nothing to do.")
+                if write_zip:
+                    pack_zip(index_path)
+                return
+            print("IVF-PQ / SQ8 index can't be updated in place - doing a full rebuild.")
+            manifest = None
+    if manifest:
+        # Every file's hash, which the app skips at load (it checks sizes)
+        try:
+            verify_bundle(index_path, full=True)
+        except ValueError as e:
+            print(f"{e} - doing a full rebuild.")
+            manifest = None
+    old_files = manifest["files"] if manifest else {}
+
+    # Pass 1: hash every text file (cheap) to find what changed
+    files = {}
+    changed = []
+    for filename in sorted(os.listdir(data_folder)):
+        if not filename.endswith(".txt"):
+            continue
+        file_path = os.path.join(data_folder, filename)
+        digest = file_hash(file_path)
+        previous = old_files.get(filename)
+
+        # Unchanged file: keep its stored vectors, don't even re-read it
+        if previous and previous["sha256"] == digest:
+            print(f"Unchanged: {file_path}")
+            files[filename] = previous
+        else:
+            changed.append((filename, file_path, digest))
+
+    # Files that disappeared from data/
+    stale_ids = []
+    for filename, previous in old_files.items():
+        if not os.path.exists(os.path.join(data_folder, filename)):
+            print(f"Removed: {filename}")
+            stale_ids.extend(previous["chunks"])
+
+    # An unchanged file that skipped chunks as duplicates of a changed or
+    # removed file's must be split again, or that text could drop out
+    replaced = set()
+    for filename, previous in old_files.items():
+        if filename not in files:
+            replaced.update(previous.get("fingerprints", []))
+    for filename in sorted(files):
+        if replaced.intersection(files[filename].get("duplicates", [])):
+            print(f"Re-splitting: {filename} (a chunk it skipped as a duplicate changed)")
+            changed.append((filename, os.path.join(data_folder, filename), files.pop(filename)["sha256"]))
+    changed.sort()
+
+    if not changed and not files:
         print("\nNo documents found! Please add .txt files to the 'data' folder.")
         return
-    
-    print(f"\n--- Total documents loaded: {len(all_documents)} ---")
-    
-    # Split documents into chunks
-    print("\n--- Splitting documents into chunks ---")
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=800,       # Increased from 500
-        chunk_overlap=150,     # Increased from 50 to keep more context between chunks
-        length_function=len,
-        separators=["\n\n", "\n", ".", "!", "?", ",", " ", ""]
-    )
-    
-    chunks = text_splitter.split_documents(all_documents)
-    print(f"Created {len(chunks)} chunks")
-    
+
+    if manifest and not changed and not stale_ids:
+        if manifest.get("index") == index_settings:
+            print("\n✓ Knowledge base already up to date - nothing to do.")
+            if write_zip:
+                pack_zip(index_path)
+            return
+        print("\nIndex type or parameters changed - rebuilding the search index.")
+
+    # Pass 2: lazily load + split changed files, one at a time
+    stats = {"documents": 0, "duplicates": 0}
+    # Near-duplicate keys of chunks already in the index (kept from unchanged files)
+    seen = {key for entry in files.values() for key in entry.get("fingerprints", [])}
+
+    def iter_new_chunks():
+        for filename, file_path, digest in changed:
+            previous = old_files.get(filename)
+            documents = load_text_file(file_path)
+            if documents is None:
+                # Keep the previous version of a file we could not read
+                if previous:
+                    files[filename] = previous
+                continue
+            stats["documents"] += len(documents)
+
+            chunks = split_documents(documents)
+            fingerprints, duplicates = [], []
+            if DEDUPE_CHUNKS:
+                chunks, fingerprints, duplicates = drop_near_duplicates(chunks, seen)
+                stats["duplicates"] += len(duplicates)
+            ids = assign_chunk_ids(chunks)
+            old_ids = set(previous["chunks"]) if previous else set()
+            stale_ids.extend(old_ids.difference(ids))
+            files[filename] = {"sha256": digest, "chunks": ids, "fingerprints": fingerprints, "duplicates": duplicates}
+            skipped = f" ({len(duplicates)} near-duplicates skipped)" if duplicates else ""
+            print(f"  {len(chunks)} chunks from {filename}{skipped}")
+
+            for chunk, chunk_id in zip(chunks, ids):
+                if chunk_id not in old_ids:
+                    yield chunk, chunk_id
+
     # Create embeddings
     print("\n--- Creating embeddings (this may take a moment) ---")
-    embeddings = HuggingFaceEmbeddings(model_name="paraphrase-multilingual-MiniLM-L12-v2")
-    
-    # Create FAISS index
-    print("\n--- Building FAISS vector store ---")
-    vectorstore = FAISS.from_documents(chunks, embeddings)
-    
+    embeddings = create_ingest_embeddings(workers, embedding_backend)
+
+    try:
+        vectorstore = None
+        if manifest:
+            # Update the existing FAISS index in place
+            print("\n--- Updating FAISS vector store ---")
+            if has_sqlite_docstore(index_path):
+                vectorstore = load_index_for_update(index_path, embeddings)
+            else:
+                # Index built before the SQLite docstore: read the old pickle once
+                vectorstore = FAISS.load_local(
+                    index_path,
+                    embeddings,
+                    allow_dangerous_deserialization=True
+                )
+            if index_type_of(vectorstore.index) != "flat":
+                # HNSW can't delete; add/delete on flat, then rebuild below
+                vectorstore.index = to_flat_index(vectorstore.index)
+        else:
+            print("\n--- Building FAISS vector store ---")
+
+        vectorstore, embedded = embed_into_index(vectorstore, iter_new_chunks(), embeddings, batch_size)
+    finally:
+        if isinstance(embeddings, PooledEmbeddings):
+            embeddings.close()
+
+    if vectorstore is None:
+        print("\nNo chunks could be loaded from the 'data' folder.")
+        return
+
+    if stale_ids:
+        vectorstore.delete(stale_ids)
+        print(f"  ✓ Deleted {len(stale_ids)} stale chunk(s)")
+
+    total_chunks = sum(len(entry["chunks"]) for entry in files.values())
+    if total_chunks == 0:
+        print("\nNo documents found! Please add .txt files to the 'data' folder.")
+        return
+
     # Save the index
-    index_path = "faiss_index"
-    vectorstore.save_local(index_path)
+    print(f"\n--- Building {index_type} search index ---")
+    search_index, partitions = build_search_index(vectorstore, index_type, index_params)
+    save_index(vectorstore, index_path)
+    save_partitions(index_path, partitions)
+    write_index_meta(index_path, search_index)
+    save_manifest(index_path, files, embedding_backend, index_settings)
     print(f"\n✓ FAISS index saved to '{index_path}/' folder")
-    
-    # Compress the index
-    print("\n--- Compressing FAISS index ---")
-    shutil.make_archive("faiss_index", 'zip', index_path)
-    print("✓ Compressed to 'faiss_index.zip'")
-    
+
+    # BM25 postings for exact-token queries, aligned with FAISS positions
+    positions = sorted(vectorstore.index_to_docstore_id.items())
+    docs = [vectorstore.docstore.search(doc_id) for _, doc_id in positions]
+    vocab_size = build_sparse_index(
+        [doc.page_content for doc in docs],
+        [doc_id for _, doc_id in positions],
+        index_path,
+        languages=[doc.metadata.get("language", "") for doc in docs],
+    )
+    print(f"✓ Sparse (BM25) index saved ({vocab_size} terms)")
+
+    # Stamp the new index so the app drops answers cached against the old one
+    index_version = write_index_version(index_path)
+    print(f"✓ Index version: {index_version}")
+
+    # Manifest goes last: the app refuses a bundle whose files don't match it
+    bundle_hash = write_bundle_manifest(index_path)
+    print(f"✓ Bundle manifest written (sha256 {bundle_hash[:12]}...)")
+
+    if write_zip:
+        pack_zip(index_path)
+
     # Summary
     print("\n" + "="*50)
     print("SUCCESS! Knowledge base updated.")
     print("="*50)
-    print(f"Documents processed: {len(all_documents)}")
-    print(f"Chunks created: {len(chunks)}")
+    print(f"Documents processed: {stats['documents']}")
+    print(f"Chunks in index: {total_chunks}")
+    print(f"Chunks embedded this run: {embedded}")
+    print(f"Near-duplicate chunks skipped: {stats['duplicates']}")
+    print(f"Chunk size: at most {CHUNK_TOKENS} tokens ({token_counter()[1]})")
+    print(f"Index type: {search_index['type']} {search_index['search'] or ''}")
+    print(f"Language sub-indexes: {', '.join(partitions) or 'none (single language)'}")
     print(f"Index saved to: {index_path}/")
     print("\nNext steps:")
     print("1. Upload the 'faiss_index' folder to GitHub")
@@ -101,4 +769,42 @@ def update_knowledge_base():
     print("="*50)
 
 if __name__ == "__main__":
-    update_knowledge_base()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Build the Digital Protection FAISS index")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Only embed new/changed chunks and delete removed ones")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE,
+                        help=f"Chunks per embedding batch (default {BATCH_SIZE})")
+    parser.add_argument("--workers", type=int, default=WORKERS,
+                        help="Embedding worker processes, 0 = one per CPU core (default 1)")
+    parser.add_argument("--embedding-backend", choices=("torch", "onnx", "onnx-int8"), default=EMBEDDING_BACKEND,
+                        help=f"Embedding backend (default {EMBEDDING_BACKEND}); changing it forces a full rebuild")
+    parser.add_argument("--zip", action="store_true",
+                        help="Also pack the index into faiss_index.zip for deployment")
+    parser.add_argument("--index-type", choices=INDEX_TYPES,
+                        help=f"FAISS index type (default: the existing index's, else {INDEX_TYPE}); see ann_index.py")
+    parser.add_argument("--index-param", action="append", default=[], metavar="NAME=VALUE",
+                        help="Index build/search parameter, e.g. m=32, ef_search=96, nlist=1024, nprobe=32, pq_m=48 "
+                             "(default: the existing index's, if --index-type is unchanged)")
+    parser.add_argument("--verify", action="store_true",
+                        help="Only check the sha256 of every index file (and the zip) against the bundle manifest")
+    args = parser.parse_args()
+    if args.verify:
+        for path, verify in ((INDEX_PATH, verify_bundle), (INDEX_PATH + ".zip", verify_bundle_zip)):
+            if os.path.exists(path):
+                try:
+                    if not verify(path, full=True):
+                        print(f"✗ '{path}' has no bundle manifest (built before manifests: rebuild it)")
+                        sys.exit(1)
+                    print(f"✓ '{path}' matches its bundle manifest")
+                except ValueError as e:
+                    print(f"✗ '{path}': {e}")
+                    sys.exit(1)
+        sys.exit(0)
+    index_params = {} if args.index_param else None
+    for param in args.index_param:
+        name, _, value = param.partition("=")
+        index_params[name.strip()] = int(value)
+    update_knowledge_base(incremental=args.incremental, batch_size=args.batch_size,
+                          workers=args.workers, write_zip=args.zip,
+                          embedding_backend=args.embedding_backend,
+                          index_type=args.index_type, index_params=index_params)
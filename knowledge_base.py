@@ -0,0 +1,153 @@
+"""
+Digital Protection - Knowledge Base Search
+The FAISS index, its BM25 companion and the query embedder behind one small
+interface. The app uses it in-process, or talks to the same interface through
+embedding_sidecar.py when several app processes share one box.
+"""
+
+import time
+
+import numpy as np
+from langchain_core.documents import Document
+
+from index_store import open_index, open_partitions
+from ann_index import configure_search, read_index_meta
+from embedding_backends import DEFAULT_BACKEND, backend_from_env, check_against_index, create_embeddings
+from sparse_index import load_sparse_index, reciprocal_rank_fusion
+
+
+class LocalKnowledgeBase:
+    """Embeds and searches inside this process"""
+
+    def __init__(self, vectorstore, sparse_index=None, k=4, fetch_k=10, partitions=None, reranker=None):
+        self.vectorstore = vectorstore
+        self.sparse_index = sparse_index
+        self.partitions = partitions or {}  # {language: sub-index returning main-index positions}
+        self.reranker = reranker
+        self.k = k
+        # The cross-encoder picks k from a wider pool of candidates
+        self.fetch_k = max(fetch_k, reranker.candidates) if reranker else fetch_k
+
+    def embed_query(self, text):
+        return self.vectorstore.embeddings.embed_query(text)
+
+    def embed_queries(self, texts):
+        """One forward pass for several queries"""
+        return self.vectorstore.embeddings.embed_documents(texts)
+
+    def search(self, vector, sparse_query=None, language=None, query=None):
+        """Search FAISS (and BM25) for an embedded query; returns (docs, stages)
+
+        With a sparse index, the top fetch_k dense and BM25 hits are merged
+        with reciprocal rank fusion before keeping k. Each doc carries its
+        fused score in metadata["relevance"]. A language with its own
+        sub-index is searched there, so every result slot is in that language.
+        With a reranker, the fused candidates are rescored against query (or
+        sparse_query) and at most k above its cutoff are kept.
+        """
+        started = time.perf_counter()
+        use_sparse = self.sparse_index is not None and sparse_query
+        rerank_query = (query or sparse_query) if self.reranker else None
+        index = self.partitions.get(language)
+        if index is None or index.ntotal < self.k:
+            index, language = self.vectorstore.index, None
+        _, found = index.search(
+            np.array([vector], dtype=np.float32), self.fetch_k if use_sparse or rerank_query else self.k
+        )
+        dense = [int(p) for p in found[0] if p != -1]
+        searched = time.perf_counter()
+        stages = {"search": searched - started}
+
+        # Dense-only results go through RRF too, so relevance is on one scale
+        ranked_lists = [dense]
+        if use_sparse:
+            ranked_lists.append([p for p, _ in self.sparse_index.search(sparse_query, self.fetch_k, language)])
+        ranked = reciprocal_rank_fusion(ranked_lists, with_scores=True)
+        ranked = ranked[:self.reranker.candidates if rerank_query else self.k]
+        if use_sparse:
+            stages["sparse"] = time.perf_counter() - searched
+
+        docs = []
+        for position, relevance in ranked:
+            doc = self.vectorstore.docstore.search(self.vectorstore.index_to_docstore_id[position])
+            # Copy: an in-memory docstore hands out shared Document objects
+            docs.append(Document(id=doc.id, page_content=doc.page_content,
+                                 metadata={**doc.metadata, "relevance": relevance}))
+
+        if rerank_query:
+            reranking = time.perf_counter()
+            docs = self.reranker.rerank(rerank_query, docs, self.k)
+            stages["rerank"] = time.perf_counter() - reranking
+        return docs, stages
+
+    def retrieve(self, query, sparse_query=None, embedding_cache=None, language=None):
+        """Embed + search as separately timed stages
+
+        embedding_cache (query_rewriter.QueryEmbeddingCache) skips the model
+        for a query this session has already embedded.
+        """
+        started = time.perf_counter()
+        if embedding_cache is not None:
+            vector = embedding_cache.embed(query, self.embed_query)
+        else:
+            vector = self.embed_query(query)
+        embed_seconds = time.perf_counter() - started
+        docs, stages = self.search(vector, sparse_query, language, query)
+        stages["embed"] = embed_seconds
+        return docs, stages
+
+
+def open_knowledge_base(index_path, backend=None, k=4, reranker=None):
+    """Open the dense index and, if present and in sync, the BM25 index
+
+    A non-reference embedding backend is checked against the stored index
+    vectors first; if it drifts too far the reference backend is used instead.
+    HNSW / IVF-PQ indexes get their search knobs set from index_meta.json,
+    which also lists the per-language sub-indexes to load. reranker
+    (reranker.CrossEncoderReranker) adds the cross-encoder stage; it is
+    passed in so one model serves every reload of the index.
+    """
+    backend = backend or backend_from_env()
+    vectorstore = open_index(index_path, create_embeddings(backend))
+
+    if backend != DEFAULT_BACKEND:
+        try:
+            lowest = check_against_index(vectorstore)
+            if lowest is not None:
+                print(f"✓ Embedding backend '{backend}' matches the index (min cosine {lowest:.4f})")
+        except ValueError as e:
+            print(f"DEBUG: {e} - falling back to '{DEFAULT_BACKEND}'")
+            vectorstore.embedding_function = create_embeddings(DEFAULT_BACKEND)
+
+    sparse_index = None
+    try:
+        sparse_index = load_sparse_index(index_path)
+        if sparse_index is None:
+            print("DEBUG: No sparse index found, using dense search only")
+        elif sparse_index.num_docs != vectorstore.index.ntotal:
+            print("DEBUG: Sparse index is out of sync with FAISS, using dense search only")
+            sparse_index = None
+    except Exception as e:
+        print(f"DEBUG: Sparse index failed to load: {e}")
+
+    meta = read_index_meta(index_path) or {}
+    partitions = {}
+    try:
+        partitions = open_partitions(index_path, meta.get("partitions", {}))
+        if sum(index.ntotal for index in partitions.values()) != vectorstore.index.ntotal:
+            if partitions:
+                print("DEBUG: Language sub-indexes are out of sync with FAISS, searching all languages")
+            partitions = {}
+    except Exception as e:
+        print(f"DEBUG: Language sub-indexes failed to load: {e}")
+    knowledge_base = LocalKnowledgeBase(vectorstore, sparse_index, k=k, partitions=partitions, reranker=reranker)
+
+    # ANN indexes: efSearch / nprobe from index_meta.json, scaled to fetch_k
+    knobs = configure_search(vectorstore.index, meta, knowledge_base.fetch_k)
+    for language, index in partitions.items():
+        configure_search(index, meta["partitions"][language], knowledge_base.fetch_k)
+    if knobs:
+        print(f"✓ Search settings: {knobs}")
+    if partitions:
+        print(f"✓ Language sub-indexes: {', '.join(f'{l} ({i.ntotal})' for l, i in partitions.items())}")
+    return knowledge_base
@@ -0,0 +1,293 @@
+"""
+Digital Protection - Hedged Model Router
+Streams from the primary Groq model, and starts the backup model when the
+primary is slow to produce its first token or keeps failing.
+"""
+
+import time
+import queue
+import threading
+
+# Time-to-first-token buckets (seconds), shared with the metrics export
+TTFT_BUCKETS = (0.1, 0.25, 0.5, 0.75, 1.0, 1.5, 2.0, 3.0, 5.0, 8.0, 13.0, float("inf"))
+
+
+class AllModelsFailed(Exception):
+    """Neither model produced a first token"""
+
+    def __init__(self, message, reason=None):
+        super().__init__(message)
+        self.reason = reason
+
+
+class LatencyHistogram:
+    """Bucketed time-to-first-token samples for one model"""
+
+    def __init__(self, buckets=TTFT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        with self._lock:
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    self.counts[i] += 1
+                    break
+            self.total += 1
+            self.sum += seconds
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-th sample (None if empty)"""
+        with self._lock:
+            if not self.total:
+                return None
+            target = q * self.total
+            seen = 0
+            for bound, count in zip(self.buckets, self.counts):
+                seen += count
+                if seen >= target:
+                    return bound
+            return self.buckets[-1]
+
+
+class CircuitBreaker:
+    """Skip a model after repeated failures, then let one probe through"""
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, failure_threshold=3, cooldown_seconds=60):
+        self.failure_threshold = failure_threshold
+        self.cooldown_seconds = cooldown_seconds
+        self.failures = 0
+        self.opened_at = 0.0
+        self.state = self.CLOSED
+        self.probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """True if a call may go ahead; after the cooldown exactly one probe does"""
+        with self._lock:
+            if self.state == self.OPEN and time.time() - self.opened_at >= self.cooldown_seconds:
+                self.state = self.HALF_OPEN
+            if self.state == self.HALF_OPEN:
+                if self.probe_in_flight:
+                    return False
+                self.probe_in_flight = True
+                return True
+            return self.state == self.CLOSED
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.state = self.CLOSED
+            self.probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self.probe_in_flight = False
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self.opened_at = time.time()
+
+
+class HedgingPolicy:
+    """When to start the backup model
+
+    mode="hedge":      start the backup if the primary has no first token
+                       within the deadline (or fails first)
+    mode="race":       start both at once and keep whichever answers first
+    mode="sequential": only try the backup after the primary has failed
+    The hedge deadline follows the primary's observed p95 TTFT once enough
+    samples exist, clamped to [min_deadline, max_deadline].
+    """
+
+    def __init__(self, mode="hedge", deadline_seconds=2.0, min_deadline=0.75,
+                 max_deadline=5.0, adaptive_quantile=0.95, min_samples=20):
+        self.mode = mode
+        self.deadline_seconds = deadline_seconds
+        self.min_deadline = min_deadline
+        self.max_deadline = max_deadline
+        self.adaptive_quantile = adaptive_quantile
+        self.min_samples = min_samples
+
+    def deadline(self, histogram):
+        if self.mode == "race":
+            return 0.0
+        if self.mode == "sequential":
+            return None
+        if histogram.total >= self.min_samples:
+            observed = histogram.quantile(self.adaptive_quantile)
+            return min(max(observed, self.min_deadline), self.max_deadline)
+        return self.deadline_seconds
+
+
+class _Attempt(threading.Thread):
+    """Streams one model into the shared event queue until cancelled
+
+    The model's TTFT and its breaker outcome up to the first token are
+    recorded here, so an attempt that lost the race still counts once its
+    first token (or error) arrives; otherwise the hedge deadline would only
+    ever see the winners' TTFT.
+    """
+
+    def __init__(self, client, model, messages, temperature, events, histogram, breaker):
+        super().__init__(daemon=True, name=f"dp-model-{model}")
+        self.client = client
+        self.model = model
+        self.messages = messages
+        self.temperature = temperature
+        self.events = events
+        self.histogram = histogram
+        self.breaker = breaker
+        self.cancelled = threading.Event()
+        self.started_at = time.perf_counter()
+
+    def run(self):
+        stream = None
+        first_token = True
+        try:
+            stream = self.client.chat.completions.create(
+                messages=self.messages,
+                model=self.model,
+                temperature=self.temperature,
+                stream=True,
+            )
+            for chunk in stream:
+                content = chunk.choices[0].delta.content
+                if content and first_token:
+                    first_token = False
+                    self.histogram.record(time.perf_counter() - self.started_at)
+                    self.breaker.record_success()
+                # A cancelled attempt still reads on until its first token is timed
+                if self.cancelled.is_set() and not first_token:
+                    break
+                if content:
+                    self.events.put(("token", self, content))
+            if first_token:
+                self.breaker.record_failure()  # Empty response
+            self.events.put(("done", self, None))
+        except Exception as e:
+            if first_token:
+                self.breaker.record_failure()
+            self.events.put(("error", self, e))
+        finally:
+            if stream is not None and self.cancelled.is_set():
+                try:
+                    stream.close()
+                except Exception:
+                    pass
+
+
+class ModelStream:
+    """Iterates the text deltas of the model that won the race"""
+
+    def __init__(self, router, winner, first_token, events, fallback_reason=None):
+        self.router = router
+        self.winner = winner
+        self.model = winner.model
+        self.fallback_reason = fallback_reason
+        self.first_token = first_token
+        self.events = events
+
+    def __iter__(self):
+        yield self.first_token
+        while True:
+            kind, attempt, payload = self.events.get()
+            if attempt is not self.winner:
+                continue
+            if kind == "token":
+                yield payload
+            elif kind == "done":
+                return
+            else:
+                self.router.breakers[self.model].record_failure()
+                raise payload
+
+    def close(self):
+        """Stop the winning model's stream (the reader went away)"""
+        self.winner.cancelled.set()
+
+
+class ModelRouter:
+    """Primary/backup model selection with hedging and circuit breakers"""
+
+    def __init__(self, client, primary, backup, policy=None,
+                 failure_threshold=3, cooldown_seconds=60):
+        self.client = client
+        self.primary = primary
+        self.backup = backup
+        self.policy = policy or HedgingPolicy()
+        self.histograms = {model: LatencyHistogram() for model in (primary, backup)}
+        self.breakers = {model: CircuitBreaker(failure_threshold, cooldown_seconds)
+                         for model in (primary, backup)}
+
+    def stream(self, messages, temperature=0.1):
+        """Block until some model produces its first token; return a ModelStream"""
+        events = queue.Queue()
+        attempts = []
+        failures = []
+        state = {"reason": None, "backup_started": False}
+
+        def launch(model):
+            attempt = _Attempt(self.client, model, messages, temperature, events,
+                               self.histograms[model], self.breakers[model])
+            attempt.start()
+            attempts.append(attempt)
+
+        def start_backup(reason):
+            state["backup_started"] = True
+            state["reason"] = state["reason"] or reason
+            if self.breakers[self.backup].allow():
+                launch(self.backup)
+            else:
+                failures.append(f"{self.backup}: circuit open")
+
+        deadline = None
+        if self.breakers[self.primary].allow():
+            launch(self.primary)
+            deadline = self.policy.deadline(self.histograms[self.primary])
+        else:
+            failures.append(f"{self.primary}: circuit open")
+            start_backup("primary_circuit_open")
+
+        pending = len(attempts)
+        wait_started = time.perf_counter()
+        while pending:
+            timeout = None
+            if not state["backup_started"] and deadline is not None:
+                timeout = max(0.0, deadline - (time.perf_counter() - wait_started))
+
+            try:
+                kind, attempt, payload = events.get(timeout=timeout)
+            except queue.Empty:
+                # Primary missed its first-token deadline: hedge with the backup
+                before = len(attempts)
+                start_backup("primary_slow")
+                pending += len(attempts) - before
+                continue
+
+            if kind == "token":
+                for other in attempts:
+                    if other is not attempt:
+                        other.cancelled.set()
+                reason = None if attempt.model == self.primary else state["reason"]
+                return ModelStream(self, attempt, payload, events, fallback_reason=reason)
+
+            # The attempt ended without producing any text
+            pending -= 1
+            if kind == "error":
+                print(f"Model {attempt.model} failed: {payload}")
+                failures.append(f"{attempt.model}: {payload}")
+            else:
+                failures.append(f"{attempt.model}: empty response")
+
+            if not state["backup_started"]:
+                before = len(attempts)
+                start_backup("primary_error")
+                pending += len(attempts) - before
+
+        raise AllModelsFailed("; ".join(failures), reason=state["reason"])
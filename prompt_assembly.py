@@ -0,0 +1,118 @@
+"""
+Digital Protection - Prompt Assembly
+Lays out every Groq request so it starts with the same bytes on every turn.
+The system instructions and answer rules for each reply language are built
+once per process (chat_pipeline.PROMPT_ASSEMBLER) and always go first, as
+the system message. What changes per turn (history, retrieved context, the question)
+comes after it, so a provider-side prompt cache can reuse the prefix.
+"""
+
+import hashlib
+import json
+
+from context_builder import estimate_tokens
+
+LANGUAGE_NAMES = {"en": "English", "ar": "Arabic"}
+
+ANSWER_RULES = """Answer the question using ONLY the information in the CONTEXT of the user's message.
+
+RULES:
+1. NO emojis
+2. Give a COMPLETE answer using the context - include all relevant details
+3. Only say "contact us" for pricing questions or if info is truly not in context
+4. Answer in {language} only"""
+
+# Repeated next to the question, where the model reads it last
+REMINDER = "REMEMBER: Answer using the context provided, in {language} only. No emojis."
+
+QUESTION_TEMPLATE = """CONTEXT:
+{context}
+
+{reminder}
+
+QUESTION:
+{question}
+
+ANSWER:"""
+
+
+class StaticPrefix:
+    """The system message for one reply language, with its token count and hash"""
+
+    def __init__(self, language, instructions):
+        name = LANGUAGE_NAMES[language]
+        self.language = language
+        self.content = f"{instructions}\n\n{ANSWER_RULES.format(language=name)}"
+        self.reminder = REMINDER.format(language=name)
+        self.tokens = estimate_tokens(self.content)
+        # Hash of the bytes the API client sends, to check prefixes match across turns in the logs
+        serialized = json.dumps({"role": "system", "content": self.content}, ensure_ascii=False)
+        self.sha = hashlib.sha256(serialized.encode("utf-8")).hexdigest()[:12]
+
+    def message(self):
+        return {"role": "system", "content": self.content}
+
+
+class AssembledPrompt:
+    def __init__(self, messages, report):
+        self.messages = messages  # [{"role", "content"}], the static system message first
+        self.report = report      # Token estimate per section, plus the prefix hash
+
+
+class PreparedPrompt:
+    """Everything but the context: built while the knowledge base is searched"""
+
+    def __init__(self, prefix, question, fitted):
+        self.prefix = prefix
+        self.question = question
+        self.fitted = fitted  # context_builder.FittedHistory
+
+    def finish(self, chunks):
+        prefix = self.prefix
+        built = self.fitted.finish(chunks)
+
+        messages = [prefix.message()]
+        messages.extend(built.history)
+        messages.append({"role": "user", "content": QUESTION_TEMPLATE.format(
+            context=built.context, reminder=prefix.reminder, question=self.question)})
+
+        question_tokens = built.report["fixed"] - prefix.tokens
+        report = {
+            "prefix": prefix.tokens,
+            "history": built.report["history"],
+            "context": built.report["chunks"],
+            "question": question_tokens,
+            "total": built.report["total"],
+            "history_messages": built.report["history_messages"],
+            "chunks_kept": built.report["chunks_kept"],
+            "chunks_retrieved": built.report["chunks_retrieved"],
+            "prefix_sha": prefix.sha,
+        }
+        return AssembledPrompt(messages, report)
+
+
+class PromptAssembler:
+    """Static prefix first, then history, then context and question
+
+    instructions: {language: system instructions}. The context builder
+    still decides how much history and context fit the token budget; the
+    prefix's tokens are counted once, here.
+    """
+
+    def __init__(self, instructions):
+        self.prefixes = {language: StaticPrefix(language, text) for language, text in instructions.items()}
+
+    def prepare(self, language, question, history, context_builder):
+        """The prefix and the fitted history; finish(chunks) adds the context"""
+        prefix = self.prefixes[language]
+        # Everything but the context is fixed for this turn
+        question_text = QUESTION_TEMPLATE.format(context="", reminder=prefix.reminder, question=question)
+        fitted = context_builder.fit_history(question_text, history, prefix_tokens=prefix.tokens)
+        return PreparedPrompt(prefix, question, fitted)
+
+    def build(self, language, question, history, chunks, context_builder):
+        return self.prepare(language, question, history, context_builder).finish(chunks)
+
+
+def format_prompt_report(report):
+    return "PROMPT: " + " ".join(f"{key}={value}" for key, value in report.items())
@@ -0,0 +1,131 @@
+"""
+Digital Protection - Retrieval Query Construction
+Turns the current question plus the chat so far into a short standalone search
+query, instead of embedding the transcript (MiniLM only reads 128 tokens, so
+the question itself was often cut off).
+"""
+
+import re
+import threading
+from collections import OrderedDict
+
+from context_builder import strip_html
+from sparse_index import normalize_arabic
+
+WORD_PATTERN = re.compile(r"[\w/+&-]+", flags=re.UNICODE)
+# Acronyms and standards: GDPR, ISO, 27701, IAM/PAM, CBJ
+ENTITY_PATTERN = re.compile(r"\b(?:[A-Z][A-Z0-9/&+-]{1,}|\d{3,})\b")
+
+STOPWORDS = set("""
+a an the and or but if then so of to in on at for from by with about as into is are was were be been
+being do does did have has had can could would should will shall may might must i you he she it we
+they me him her us them my your his its our their this that these those there here what which who whom
+whose when where why how please tell more also any some all other than too very just only not no yes
+ok okay thanks thank hi hello need want like know explain give show much many get help offer provide
+""".split())
+STOPWORDS |= {normalize_arabic(w) for w in """
+في من على الى إلى عن مع هل ما ماذا كيف كم لماذا متى اين أين هو هي هم هذا هذه ذلك تلك التي الذي الذين
+و او أو ثم لا نعم انا أنا انت أنت نحن لكم لك لنا عندكم ايضا أيضا كان يكون تقدمون تقدم اريد أريد ممكن
+شكرا مرحبا اخبرني أخبرني المزيد اكثر أكثر عنها عنه فيها فيه بها به لها له
+""".split()}
+
+# A question that leans on earlier turns ("how much does it cost?")
+FOLLOW_UP_WORDS = {"it", "its", "this", "that", "these", "those", "they", "them", "their", "there",
+                   "same", "above", "more", "also", "else", "another"}
+FOLLOW_UP_WORDS |= {normalize_arabic(w) for w in
+                    "هذا هذه ذلك تلك عنها عنه فيها فيه بها به لها له ايضا أيضا المزيد".split()}
+
+# Arabic attaches the pronoun: تكلفتها ("its cost"), خدماتهم ("their services")
+ARABIC_PRONOUN_SUFFIX = re.compile(r"\w{3,}(?:ها|هم|هما)$")
+
+MAX_HISTORY_TERMS = 8
+
+
+def content_words(text):
+    """Words that carry meaning: no stopwords, nothing shorter than 3 letters"""
+    words = []
+    for word in WORD_PATTERN.findall(text):
+        key = normalize_arabic(word.lower())
+        if len(key) >= 3 and key not in STOPWORDS:
+            words.append(word)
+    return words
+
+
+def is_follow_up(question):
+    """Refers back to earlier turns, or has no topic words of its own ("why?")"""
+    words = [normalize_arabic(w.lower()) for w in WORD_PATTERN.findall(question)]
+    if any(w in FOLLOW_UP_WORDS or ARABIC_PRONOUN_SUFFIX.match(w) for w in words):
+        return True
+    return not content_words(question)
+
+
+def salient_history_terms(history, limit=MAX_HISTORY_TERMS):
+    """Topic words from the latest question and entities from the latest answer
+
+    Newest first, deduplicated; assistant answers only contribute acronyms and
+    numbers since the rest of an answer is mostly phrasing.
+    """
+    terms = []
+    seen = set()
+
+    def add(term):
+        key = normalize_arabic(term.lower())
+        if key not in seen:
+            seen.add(key)
+            terms.append(term)
+
+    for message in reversed(history):
+        text = strip_html(message["content"])
+        if message["role"] == "user":
+            for term in ENTITY_PATTERN.findall(text) + content_words(text):
+                add(term)
+            break  # Only the latest question sets the topic
+        for term in ENTITY_PATTERN.findall(text):
+            add(term)
+    return terms[:limit]
+
+
+def build_search_query(question, history):
+    """Standalone search query: the question, plus history terms for a follow-up"""
+    question = question.strip()
+    if not history or not is_follow_up(question):
+        return question
+    present = {normalize_arabic(w.lower()) for w in WORD_PATTERN.findall(question)}
+    extra = [t for t in salient_history_terms(history) if normalize_arabic(t.lower()) not in present]
+    return f"{question} {' '.join(extra)}".strip()
+
+
+class QueryEmbeddingCache:
+    """Per-session LRU of query text -> vector, so repeated queries skip the model"""
+
+    def __init__(self, max_entries=32):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, text):
+        with self._lock:
+            vector = self._entries.get(text)
+            if vector is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(text)
+            self.hits += 1
+            return vector
+
+    def put(self, text, vector):
+        with self._lock:
+            self._entries[text] = vector
+            self._entries.move_to_end(text)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def embed(self, text, embed_query):
+        """Cached vector for text, computing it with embed_query on a miss"""
+        vector = self.get(text)
+        if vector is None:
+            vector = embed_query(text)
+            self.put(text, vector)
+        return vector
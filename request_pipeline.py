@@ -0,0 +1,91 @@
+"""
+Digital Protection - Request Pipeline Helpers
+Overlaps retrieval with Groq connection warm-up and records per-stage timings
+"""
+
+import time
+import threading
+from collections import deque
+
+import numpy as np
+
+STAGES = ("embed", "search", "sparse", "rerank", "ttft", "total")
+
+
+class ConnectionWarmer:
+    """Keeps a TLS connection to Groq open in the shared HTTP pool
+
+    A cheap models.list() call opens the connection while retrieval is still
+    running, so the chat request that follows skips the handshake. Calls are
+    skipped while the pooled connection should still be alive.
+    """
+
+    def __init__(self, client, interval_seconds=30):
+        self.client = client
+        self.interval_seconds = interval_seconds
+        self._last_warm = 0.0
+        self._lock = threading.Lock()
+
+    def warm(self):
+        with self._lock:
+            now = time.time()
+            if now - self._last_warm < self.interval_seconds:
+                return
+            self._last_warm = now
+        try:
+            self.client.models.list()
+        except Exception as e:
+            print(f"DEBUG: Groq warm-up failed: {e}")
+
+
+class RequestTimings:
+    """Stage durations (seconds) for one chat turn"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = {}
+
+    def record(self, stages):
+        self.stages.update(stages)
+
+    def mark_first_token(self):
+        if "ttft" not in self.stages:
+            self.stages["ttft"] = time.perf_counter() - self.started
+
+    def finish(self):
+        self.stages["total"] = time.perf_counter() - self.started
+        return self.stages
+
+
+class TimingLog:
+    """Recent per-stage timings across all sessions, for p50/p95"""
+
+    def __init__(self, max_requests=1000):
+        self._samples = {stage: deque(maxlen=max_requests) for stage in STAGES}
+        self._lock = threading.Lock()
+
+    def add(self, stages):
+        with self._lock:
+            for stage, seconds in stages.items():
+                if stage in self._samples:
+                    self._samples[stage].append(seconds)
+
+    def percentiles(self, pcts=(50, 95)):
+        """Return {stage: {pct: milliseconds}} for stages with samples"""
+        with self._lock:
+            samples = {stage: list(values) for stage, values in self._samples.items() if values}
+        return {
+            stage: {pct: float(np.percentile(values, pct)) * 1000 for pct in pcts}
+            for stage, values in samples.items()
+        }
+
+
+def format_timings(stages, log=None):
+    """One log line: this request's stages, plus the running p95 if available"""
+    parts = [f"{stage}={stages[stage] * 1000:.0f}ms" for stage in STAGES if stage in stages]
+    line = "TIMING: " + " ".join(parts)
+    if log is not None:
+        p95 = log.percentiles(pcts=(95,))
+        if p95:
+            line += " | p95 " + " ".join(f"{stage}={p95[stage][95]:.0f}ms" for stage in STAGES if stage in p95)
+    return line
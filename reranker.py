@@ -0,0 +1,153 @@
+"""
+Digital Protection - Cross-Encoder Reranking
+Optional second retrieval stage. The knowledge base over-fetches fused
+(FAISS + BM25) candidates, a small multilingual cross-encoder scores every
+(question, chunk) pair in one batched forward pass on CPU, and only the best
+k above a score cutoff go into the prompt.
+
+Reranking has a strict latency budget: if the scores aren't back in time,
+another rerank is already running, or the model fails, the fused
+bi-encoder order is kept.
+
+Enable with DP_RERANK=1 (app/sidecar) or --rerank (benchmarks).
+"""
+
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+RERANK_MODEL = "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1"  # Multilingual (incl. Arabic), ~120M params
+RERANK_CANDIDATES = 20         # Fused candidates the cross-encoder scores
+RERANK_MIN_SCORE = 0.1         # Sigmoid score below which a chunk is dropped
+RERANK_MIN_KEEP = 1            # Chunks kept even when all score below the cutoff
+RERANK_BUDGET_SECONDS = 0.25   # Longest a turn waits for scores before keeping bi-encoder order
+RERANK_MAX_CONCURRENT = 2      # Forward passes at once; more turns keep bi-encoder order
+RERANK_MAX_LENGTH = 256        # Tokens per (question, chunk) pair
+
+# Roughly chunk-sized text for the warm-up pass that also times the model
+WARM_UP_TEXT = "Digital Protection helps organisations with GDPR and ISO 27701 compliance. " * 12
+
+
+def rerank_from_env():
+    return os.environ.get("DP_RERANK", "0").lower() in ("1", "true", "yes", "on")
+
+
+class CrossEncoderReranker:
+    """Reorders and prunes retrieved chunks with a cross-encoder, within a latency budget
+
+    model: anything with CrossEncoder.predict(pairs, batch_size=...) -> scores;
+    loaded from model_name when not given.
+    """
+
+    def __init__(self, model=None, model_name=RERANK_MODEL, candidates=RERANK_CANDIDATES,
+                 min_score=RERANK_MIN_SCORE, min_keep=RERANK_MIN_KEEP, budget_seconds=RERANK_BUDGET_SECONDS,
+                 max_concurrent=RERANK_MAX_CONCURRENT, max_length=RERANK_MAX_LENGTH):
+        self.model_name = model_name
+        self.model = model if model is not None else self._load(model_name, max_length)
+        self.candidates = candidates
+        self.min_score = min_score
+        self.min_keep = min_keep
+        self.budget_seconds = budget_seconds
+        self.max_concurrent = max_concurrent
+        self.seconds_per_pair = None  # Running estimate, to score only what fits the budget
+        self.results = {"reranked": 0, "busy": 0, "timeout": 0, "error": 0}
+        self.dropped = 0
+        self._running = 0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrent, thread_name_prefix="dp-rerank")
+        self.warm_up()
+
+    @staticmethod
+    def _load(model_name, max_length):
+        # Imported here: sentence-transformers pulls in torch
+        from sentence_transformers import CrossEncoder
+        return CrossEncoder(model_name, max_length=max_length, device="cpu")
+
+    def warm_up(self):
+        """The first forward pass is slow; take it at load, then time a full batch"""
+        self._score("warm up", [WARM_UP_TEXT])
+        self.seconds_per_pair = None
+        self._score("What does Digital Protection offer?", [WARM_UP_TEXT] * self.candidates)
+
+    def _score(self, query, texts):
+        started = time.perf_counter()
+        scores = self.model.predict([(query, text) for text in texts], batch_size=len(texts),
+                                    show_progress_bar=False)
+        per_pair = (time.perf_counter() - started) / len(texts)
+        with self._lock:
+            if self.seconds_per_pair is None:
+                self.seconds_per_pair = per_pair
+            else:
+                self.seconds_per_pair = 0.8 * self.seconds_per_pair + 0.2 * per_pair
+        return [float(score) for score in scores]
+
+    def _run(self, query, texts):
+        try:
+            return self._score(query, texts)
+        finally:
+            with self._lock:
+                self._running -= 1
+
+    def _fallback(self, docs, k, reason):
+        with self._lock:
+            self.results[reason] += 1
+        return docs[:k]
+
+    def rerank(self, query, docs, k):
+        """The best (at most k) of docs for query, most relevant first
+
+        docs are in bi-encoder order; scored ones get the cross-encoder
+        score as metadata["relevance"]. Falls back to docs[:k] if scoring
+        would overrun the budget.
+        """
+        if not docs:
+            return docs
+        # Score only as many candidates as the budget allows, but at least k
+        count = len(docs)
+        if self.seconds_per_pair:
+            count = min(count, max(k, int(self.budget_seconds / self.seconds_per_pair)))
+
+        with self._lock:
+            busy = self._running >= self.max_concurrent
+            if not busy:
+                self._running += 1
+        if busy:
+            return self._fallback(docs, k, "busy")
+
+        future = self._executor.submit(self._run, query, [doc.page_content for doc in docs[:count]])
+        try:
+            # A late forward pass finishes in the background (and still
+            # updates the estimate) but its scores are not used
+            scores = future.result(timeout=self.budget_seconds)
+        except FutureTimeoutError:
+            return self._fallback(docs, k, "timeout")
+        except Exception as e:
+            print(f"DEBUG: Rerank failed: {e}")
+            return self._fallback(docs, k, "error")
+
+        order = sorted(range(count), key=lambda i: scores[i], reverse=True)
+        kept = [i for i in order[:k] if scores[i] >= self.min_score]
+        if len(kept) < self.min_keep:
+            kept = order[:self.min_keep]
+        with self._lock:
+            self.results["reranked"] += 1
+            self.dropped += min(k, len(docs)) - len(kept)
+        reranked = []
+        for i in kept:
+            docs[i].metadata["relevance"] = scores[i]
+            reranked.append(docs[i])
+        return reranked
+
+
+def load_reranker():
+    """A CrossEncoderReranker, or None (search keeps bi-encoder order) if the model can't load"""
+    try:
+        reranker = CrossEncoderReranker()
+    except Exception as e:
+        print(f"DEBUG: Reranker not loaded, keeping bi-encoder order: {e}")
+        return None
+    print(f"✓ Reranking {reranker.candidates} candidates with {reranker.model_name} "
+          f"(~{reranker.seconds_per_pair * 1000:.1f} ms/pair, budget {reranker.budget_seconds * 1000:.0f} ms)")
+    return reranker
@@ -0,0 +1,125 @@
+"""
+Digital Protection - Semantic Response Cache
+Replays stored answers for near-identical questions instead of calling Groq
+"""
+
+import os
+import time
+import uuid
+import zipfile
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+INDEX_VERSION_FILE = "index_version.txt"
+
+
+def read_index_version(index_path="faiss_index"):
+    """Return the version stamp of the FAISS index on disk"""
+    version_file = os.path.join(index_path, INDEX_VERSION_FILE)
+    if os.path.exists(version_file):
+        with open(version_file, "r", encoding="utf-8") as f:
+            return f.read().strip()
+
+    # Index shipped only as a zip: read the stamp without extracting anything
+    zip_path = index_path + ".zip"
+    if not os.path.isdir(index_path) and os.path.exists(zip_path):
+        with zipfile.ZipFile(zip_path, "r") as archive:
+            for name in archive.namelist():
+                if os.path.basename(name) == INDEX_VERSION_FILE:
+                    return archive.read(name).decode("utf-8").strip()
+        return f"mtime-{os.path.getmtime(zip_path)}"
+
+    # Indexes built before version stamps existed: fall back to the file mtime
+    index_file = os.path.join(index_path, "index.faiss")
+    if os.path.exists(index_file):
+        return f"mtime-{os.path.getmtime(index_file)}"
+    return ""
+
+
+def write_index_version(index_path="faiss_index"):
+    """Stamp a freshly built index so cached answers from the old one are dropped"""
+    version = f"{time.strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:8]}"
+    with open(os.path.join(index_path, INDEX_VERSION_FILE), "w", encoding="utf-8") as f:
+        f.write(version)
+    return version
+
+
+class SemanticResponseCache:
+    """LRU + TTL cache of final answers keyed on the query embedding and language"""
+
+    def __init__(self, similarity_threshold=0.92, ttl_seconds=3600, max_entries=256):
+        self.similarity_threshold = similarity_threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.index_version = None
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _normalize(vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _check_version(self, index_version):
+        # Caller holds the lock
+        if index_version != self.index_version:
+            self._entries.clear()
+            self.index_version = index_version
+
+    def _evict_expired(self, now):
+        # Caller holds the lock
+        expired = [key for key, entry in self._entries.items()
+                   if now - entry["created"] > self.ttl_seconds]
+        for key in expired:
+            del self._entries[key]
+
+    def lookup(self, vector, language, index_version):
+        """Return the cached answer for a similar query in the same language, or None"""
+        query = self._normalize(vector)
+        now = time.time()
+
+        with self._lock:
+            self._check_version(index_version)
+            self._evict_expired(now)
+
+            keys = [key for key, entry in self._entries.items() if entry["language"] == language]
+            if not keys:
+                self.misses += 1
+                return None
+
+            matrix = np.stack([self._entries[key]["vector"] for key in keys])
+            scores = matrix @ query
+            best = int(np.argmax(scores))
+            if scores[best] < self.similarity_threshold:
+                self.misses += 1
+                return None
+
+            key = keys[best]
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return self._entries[key]["answer"]
+
+    def store(self, vector, language, answer, index_version):
+        """Remember a final answer, evicting the least recently used entry when full"""
+        with self._lock:
+            self._check_version(index_version)
+            self._entries[uuid.uuid4().hex] = {
+                "vector": self._normalize(vector),
+                "language": language,
+                "answer": answer,
+                "created": time.time(),
+            }
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
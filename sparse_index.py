@@ -0,0 +1,160 @@
+"""
+Digital Protection - Sparse (BM25) Index
+Exact-token search for queries like "ISO 27701", "CBJ", "WAF" or "IAM/PAM"
+that dense MiniLM search misses. Built next to the FAISS index at ingestion
+time and stored as flat numpy arrays, so loading it is a single np.load.
+"""
+
+import io
+import os
+import re
+import zipfile
+from collections import Counter
+
+import numpy as np
+
+SPARSE_INDEX_FILE = "sparse_index.npz"
+
+BM25_K1 = 1.5
+BM25_B = 0.75
+RRF_K = 60
+
+TOKEN_PATTERN = re.compile(r"\w+", flags=re.UNICODE)
+ARABIC_DIACRITICS = re.compile(r"[\u064B-\u0652\u0670\u0640]")  # Tashkeel + tatweel
+ARABIC_NORMALIZE = str.maketrans({"أ": "ا", "إ": "ا", "آ": "ا", "ى": "ي", "ة": "ه", "ؤ": "و", "ئ": "ي"})
+ARABIC_PREFIXES = ("وال", "بال", "كال", "فال", "لل", "ال")
+
+
+def normalize_arabic(text):
+    return ARABIC_DIACRITICS.sub("", text).translate(ARABIC_NORMALIZE)
+
+
+def tokenize(text):
+    """Lowercase word tokens; Arabic is normalized and the article prefix stripped"""
+    tokens = []
+    for token in TOKEN_PATTERN.findall(normalize_arabic(text.lower())):
+        for prefix in ARABIC_PREFIXES:
+            # Keep at least 2 letters so short words aren't destroyed
+            if token.startswith(prefix) and len(token) - len(prefix) >= 2:
+                token = token[len(prefix):]
+                break
+        tokens.append(token)
+    return tokens
+
+
+def reciprocal_rank_fusion(ranked_lists, k=RRF_K, with_scores=False):
+    """Merge ranked lists of ids: score = sum of 1 / (k + rank)"""
+    scores = {}
+    for ranked in ranked_lists:
+        for rank, item in enumerate(ranked):
+            scores[item] = scores.get(item, 0.0) + 1.0 / (k + rank + 1)
+    merged = sorted(scores, key=scores.get, reverse=True)
+    if with_scores:
+        return [(item, scores[item]) for item in merged]
+    return merged
+
+
+def build_sparse_index(texts, doc_ids, index_path, languages=None):
+    """Write the BM25 postings for texts (in FAISS position order)
+
+    languages (one per text) lets search() keep to one language's chunks.
+    """
+    term_docs = {}
+    doc_lengths = np.zeros(len(texts), dtype=np.int32)
+    for position, text in enumerate(texts):
+        counts = Counter(tokenize(text))
+        doc_lengths[position] = sum(counts.values())
+        for term, count in counts.items():
+            term_docs.setdefault(term, []).append((position, count))
+
+    vocab = sorted(term_docs)
+    offsets = np.zeros(len(vocab) + 1, dtype=np.int64)
+    postings = []
+    freqs = []
+    for i, term in enumerate(vocab):
+        entries = term_docs[term]
+        postings.extend(position for position, _ in entries)
+        freqs.extend(count for _, count in entries)
+        offsets[i + 1] = offsets[i] + len(entries)
+
+    path = os.path.join(index_path, SPARSE_INDEX_FILE)
+    with open(path + ".tmp", "wb") as f:
+        np.savez(
+            f,
+            vocab=np.array(vocab, dtype=str),
+            offsets=offsets,
+            postings=np.array(postings, dtype=np.int32),
+            freqs=np.array(freqs, dtype=np.float32),
+            doc_lengths=doc_lengths,
+            doc_ids=np.array(doc_ids, dtype=str),
+            doc_languages=np.array(languages if languages is not None else [""] * len(texts), dtype=str),
+        )
+    os.replace(path + ".tmp", path)
+    return len(vocab)
+
+
+class SparseIndex:
+    """BM25 search over the precomputed postings"""
+
+    def __init__(self, arrays):
+        self.offsets = arrays["offsets"]
+        self.postings = arrays["postings"]
+        self.freqs = arrays["freqs"]
+        self.doc_lengths = arrays["doc_lengths"].astype(np.float32)
+        self.doc_ids = arrays["doc_ids"]
+        self.vocab = {term: i for i, term in enumerate(arrays["vocab"].tolist())}
+        self.language_masks = {}
+        if "doc_languages" in arrays.files:  # Older indexes have no languages
+            languages = arrays["doc_languages"]
+            self.language_masks = {language: languages == language for language in set(languages.tolist()) if language}
+
+        self.num_docs = len(self.doc_lengths)
+        doc_freq = np.diff(self.offsets).astype(np.float32)
+        self.idf = np.log(1.0 + (self.num_docs - doc_freq + 0.5) / (doc_freq + 0.5))
+        average = self.doc_lengths.mean() if self.num_docs else 1.0
+        self.length_norm = BM25_K1 * (1 - BM25_B + BM25_B * self.doc_lengths / max(average, 1e-6))
+
+    def search(self, query, k=10, language=None):
+        """Return [(faiss_position, score)] for the k best BM25 matches
+
+        With a language this index knows, other languages' chunks score 0.
+        """
+        scores = np.zeros(self.num_docs, dtype=np.float32)
+        matched = False
+        for term in set(tokenize(query)):
+            t = self.vocab.get(term)
+            if t is None:
+                continue
+            matched = True
+            start, end = self.offsets[t], self.offsets[t + 1]
+            docs = self.postings[start:end]
+            tf = self.freqs[start:end]
+            scores[docs] += self.idf[t] * tf * (BM25_K1 + 1) / (tf + self.length_norm[docs])
+        if not matched:
+            return []
+        if language in self.language_masks:
+            scores *= self.language_masks[language]
+
+        k = min(k, self.num_docs)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(p), float(scores[p])) for p in top if scores[p] > 0]
+
+
+def load_sparse_index(index_path):
+    """Load sparse_index.npz from the index folder (or '<folder>.zip'), or None"""
+    path = os.path.join(index_path, SPARSE_INDEX_FILE)
+    if os.path.isdir(index_path):
+        if not os.path.exists(path):
+            return None
+        with np.load(path, allow_pickle=False) as arrays:
+            return SparseIndex(arrays)
+
+    zip_path = index_path + ".zip"
+    if os.path.exists(zip_path):
+        with zipfile.ZipFile(zip_path, "r") as archive:
+            for name in archive.namelist():
+                if os.path.basename(name) == SPARSE_INDEX_FILE:
+                    with np.load(io.BytesIO(archive.read(name)), allow_pickle=False) as arrays:
+                        return SparseIndex(arrays)
+    return None
@@ -0,0 +1,240 @@
+"""
+Digital Protection - Request Tracing and Metrics
+Each chat turn gets a RequestTrace (spans + attributes) that is written as one
+JSON log line and folded into process-wide Prometheus-style metrics, served
+from a small local HTTP endpoint.
+
+    curl http://127.0.0.1:9108/metrics
+"""
+
+import json
+import time
+import uuid
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from model_router import LatencyHistogram
+
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, float("inf"))
+TOKEN_BUCKETS = (16, 32, 64, 128, 256, 512, 1024, 2048, float("inf"))
+
+METRIC_HELP = {
+    "dp_requests_total": ("counter", "Chat turns by outcome and answering model"),
+    "dp_model_fallbacks_total": ("counter", "Turns answered by the backup model, by reason"),
+    "dp_static_fallbacks_total": ("counter", "Turns answered from FALLBACK_EN/AR, by language"),
+    "dp_stage_seconds": ("histogram", "Duration of each request stage"),
+    "dp_tokens_out": ("histogram", "Streamed deltas per answer, by model"),
+    "dp_prompt_tokens": ("histogram", "Estimated prompt tokens per section (prefix is the static system message)"),
+    "dp_model_ttft_seconds": ("histogram", "Time to first token per model (as seen by the router)"),
+    "dp_circuit_open": ("gauge", "1 while a model's circuit breaker is open"),
+    "dp_groq_queue_depth": ("gauge", "Chat requests waiting for Groq rate-limit budget"),
+    "dp_groq_in_flight": ("gauge", "Chat requests sent to Groq and not yet finished"),
+    "dp_groq_queue_wait_seconds": ("histogram", "Time requests spent queued before being sent"),
+    "dp_groq_rejected_total": ("counter", "Requests refused by the scheduler (queue full or wait too long)"),
+    "dp_groq_rate_limited_total": ("counter", "429 responses from Groq"),
+    "dp_groq_window_tokens": ("gauge", "Tokens used in the last minute, per model"),
+    "dp_groq_window_tokens_limit": ("gauge", "Tokens-per-minute limit, per model"),
+    "dp_faq_lookups_total": ("counter", "Questions checked against the FAQ intents"),
+    "dp_faq_hits_total": ("counter", "Questions answered by the FAQ fast path, by intent"),
+    "dp_faq_threshold": ("gauge", "Cosine needed for a FAQ answer"),
+    "dp_rerank_total": ("counter", "Reranking attempts by result (reranked, or why bi-encoder order was kept)"),
+    "dp_rerank_dropped_chunks_total": ("counter", "Chunks left out of the prompt by the rerank score cutoff"),
+    "dp_rerank_seconds_per_pair": ("gauge", "Running estimate of cross-encoder time per (question, chunk) pair"),
+}
+
+
+class RequestTrace:
+    """Spans and attributes for one chat turn"""
+
+    def __init__(self, request_id=None, **attributes):
+        self.request_id = request_id or uuid.uuid4().hex[:12]
+        self.started = time.perf_counter()
+        self.started_at = time.time()
+        self.spans = {}
+        self.attributes = dict(attributes)
+
+    def add_span(self, name, seconds, start=None):
+        """Record a span; start is its perf_counter() value, if known"""
+        self.spans[name] = {"duration_ms": seconds * 1000}
+        if start is not None:
+            self.spans[name]["start_ms"] = (start - self.started) * 1000
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def finish(self, stages=None):
+        """Fold in RequestTimings stages and return the log record"""
+        for stage, seconds in (stages or {}).items():
+            if stage not in self.spans:
+                self.add_span(stage, seconds, self.started if stage in ("ttft", "total") else None)
+        return {
+            "event": "chat_turn",
+            "request_id": self.request_id,
+            "ts": round(self.started_at, 3),
+            **self.attributes,
+            "spans": {name: {k: round(v, 2) for k, v in span.items()} for name, span in self.spans.items()},
+        }
+
+
+def log_json(record):
+    print(json.dumps(record, ensure_ascii=False, default=str), flush=True)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels) + "}"
+
+
+def _format_bound(bound):
+    return "+Inf" if bound == float("inf") else repr(float(bound))
+
+
+def _histogram_lines(name, labels, histogram):
+    lines = []
+    cumulative = 0
+    for bound, count in zip(histogram.buckets, list(histogram.counts)):
+        cumulative += count
+        lines.append(f"{name}_bucket{_format_labels(labels + (('le', _format_bound(bound)),))} {cumulative}")
+    lines.append(f"{name}_sum{_format_labels(labels)} {histogram.sum}")
+    lines.append(f"{name}_count{_format_labels(labels)} {histogram.total}")
+    return lines
+
+
+class MetricsRegistry:
+    """Counters and histograms in the Prometheus text format (no client library)"""
+
+    def __init__(self):
+        self._counters = {}
+        self._histograms = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name, value, buckets=STAGE_BUCKETS, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = LatencyHistogram(buckets)
+        histogram.record(value)
+
+    def add_collector(self, collect):
+        """collect() yields (name, labels_dict, value_or_LatencyHistogram) at scrape time"""
+        self._collectors.append(collect)
+
+    def render(self):
+        with self._lock:
+            series = [(name, labels, value) for (name, labels), value in self._counters.items()]
+            series += [(name, labels, histogram) for (name, labels), histogram in self._histograms.items()]
+        for collect in self._collectors:
+            try:
+                series += [(name, tuple(sorted(labels.items())), value) for name, labels, value in collect()]
+            except Exception as e:
+                print(f"DEBUG: Metrics collector failed: {e}")
+
+        lines = []
+        for name in sorted({name for name, _, _ in series}):
+            kind, help_text = METRIC_HELP.get(name, ("untyped", name))
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for _, labels, value in sorted((s for s in series if s[0] == name), key=lambda s: s[1]):
+                if isinstance(value, LatencyHistogram):
+                    lines.extend(_histogram_lines(name, labels, value))
+                else:
+                    lines.append(f"{name}{_format_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def record_turn(registry, record):
+    """Update the metrics from one finished RequestTrace record"""
+    model = record.get("model") or "none"
+    registry.inc("dp_requests_total", outcome=record.get("outcome", "unknown"), model=model)
+    if record.get("fallback_reason") and record.get("outcome") == "answer":
+        registry.inc("dp_model_fallbacks_total", reason=record["fallback_reason"])
+    if record.get("outcome") == "static_fallback":
+        registry.inc("dp_static_fallbacks_total", language=record.get("language", "unknown"))
+    for stage, span in record["spans"].items():
+        registry.observe("dp_stage_seconds", span["duration_ms"] / 1000, stage=stage)
+    if record.get("tokens_out"):
+        registry.observe("dp_tokens_out", record["tokens_out"], buckets=TOKEN_BUCKETS, model=model)
+    for section, tokens in (record.get("prompt_sections") or {}).items():
+        registry.observe("dp_prompt_tokens", tokens, buckets=TOKEN_BUCKETS, section=section)
+
+
+def router_collector(router):
+    """Per-model TTFT histograms and breaker state straight from a ModelRouter"""
+    def collect():
+        for model, histogram in router.histograms.items():
+            yield "dp_model_ttft_seconds", {"model": model}, histogram
+        for model, breaker in router.breakers.items():
+            yield "dp_circuit_open", {"model": model}, int(breaker.state == breaker.OPEN)
+    return collect
+
+
+def scheduler_collector(scheduler):
+    """Queue depth, waits and budget use from a GroqScheduler, to size the Groq plan"""
+    def collect():
+        for model, budget in list(scheduler.budgets.items()):
+            yield "dp_groq_queue_depth", {"model": model}, scheduler.queue_depth(model)
+            yield "dp_groq_window_tokens", {"model": model}, budget.tokens
+            yield "dp_groq_window_tokens_limit", {"model": model}, budget.tokens_per_minute
+        yield "dp_groq_in_flight", {}, scheduler.in_flight
+        yield "dp_groq_queue_wait_seconds", {}, scheduler.wait_histogram
+        for reason, count in scheduler.rejected.items():
+            yield "dp_groq_rejected_total", {"reason": reason}, count
+        yield "dp_groq_rate_limited_total", {}, scheduler.rate_limited
+    return collect
+
+
+def faq_collector(faq_router):
+    """FAQ fast path hits against lookups: the LLM load it removes"""
+    def collect():
+        yield "dp_faq_lookups_total", {}, faq_router.lookups
+        for intent, count in list(faq_router.hits.items()):
+            yield "dp_faq_hits_total", {"intent": intent}, count
+        yield "dp_faq_threshold", {}, faq_router.threshold
+    return collect
+
+
+def reranker_collector(reranker):
+    """How often reranking fits its budget, and how much it prunes"""
+    def collect():
+        for result, count in list(reranker.results.items()):
+            yield "dp_rerank_total", {"result": result}, count
+        yield "dp_rerank_dropped_chunks_total", {}, reranker.dropped
+        if reranker.seconds_per_pair is not None:
+            yield "dp_rerank_seconds_per_pair", {}, reranker.seconds_per_pair
+    return collect
+
+
+def start_metrics_server(registry, host="127.0.0.1", port=9108):
+    """Serve GET /metrics from a daemon thread; returns the server"""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # Scrapes would flood the Streamlit log
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="dp-metrics", daemon=True).start()
+    return server
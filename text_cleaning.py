@@ -0,0 +1,194 @@
+"""
+Digital Protection - Response Cleaning
+clean_response() cleans a finished answer; StreamingCleaner produces the same
+output while the answer streams in, touching only the new text each time.
+"""
+
+import re
+
+# Robotic labels, removed in this order (order matters: removing one label
+# can join the text around it into another)
+LABELS = ["Direct answer:", "Key Points:", "Key Considerations:", "Next Step:",
+          "Response:", "Answer:", "الاجابة:", "النقاط الرئيسية:", "الخطوة التالية:"]
+
+EMOJI_PATTERN = re.compile("["
+    u"\U0001F600-\U0001F64F"
+    u"\U0001F300-\U0001F5FF"
+    u"\U0001F680-\U0001F6FF"
+    u"\U0001F1E0-\U0001F1FF"
+    u"\U00002702-\U000027B0"
+    u"\U000024C2-\U0001F251"
+    "]+", flags=re.UNICODE)
+
+EXTRA_NEWLINES_PATTERN = re.compile(r"\n{3,}")
+NEWLINE_RUNS_PATTERN = re.compile(r"\n+|[^\n]+")
+
+
+ARABIC_OPEN = '<div class="arabic-text">'
+ARABIC_CLOSE = '</div>'
+
+
+def wrap_arabic(answer):
+    return f'{ARABIC_OPEN}{answer}{ARABIC_CLOSE}'
+
+
+def unwrap_arabic(answer):
+    """Undo wrap_arabic(), for clients that set the text direction themselves"""
+    if answer.startswith(ARABIC_OPEN) and answer.endswith(ARABIC_CLOSE):
+        return answer[len(ARABIC_OPEN):-len(ARABIC_CLOSE)]
+    return answer
+
+
+def clean_response(answer, is_arabic_response=False):
+    """Clean up the response text"""
+    # Remove robotic labels
+    for label in LABELS:
+        answer = answer.replace(label, "")
+
+    # Remove emojis
+    answer = EMOJI_PATTERN.sub('', answer)
+
+    # Clean whitespace: any run of 3+ newlines becomes 2
+    answer = EXTRA_NEWLINES_PATTERN.sub("\n\n", answer)
+
+    answer = answer.strip()
+
+    # Wrap Arabic in RTL div
+    if is_arabic_response:
+        answer = wrap_arabic(answer)
+
+    return answer
+
+
+# --- STREAMING STAGES ---
+# Each stage takes a piece of text and returns what it can safely emit,
+# holding back only what a later piece could still change.
+
+class _LabelStage:
+    """Streaming str.replace(label, "")"""
+
+    def __init__(self, label):
+        self.label = label
+        self.keep = len(label) - 1
+        self.pending = ""
+
+    def feed(self, text):
+        buffer = self.pending + text
+        out = []
+        start = 0
+        while True:
+            found = buffer.find(self.label, start)
+            if found < 0:
+                break
+            out.append(buffer[start:found])
+            start = found + len(self.label)
+        # Only the last len(label)-1 chars can still begin a match
+        tail = buffer[start:]
+        cut = max(0, len(tail) - self.keep)
+        out.append(tail[:cut])
+        self.pending = tail[cut:]
+        return "".join(out)
+
+    def flush(self):
+        pending, self.pending = self.pending, ""
+        return pending
+
+
+class _EmojiStage:
+    """Emoji removal is per character, so it needs no state"""
+
+    def feed(self, text):
+        return EMOJI_PATTERN.sub('', text)
+
+    def flush(self):
+        return ""
+
+
+class _NewlineStage:
+    """Streaming version of collapsing 3+ newlines to 2"""
+
+    def __init__(self):
+        self.run = 0  # Newlines emitted at the end of the output so far (max 2)
+
+    def feed(self, text):
+        out = []
+        for match in NEWLINE_RUNS_PATTERN.finditer(text):
+            segment = match.group()
+            if segment[0] == "\n":
+                allowed = min(self.run + len(segment), 2) - self.run
+                out.append("\n" * allowed)
+                self.run += allowed
+            else:
+                out.append(segment)
+                self.run = 0
+        return "".join(out)
+
+    def flush(self):
+        return ""
+
+
+class _StripStage:
+    """Streaming str.strip(): drop leading whitespace, hold back trailing"""
+
+    def __init__(self):
+        self.started = False
+        self.pending = ""
+
+    def feed(self, text):
+        text = self.pending + text
+        if not self.started:
+            text = text.lstrip()
+            if not text:
+                return ""
+            self.started = True
+        body = text.rstrip()
+        self.pending = text[len(body):]
+        return body
+
+    def flush(self):
+        self.pending = ""
+        return ""
+
+
+class StreamingCleaner:
+    """Incremental clean_response(): cost per delta doesn't grow with the answer
+
+    feed() each streamed delta (it returns the cleaned text to append), read
+    .text or display() only to render, and call finish() at the end. finish()
+    returns exactly clean_response(full_text, is_arabic).
+    """
+
+    def __init__(self, is_arabic_response=False):
+        self.is_arabic_response = is_arabic_response
+        self._stages = [_LabelStage(label) for label in LABELS]
+        self._stages += [_EmojiStage(), _NewlineStage(), _StripStage()]
+        self._parts = []
+        self._finished = False
+
+    def feed(self, delta):
+        for stage in self._stages:
+            delta = stage.feed(delta)
+        if delta:
+            self._parts.append(delta)
+        return delta
+
+    def finish(self):
+        if not self._finished:
+            text = ""
+            for stage in self._stages:
+                text = stage.feed(text) + stage.flush()
+            if text:
+                self._parts.append(text)
+            self._finished = True
+        return self.display()
+
+    @property
+    def text(self):
+        """Cleaned text so far (without the Arabic wrapper)"""
+        if len(self._parts) > 1:
+            self._parts[:] = ["".join(self._parts)]
+        return self._parts[0] if self._parts else ""
+
+    def display(self):
+        answer = self.text
+        return wrap_arabic(answer) if self.is_arabic_response else answer